@@ -1,21 +1,33 @@
 import streamlit as st
-from database import get_session, Usuario, ConfigSistema, Categoria, Transacao
-import bcrypt
+from database import unidade_de_trabalho, incrementar_versao_dados, executar_bootstrap, Usuario, Categoria
 import pandas as pd
 from datetime import datetime
 import json
+import os
+from backup import TABELAS_BACKUP, EXTENSOES, compressoes_disponiveis, gerar_backup_arquivo, abrir_backup, restaurar_backup
+from configuracao import listar_configs, definir_config, incrementar_versao_config, invalidar_cache_config
+from auditoria import EVENTOS_AUDITORIA, listar_auditoria, contar_auditoria, resumo_auditoria, aplicar_retencao_auditoria
+from paginacao import controles_paginacao, separar_pagina, navegacao_paginacao, reiniciar_paginacao
+from senhas import gerar_hash
+from manutencao import TAREFAS_MANUTENCAO, execucao_pendente, executar_manutencao
+from snapshots import snapshots_disponiveis, criar_snapshot, listar_snapshots, backup_automatico_ativo
 
 # Funções auxiliares
 def hash_password_local(password):
     """Função local para hash de senha"""
-    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+    return gerar_hash(password)
 
 # 1. Função para gerenciar usuários
 def gerenciar_usuarios():
     """Interface de gerenciamento de usuários"""
     st.subheader("👥 Gerenciamento de Usuários")
     
-    session = get_session()
+    # Leitura em sessão curta; cada ação abre sua própria transação
+    with unidade_de_trabalho() as session:
+        usuarios = session.query(
+            Usuario.id, Usuario.username, Usuario.email, Usuario.nivel_acesso,
+            Usuario.ativo, Usuario.created_at, Usuario.ultimo_login
+        ).order_by(Usuario.id).all()
     
     # Abas para diferentes funcionalidades
     tab1, tab2, tab3 = st.tabs(["📋 Listar Usuários", "➕ Criar Usuário", "⚙️ Editar/Excluir"])
@@ -23,9 +35,6 @@ def gerenciar_usuarios():
     with tab1:
         st.write("### Lista de Usuários do Sistema")
         
-        # Buscar todos os usuários
-        usuarios = session.query(Usuario).order_by(Usuario.id).all()
-        
         if not usuarios:
             st.info("Nenhum usuário cadastrado no sistema.")
         else:
@@ -112,8 +121,7 @@ def gerenciar_usuarios():
                     mensagens_erro.append("A senha deve ter pelo menos 6 caracteres")
                 
                 # Verificar se usuário já existe
-                usuario_existente = session.query(Usuario).filter_by(username=novo_username).first()
-                if usuario_existente:
+                if any(u.username == novo_username for u in usuarios):
                     mensagens_erro.append(f"O usuário '{novo_username}' já existe")
                 
                 if mensagens_erro:
@@ -121,7 +129,7 @@ def gerenciar_usuarios():
                         st.error(erro)
                 else:
                     try:
-                        # Criar novo usuário
+                        # Criar novo usuário (hash calculado antes de abrir a transação)
                         novo_usuario = Usuario(
                             username=novo_username,
                             password_hash=hash_password_local(nova_senha),
@@ -131,8 +139,8 @@ def gerenciar_usuarios():
                             created_at=datetime.utcnow()
                         )
                         
-                        session.add(novo_usuario)
-                        session.commit()
+                        with unidade_de_trabalho() as session:
+                            session.add(novo_usuario)
                         
                         st.success(f"✅ Usuário '{novo_username}' criado com sucesso!")
                         st.balloons()
@@ -141,20 +149,17 @@ def gerenciar_usuarios():
                         st.rerun()
                         
                     except Exception as e:
-                        session.rollback()
                         st.error(f"❌ Erro ao criar usuário: {str(e)}")
     
     with tab3:
         st.write("### Editar ou Excluir Usuários")
         
-        # Buscar usuários para edição
-        usuarios = session.query(Usuario).order_by(Usuario.username).all()
-        
         if not usuarios:
             st.info("Nenhum usuário para editar.")
         else:
             # Lista de usuários para seleção
-            usuarios_opcoes = {u.id: f"{u.username} ({u.nivel_acesso})" for u in usuarios}
+            usuarios_por_id = {u.id: u for u in sorted(usuarios, key=lambda u: u.username)}
+            usuarios_opcoes = {id_: f"{u.username} ({u.nivel_acesso})" for id_, u in usuarios_por_id.items()}
             
             usuario_id_selecionado = st.selectbox(
                 "Selecione um usuário para editar",
@@ -163,7 +168,7 @@ def gerenciar_usuarios():
             )
             
             if usuario_id_selecionado:
-                usuario = session.query(Usuario).filter_by(id=usuario_id_selecionado).first()
+                usuario = usuarios_por_id.get(usuario_id_selecionado)
                 
                 if usuario:
                     with st.form(f"form_editar_usuario_{usuario.id}"):
@@ -233,17 +238,12 @@ def gerenciar_usuarios():
                         # Processar ações
                         if salvar:
                             try:
-                                # Atualizar email
-                                if usuario.username != 'admin':
-                                    usuario.email = novo_email if novo_email.strip() else None
-                                
-                                # Atualizar nível de acesso
-                                if usuario.username != 'admin':
-                                    usuario.nivel_acesso = novo_nivel
-                                
-                                # Atualizar status
+                                alteracoes = {}
                                 if usuario.username != 'admin':
-                                    usuario.ativo = (novo_status == "Ativo")
+                                    # Atualizar email, nível de acesso e status
+                                    alteracoes[Usuario.email] = novo_email if novo_email.strip() else None
+                                    alteracoes[Usuario.nivel_acesso] = novo_nivel
+                                    alteracoes[Usuario.ativo] = (novo_status == "Ativo")
                                 
                                 # Atualizar senha se solicitado
                                 if alterar_senha and nova_senha_usuario and confirmar_senha_usuario:
@@ -252,32 +252,35 @@ def gerenciar_usuarios():
                                     elif len(nova_senha_usuario) < 6:
                                         st.error("A senha deve ter pelo menos 6 caracteres")
                                     else:
-                                        usuario.password_hash = hash_password_local(nova_senha_usuario)
+                                        alteracoes[Usuario.password_hash] = hash_password_local(nova_senha_usuario)
                                         st.success("Senha atualizada com sucesso!")
                                 
-                                session.commit()
+                                if alteracoes:
+                                    with unidade_de_trabalho() as session:
+                                        session.query(Usuario).filter_by(id=usuario.id).update(
+                                            alteracoes, synchronize_session=False
+                                        )
                                 st.success("✅ Alterações salvas com sucesso!")
                                 st.rerun()
                                 
                             except Exception as e:
-                                session.rollback()
                                 st.error(f"❌ Erro ao salvar alterações: {str(e)}")
                         
                         if 'desativar' in locals() and desativar:
                             if usuario.username != 'admin':
-                                usuario.ativo = not usuario.ativo
-                                session.commit()
-                                st.success(f"✅ Usuário {'desativado' if not usuario.ativo else 'ativado'}!")
+                                with unidade_de_trabalho() as session:
+                                    session.query(Usuario).filter_by(id=usuario.id).update(
+                                        {Usuario.ativo: not usuario.ativo}, synchronize_session=False
+                                    )
+                                st.success(f"✅ Usuário {'desativado' if usuario.ativo else 'ativado'}!")
                                 st.rerun()
                         
                         if 'excluir' in locals() and excluir:
                             if usuario.username != 'admin' and usuario.username != st.session_state.get('username', ''):
-                                session.delete(usuario)
-                                session.commit()
+                                with unidade_de_trabalho() as session:
+                                    session.query(Usuario).filter_by(id=usuario.id).delete(synchronize_session=False)
                                 st.success("✅ Usuário excluído com sucesso!")
                                 st.rerun()
-    
-    session.close()
 
 # 2. Função para gerenciar categorias
 def gerenciar_categorias():
@@ -289,7 +292,12 @@ def gerenciar_categorias():
     Crie e gerencie suas próprias categorias para classificação automática de transações.
     """)
     
-    session = get_session()
+    with unidade_de_trabalho() as session:
+        categorias = session.query(
+            Categoria.id, Categoria.nome, Categoria.tipo, Categoria.palavras_chave
+        ).filter(
+            Categoria.usuario_id == st.session_state.user_id
+        ).order_by(Categoria.nome).all()
     
     # Abas para funcionalidades
     tab1, tab2 = st.tabs(["📋 Minhas Categorias", "➕ Criar Nova Categoria"])
@@ -297,11 +305,6 @@ def gerenciar_categorias():
     with tab1:
         st.write("### Suas Categorias Personalizadas")
         
-        # Buscar categorias do usuário atual
-        categorias = session.query(Categoria).filter(
-            Categoria.usuario_id == st.session_state.user_id
-        ).order_by(Categoria.nome).all()
-        
         if not categorias:
             st.info("Você ainda não criou categorias personalizadas.")
         else:
@@ -320,8 +323,10 @@ def gerenciar_categorias():
                             st.session_state['editando_categoria_id'] = categoria.id
                         
                         if st.button("🗑️ Excluir", key=f"del_{categoria.id}"):
-                            session.delete(categoria)
-                            session.commit()
+                            with unidade_de_trabalho() as session:
+                                session.query(Categoria).filter_by(id=categoria.id).delete(synchronize_session=False)
+                                # As categorias entram no relatório JSON em cache
+                                incrementar_versao_dados(session, st.session_state.user_id)
                             st.success(f"Categoria '{categoria.nome}' excluída!")
                             st.rerun()
         
@@ -375,44 +380,33 @@ def gerenciar_categorias():
                 else:
                     try:
                         # Verificar se categoria já existe para este usuário
-                        categoria_existente = session.query(Categoria).filter(
-                            Categoria.usuario_id == st.session_state.user_id,
-                            Categoria.nome == nome_categoria
-                        ).first()
-                        
-                        if categoria_existente:
+                        if any(c.nome == nome_categoria for c in categorias):
                             st.error(f"Você já tem uma categoria com o nome '{nome_categoria}'")
                         else:
                             # Criar nova categoria
-                            nova_categoria = Categoria(
-                                usuario_id=st.session_state.user_id,
-                                nome=nome_categoria,
-                                tipo=tipo_categoria,
-                                palavras_chave=palavras_chave
-                            )
-                            
-                            session.add(nova_categoria)
-                            session.commit()
+                            with unidade_de_trabalho() as session:
+                                session.add(Categoria(
+                                    usuario_id=st.session_state.user_id,
+                                    nome=nome_categoria,
+                                    tipo=tipo_categoria,
+                                    palavras_chave=palavras_chave
+                                ))
+                                incrementar_versao_dados(session, st.session_state.user_id)
                             
                             st.success(f"✅ Categoria '{nome_categoria}' criada com sucesso!")
                             st.balloons()
                             st.rerun()
                             
                     except Exception as e:
-                        session.rollback()
                         st.error(f"❌ Erro ao criar categoria: {str(e)}")
-    
-    session.close()
 
 # 3. Função para configurações do sistema
 def configurar_sistema():
     """Configurações do sistema"""
     st.subheader("⚙️ Configurações do Sistema")
     
-    session = get_session()
-    
-    # Buscar configurações existentes
-    configs = session.query(ConfigSistema).order_by(ConfigSistema.chave).all()
+    # Configurações em cache (uma consulta só quando alguma configuração mudar)
+    configs = listar_configs()
     
     if configs:
         st.write("### Configurações Atuais do Sistema")
@@ -422,22 +416,21 @@ def configurar_sistema():
                 col1, col2, col3 = st.columns([3, 2, 1])
                 
                 with col1:
-                    st.write(f"**{config.chave}**")
-                    st.caption(config.descricao)
+                    st.write(f"**{config['chave']}**")
+                    st.caption(config['descricao'])
                 
                 with col2:
                     novo_valor = st.text_input(
                         "Valor",
-                        value=config.valor,
-                        key=f"input_{config.id}",
+                        value=config['valor'],
+                        key=f"input_{config['chave']}",
                         label_visibility="collapsed"
                     )
                 
                 with col3:
-                    if st.button("💾", key=f"save_{config.id}"):
-                        config.valor = novo_valor
-                        session.commit()
-                        st.success(f"Configuração '{config.chave}' atualizada!")
+                    if st.button("💾", key=f"save_{config['chave']}"):
+                        definir_config(config['chave'], novo_valor)
+                        st.success(f"Configuração '{config['chave']}' atualizada!")
                         st.rerun()
                 
                 st.divider()
@@ -475,77 +468,153 @@ def configurar_sistema():
 
     confirm = st.checkbox("Confirmo que quero zerar o banco de dados")
     if confirm and st.button("🗑️ APAGAR TUDO", type="primary", use_container_width=True):
-        session = get_session()
         try:
             from sqlalchemy import text
-            session.execute(text("DELETE FROM transacoes"))
-            session.execute(text("DELETE FROM categorias"))
-            session.execute(text("DELETE FROM usuarios"))
-            session.execute(text("DELETE FROM config_sistema"))
-            session.commit()
+            with unidade_de_trabalho() as session:
+                # Antes dos DELETEs: a forma global também cria a versão de quem ainda não tinha
+                incrementar_versao_dados(session)
+                session.execute(text("DELETE FROM transacoes"))
+                session.execute(text("DELETE FROM parcelas_previstas"))
+                session.execute(text("DELETE FROM marcas_exportacao"))
+                session.execute(text("DELETE FROM execucoes_manutencao"))
+                session.execute(text("DELETE FROM cache_classificacao_usuario"))
+                session.execute(text("DELETE FROM estatisticas_classificacao"))
+                session.execute(text("DELETE FROM categorias"))
+                session.execute(text("DELETE FROM usuarios"))
+                session.execute(text("DELETE FROM config_sistema"))
+                incrementar_versao_config(session)
+            # Recria configurações padrão e o admin inicial
+            with unidade_de_trabalho() as session:
+                executar_bootstrap(session)
+            invalidar_cache_config()
             st.success("✅ Banco zerado com sucesso!")
             st.rerun()
         except Exception as e:
-            session.rollback()
             st.error(f"❌ Erro ao zerar banco: {e}")
-        finally:
-            session.close()
 
     st.divider()
     st.write("### 🔧 Correções de Dados (TEMPORÁRIO)")
-    if st.button("🧾 Corrigir tipo para cartão de crédito", use_container_width=True):
-        session = get_session()
+    st.caption("As correções são aplicadas em blocos com commit a cada bloco; se forem interrompidas, podem ser retomadas de onde pararam.")
+    _botao_manutencao('corrigir_tipo_cartao')
+    _botao_manutencao('recalcular_competencia')
+
+    if st.button("🧮 Reconstruir grupos de compra e cronograma de parcelas", use_container_width=True):
         try:
-            from sqlalchemy import text
-            session.execute(text("UPDATE transacoes SET tipo='DEBITO' WHERE centro_custo LIKE 'Cartao Credito%' AND valor > 0"))
-            session.execute(text("UPDATE transacoes SET tipo='CREDITO' WHERE centro_custo LIKE 'Cartao Credito%' AND valor < 0"))
-            session.commit()
-            st.success("✅ Tipos atualizados para transações de cartão.")
-            st.rerun()
+            from parcelas import reconstruir_cronograma
+            total = reconstruir_cronograma()
+            st.success(f"✅ Cronograma reconstruído: {total} parcelas previstas.")
         except Exception as e:
-            session.rollback()
-            st.error(f"❌ Erro ao corrigir tipos: {e}")
-        finally:
-            session.close()
+            st.error(f"❌ Erro ao reconstruir cronograma: {e}")
 
-    if st.button("🗓️ Recalcular datas de competência (parcelas)", use_container_width=True):
-        session = get_session()
+    _botao_manutencao('corrigir_sinais')
+    _botao_manutencao('normalizar_descricoes')
+
+    st.divider()
+    st.write("### 🧠 Classificador Local")
+    st.caption("Treinado com as categorias manuais (um modelo por usuário e um global). "
+               "É atualizado a cada importação; use o botão para refazer o treino do zero.")
+    if st.button("🧠 Retreinar classificador local", use_container_width=True):
         try:
-            from sqlalchemy import text
-            # Ajusta data_competencia = data_compra + (parcela_atual-1) meses e data = data_competencia
-            session.execute(text("""
-                UPDATE transacoes
-                SET data_competencia = (data_compra + (interval '1 month' * (parcela_atual - 1))),
-                    data = (data_compra + (interval '1 month' * (parcela_atual - 1)))
-                WHERE parcelamento = true AND parcela_atual IS NOT NULL AND data_compra IS NOT NULL
-            """))
-            session.execute(text("UPDATE transacoes SET data_competencia = data WHERE data_competencia IS NULL"))
-            session.execute(text("UPDATE transacoes SET data_compra = data WHERE data_compra IS NULL"))
-            session.commit()
-            st.success("✅ Datas de competência recalculadas.")
-            st.rerun()
+            from classificador_local import disponivel, retreinar_modelos
+            if not disponivel():
+                st.error("❌ scipy não está instalado.")
+            else:
+                with st.spinner("Treinando..."):
+                    modelos = retreinar_modelos()
+                st.success(f"✅ {len(modelos)} modelos treinados ({modelos.get('global', 0)} rótulos no global).")
         except Exception as e:
-            session.rollback()
-            st.error(f"❌ Erro ao recalcular datas: {e}")
-        finally:
-            session.close()
+            st.error(f"❌ Erro ao treinar classificador local: {e}")
+
+def _botao_manutencao(tarefa):
+    """Botão de uma correção em blocos, com barra de progresso e retomada"""
+    rotulo = TAREFAS_MANUTENCAO[tarefa][0]
+    pendente = execucao_pendente(tarefa)
+    if pendente:
+        st.caption(
+            f"⏸️ Execução anterior interrompida em {pendente['processadas']:,} de {pendente['total']:,} transações"
+            .replace(',', '.') + (f" (erro: {pendente['erro']})" if pendente['erro'] else "")
+        )
+    if st.button(f"{rotulo} (retomar)" if pendente else rotulo, use_container_width=True, key=f"manutencao_{tarefa}"):
+        barra = st.progress(0.0, text=f"{rotulo}: iniciando...")
+
+        def progresso(estado):
+            fracao = estado['processadas'] / estado['total'] if estado['total'] else 1.0
+            barra.progress(min(fracao, 1.0), text=f"{rotulo}: {estado['processadas']:,} de {estado['total']:,} transações".replace(',', '.'))
 
-    if st.button("🔁 Corrigir sinais (débito negativo / crédito positivo)", use_container_width=True):
-        session = get_session()
         try:
-            from sqlalchemy import text
-            session.execute(text("UPDATE transacoes SET valor = -ABS(valor) WHERE tipo='DEBITO' AND valor > 0"))
-            session.execute(text("UPDATE transacoes SET valor = ABS(valor) WHERE tipo='CREDITO' AND valor < 0"))
-            session.commit()
-            st.success("✅ Sinais corrigidos.")
-            st.rerun()
+            estado = executar_manutencao(tarefa, progresso=progresso)
+            barra.progress(1.0, text=f"{rotulo}: concluído")
+            st.success(f"✅ Correção concluída: {estado['alteradas']} transações alteradas.")
         except Exception as e:
-            session.rollback()
-            st.error(f"❌ Erro ao corrigir sinais: {e}")
-        finally:
-            session.close()
+            st.error(f"❌ Erro na correção (o progresso foi salvo; clique novamente para retomar): {e}")
+
+def visualizar_auditoria():
+    """Eventos de auditoria (logins) com filtros e paginação"""
+    st.subheader("📜 Auditoria")
+    
+    with unidade_de_trabalho() as session:
+        usuarios = {u.id: u.username for u in session.query(Usuario.id, Usuario.username).order_by(Usuario.username)}
+    
+    col1, col2 = st.columns(2)
+    with col1:
+        filtro_usuario = st.selectbox(
+            "Usuário", [None] + list(usuarios),
+            format_func=lambda u: "Todos" if u is None else usuarios[u],
+            key="auditoria_usuario", on_change=reiniciar_paginacao, args=("auditoria",)
+        )
+    with col2:
+        filtro_evento = st.selectbox(
+            "Evento", [None] + list(EVENTOS_AUDITORIA),
+            format_func=lambda e: "Todos" if e is None else EVENTOS_AUDITORIA[e],
+            key="auditoria_evento", on_change=reiniciar_paginacao, args=("auditoria",)
+        )
     
-    session.close()
+    total = contar_auditoria(filtro_usuario, filtro_evento)
+    cursor, tamanho = controles_paginacao("auditoria", total)
+    linhas = listar_auditoria(cursor, tamanho, filtro_usuario, filtro_evento)
+    pagina, proximo_cursor = separar_pagina(linhas, tamanho, chave=lambda linha: (linha.ts, linha.id))
+    
+    if pagina:
+        st.dataframe(
+            pd.DataFrame([
+                {
+                    'Data/Hora (UTC)': linha.ts.strftime('%d/%m/%Y %H:%M:%S'),
+                    'Usuário': usuarios.get(linha.usuario_id, '-'),
+                    'Evento': EVENTOS_AUDITORIA.get(linha.evento, linha.evento),
+                    'Detalhe': linha.detalhe or ''
+                }
+                for linha in pagina
+            ]),
+            use_container_width=True,
+            hide_index=True
+        )
+    else:
+        st.info("Nenhum evento registrado.")
+    navegacao_paginacao("auditoria", proximo_cursor)
+    
+    with st.expander("📆 Resumo diário dos eventos antigos", expanded=False):
+        st.caption("Eventos com mais de AUDITORIA_RETENCAO_DIAS dias são agregados em contagens diárias.")
+        resumo = resumo_auditoria(filtro_usuario)
+        if resumo:
+            st.dataframe(
+                pd.DataFrame([
+                    {
+                        'Dia': r['dia'],
+                        'Usuário': usuarios.get(r['usuario_id'], '-'),
+                        'Evento': EVENTOS_AUDITORIA.get(r['evento'], r['evento']),
+                        'Quantidade': r['quantidade']
+                    }
+                    for r in resumo
+                ]),
+                use_container_width=True,
+                hide_index=True
+            )
+        if st.button("🧹 Aplicar retenção agora", use_container_width=True):
+            try:
+                removidos = aplicar_retencao_auditoria()
+                st.success(f"✅ {removidos} eventos agregados no resumo diário.")
+            except Exception as e:
+                st.error(f"❌ Erro ao aplicar retenção: {e}")
 
 # 4. Função para backup de dados
 def backup_dados():
@@ -558,10 +627,11 @@ def backup_dados():
     Recomendado realizar backup mensalmente.
     """)
     
-    session = get_session()
-    
-    # Abas para exportar/importar
-    tab1, tab2 = st.tabs(["📤 Exportar Backup", "📥 Restaurar Backup"])
+    # Abas para exportar/importar (snapshots do banco apenas para admin)
+    abas = ["📤 Exportar Backup", "📥 Restaurar Backup"]
+    if st.session_state.get('is_admin', False):
+        abas.append("🗄️ Snapshots do Banco")
+    tab1, tab2, *tab_snapshots = st.tabs(abas)
     
     with tab1:
         st.write("### Exportar Dados para Backup")
@@ -573,146 +643,97 @@ def backup_dados():
             default=["Transações", "Categorias"]
         )
         
+        if not st.session_state.get('is_admin', False):
+            backup_opcoes = [item for item in backup_opcoes if not TABELAS_BACKUP[item][2]]
+        
+        compressao = st.radio("Compressão", compressoes_disponiveis(), horizontal=True, key="backup_compressao")
+        
         if st.button("⬇️ Gerar Backup Completo", type="primary", use_container_width=True):
             with st.spinner("Coletando dados e gerando backup..."):
                 try:
-                    dados_backup = {
-                        'metadata': {
-                            'data_backup': datetime.now().isoformat(),
-                            'usuario': st.session_state.username,
-                            'usuario_id': st.session_state.user_id,
-                            'itens_incluidos': backup_opcoes
-                        }
-                    }
-                    
-                    # Coletar dados conforme selecionado
-                    if "Usuários" in backup_opcoes and st.session_state.get('is_admin', False):
-                        usuarios = session.query(Usuario).all()
-                        dados_backup['usuarios'] = [
-                            {
-                                'id': u.id,
-                                'username': u.username,
-                                'email': u.email,
-                                'nivel_acesso': u.nivel_acesso,
-                                'ativo': u.ativo,
-                                'created_at': u.created_at.isoformat() if u.created_at else None,
-                                'ultimo_login': u.ultimo_login.isoformat() if u.ultimo_login else None
-                            }
-                            for u in usuarios
-                        ]
-                    
-                    if "Transações" in backup_opcoes:
-                        transacoes = session.query(Transacao).filter_by(
-                            usuario_id=st.session_state.user_id
-                        ).all()
-                        
-                        dados_backup['transacoes'] = [
-                            {
-                                'id': t.id,
-                                'data': t.data.isoformat() if t.data else None,
-                                'descricao': t.descricao,
-                                'valor': float(t.valor),
-                                'tipo': t.tipo,
-                                'banco': t.banco,
-                                'categoria_ia': t.categoria_ia,
-                                'categoria_manual': t.categoria_manual,
-                                'parcelamento': t.parcelamento,
-                                'parcela_atual': t.parcela_atual,
-                                'parcela_total': t.parcela_total,
-                                'data_vencimento': t.data_vencimento.isoformat() if t.data_vencimento else None,
-                                'processado': t.processado
-                            }
-                            for t in transacoes
-                        ]
-                    
-                    if "Categorias" in backup_opcoes:
-                        categorias = session.query(Categoria).filter_by(
-                            usuario_id=st.session_state.user_id
-                        ).all()
-                        
-                        dados_backup['categorias'] = [
-                            {
-                                'id': c.id,
-                                'nome': c.nome,
-                                'palavras_chave': c.palavras_chave,
-                                'tipo': c.tipo
-                            }
-                            for c in categorias
-                        ]
-                    
-                    if "Configurações do Sistema" in backup_opcoes and st.session_state.get('is_admin', False):
-                        configs = session.query(ConfigSistema).all()
-                        dados_backup['configuracoes'] = [
-                            {
-                                'id': c.id,
-                                'chave': c.chave,
-                                'valor': c.valor,
-                                'descricao': c.descricao
-                            }
-                            for c in configs
-                        ]
-                    
-                    # Converter para JSON
-                    backup_json = json.dumps(dados_backup, indent=2, ensure_ascii=False, default=str)
-                    
-                    # Nome do arquivo
-                    nome_arquivo = f"backup_financeiro_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
-                    
-                    # Botão de download
-                    st.download_button(
-                        label="📥 Baixar Arquivo de Backup",
-                        data=backup_json,
-                        file_name=nome_arquivo,
-                        mime="application/json",
-                        use_container_width=True,
-                        icon="💾"
+                    # Só o último backup gerado nesta sessão fica no disco
+                    anterior = st.session_state.pop('backup_gerado', None)
+                    if anterior and os.path.exists(anterior['caminho']):
+                        os.remove(anterior['caminho'])
+                    caminho, contagem = gerar_backup_arquivo(
+                        st.session_state.user_id,
+                        backup_opcoes,
+                        compressao,
+                        metadata={'usuario': st.session_state.username, 'usuario_id': st.session_state.user_id}
                     )
+                    st.session_state['backup_gerado'] = {
+                        'caminho': caminho,
+                        'nome': f"backup_financeiro_{datetime.now().strftime('%Y%m%d_%H%M%S')}{EXTENSOES[compressao]}",
+                        'mime': "application/gzip" if compressao == 'gzip' else "application/zstd"
+                    }
                     
                     st.success("✅ Backup gerado com sucesso!")
-                    st.info(f"O backup inclui: {', '.join(backup_opcoes)}")
+                    st.info("O backup inclui: " + ", ".join(f"{tabela} ({linhas})" for tabela, linhas in contagem.items()))
                     
                 except Exception as e:
                     st.error(f"❌ Erro ao gerar backup: {str(e)}")
+        
+        gerado = st.session_state.get('backup_gerado')
+        if gerado and os.path.exists(gerado['caminho']):
+            def ler_backup_gerado():
+                # Chamado pelo Streamlit só no clique: o arquivo não é lido ao renderizar
+                with open(gerado['caminho'], 'rb') as arquivo:
+                    return arquivo.read()
+            
+            st.download_button(
+                label="📥 Baixar Arquivo de Backup",
+                data=ler_backup_gerado,
+                file_name=gerado['nome'],
+                mime=gerado['mime'],
+                use_container_width=True,
+                icon="💾"
+            )
     
     with tab2:
         st.write("### Restaurar Dados do Backup")
         
-        st.warning("⚠️ **Atenção:** A restauração de backup substituirá seus dados atuais. Use com cuidado!")
+        st.warning("⚠️ **Atenção:** no modo substituir, suas transações e categorias atuais são apagadas antes da restauração. Use com cuidado!")
         
         # Upload do arquivo de backup
         uploaded_file = st.file_uploader(
-            "Selecione o arquivo de backup (.json)",
-            type=['json'],
+            "Selecione o arquivo de backup (.ndjson.gz, .ndjson.zst ou .json antigo)",
+            type=['gz', 'zst', 'json'],
             help="Selecione um arquivo de backup gerado anteriormente"
         )
         
         if uploaded_file:
             try:
-                # Ler e mostrar preview do backup
-                dados_backup = json.load(uploaded_file)
+                # Apenas o cabeçalho é lido para o preview; os dados são lidos em streaming na restauração
+                texto = abrir_backup(uploaded_file)
+                primeira_linha = texto.readline()
+                try:
+                    cabecalho = json.loads(primeira_linha)
+                except json.JSONDecodeError:
+                    cabecalho = {}
+                texto.detach()
+                uploaded_file.seek(0)
                 
                 st.success("✅ Arquivo de backup carregado com sucesso!")
                 
-                # Mostrar informações do backup
-                with st.expander("📋 Visualizar conteúdo do backup", expanded=False):
-                    st.json(dados_backup)
-                
                 # Informações do backup
-                if 'metadata' in dados_backup:
-                    metadata = dados_backup['metadata']
+                if cabecalho.get('formato') == 'backup_financeiro':
+                    metadata = cabecalho.get('metadata', {})
                     st.info(f"""
                     **Informações do Backup:**
-                    - Data do backup: {metadata.get('data_backup', 'Desconhecida')}
+                    - Data do backup: {cabecalho.get('data_backup', 'Desconhecida')}
                     - Usuário original: {metadata.get('usuario', 'Desconhecido')}
-                    - Itens incluídos: {', '.join(metadata.get('itens_incluidos', []))}
+                    - Versão do esquema: {cabecalho.get('versao_esquema')}
+                    - Itens incluídos: {', '.join(cabecalho.get('itens_incluidos', []))}
                     """)
+                else:
+                    st.info("Backup no formato JSON antigo.")
                 
                 # Opção para restaurar
                 st.divider()
                 st.write("### 🔄 Restaurar Backup")
                 
                 if st.session_state.get('is_admin', False):
-                    opcoes_restaurar = ["Transações", "Categorias", "Configurações do Sistema"]
+                    opcoes_restaurar = ["Transações", "Categorias", "Configurações do Sistema", "Usuários"]
                 else:
                     opcoes_restaurar = ["Transações", "Categorias"]
                 
@@ -721,43 +742,106 @@ def backup_dados():
                     opcoes_restaurar,
                     default=["Transações", "Categorias"]
                 )
+                modo = st.radio(
+                    "Modo",
+                    ["Mesclar (mantém os dados atuais e adiciona o que falta)", "Substituir (apaga os dados atuais do usuário)"],
+                    key="modo_restauracao"
+                )
                 
                 # Confirmação
-                confirmar = st.checkbox("⚠️ Confirmo que quero substituir meus dados atuais pelos dados do backup")
+                confirmar = st.checkbox("⚠️ Confirmo que quero restaurar os dados do backup")
                 
                 if confirmar and itens_restaurar:
                     if st.button("🔄 Iniciar Restauração", type="primary", use_container_width=True):
                         with st.spinner("Restaurando dados do backup..."):
                             try:
-                                # Aqui você implementaria a lógica de restauração
-                                # Por segurança, vamos apenas informar que funcionaria
-                                st.success("✅ Restauração iniciada com sucesso!")
-                                st.info(f"Os seguintes itens serão restaurados: {', '.join(itens_restaurar)}")
-                                
-                                # Em um sistema real, aqui você implementaria:
-                                # 1. Backup dos dados atuais antes da restauração
-                                # 2. Limpeza dos dados atuais (se necessário)
-                                # 3. Importação dos dados do backup
-                                # 4. Validação dos dados importados
-                                
-                                st.warning("""
-                                **Nota de Segurança:**
-                                Em um ambiente de produção, a restauração completa requer
-                                implementação adicional para garantir a integridade dos dados
-                                e evitar perdas acidentais.
-                                """)
-                                
+                                resultado = restaurar_backup(
+                                    uploaded_file,
+                                    st.session_state.user_id,
+                                    itens_restaurar,
+                                    modo='substituir' if modo.startswith("Substituir") else 'mesclar',
+                                    admin=st.session_state.get('is_admin', False)
+                                )
+                                st.success("✅ Restauração concluída!")
+                                st.dataframe(
+                                    pd.DataFrame([
+                                        {'Tabela': tabela, 'Inseridas': r['inseridas'], 'Rejeitadas': r['rejeitadas']}
+                                        for tabela, r in resultado.items()
+                                    ]),
+                                    use_container_width=True,
+                                    hide_index=True
+                                )
                             except Exception as e:
-                                st.error(f"❌ Erro durante a restauração: {str(e)}")
+                                st.error(f"❌ Erro durante a restauração (nada foi alterado): {str(e)}")
                 elif not confirmar and itens_restaurar:
                     st.info("Marque a caixa de confirmação para habilitar a restauração.")
                     
-            except json.JSONDecodeError:
-                st.error("❌ O arquivo selecionado não é um JSON válido.")
             except Exception as e:
                 st.error(f"❌ Erro ao processar o arquivo de backup: {str(e)}")
     
-    session.close()
+    if tab_snapshots:
+        with tab_snapshots[0]:
+            painel_snapshots()
+
+def painel_snapshots():
+    """Snapshots online do banco SQLite (manual e automático)"""
+    st.write("### Snapshots do Banco SQLite")
+    
+    if not snapshots_disponiveis():
+        st.info("Snapshots online só estão disponíveis quando o sistema usa um banco SQLite em arquivo.")
+        return
+    
+    if backup_automatico_ativo():
+        st.success("🕒 Backup automático ativo (intervalo em BACKUP_INTERVALO_HORAS, retenção em SNAPSHOT_RETENCAO).")
+    else:
+        st.info("Backup automático desativado. Defina BACKUP_AUTOMATICO = true nas Configurações para ativar.")
+    
+    if st.button("📸 Criar Snapshot Agora", type="primary", use_container_width=True):
+        with st.spinner("Copiando o banco de dados..."):
+            try:
+                resultado = criar_snapshot()
+                st.success(
+                    f"✅ Snapshot {resultado['arquivo']} criado em {resultado['duracao']:.1f}s "
+                    f"({resultado['tamanho'] / 1024 / 1024:.1f} MB, integridade verificada)"
+                )
+                if resultado['removidos']:
+                    st.info("Snapshots antigos removidos: " + ", ".join(resultado['removidos']))
+            except Exception as e:
+                st.error(f"❌ Erro ao criar snapshot: {str(e)}")
+    
+    snapshots = listar_snapshots()
+    if not snapshots:
+        st.info("Nenhum snapshot gerado ainda.")
+        return
+    
+    st.dataframe(
+        pd.DataFrame([
+            {
+                'Arquivo': s['arquivo'],
+                'Criado em': s['criado_em'].strftime('%d/%m/%Y %H:%M:%S'),
+                'Tamanho (MB)': round(s['tamanho'] / 1024 / 1024, 2)
+            }
+            for s in snapshots
+        ]),
+        use_container_width=True,
+        hide_index=True
+    )
+    
+    escolhido = st.selectbox("Snapshot para download", [s['arquivo'] for s in snapshots], key="snapshot_download")
+    caminho = next(s['caminho'] for s in snapshots if s['arquivo'] == escolhido)
+
+    def ler_snapshot():
+        # Chamado pelo Streamlit só no clique: renderizar a página não lê o arquivo
+        with open(caminho, 'rb') as arquivo:
+            return arquivo.read()
+
+    st.download_button(
+        label="📥 Baixar Snapshot",
+        data=ler_snapshot,
+        file_name=escolhido,
+        mime="application/vnd.sqlite3",
+        use_container_width=True
+    )
 
 # Exportar as funções
-__all__ = ['gerenciar_usuarios', 'gerenciar_categorias', 'configurar_sistema', 'backup_dados']
+__all__ = ['gerenciar_usuarios', 'gerenciar_categorias', 'configurar_sistema', 'visualizar_auditoria', 'backup_dados']
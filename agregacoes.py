@@ -0,0 +1,399 @@
+import datetime
+import pandas as pd
+from sqlalchemy import func, case, and_, or_
+from database import get_session, Transacao, VersaoDados, EstatisticasClassificacao
+
+CATEGORIA_PADRAO = 'NÃO CLASSIFICADA'
+CENTRO_PADRAO = 'Não informado'
+
+def expressao_data(fluxo):
+    """Coluna de data usada na visualização conforme o fluxo escolhido"""
+    if fluxo == "Fluxo de Caixa":
+        return func.coalesce(Transacao.data_compra, Transacao.data)
+    return func.coalesce(Transacao.data_competencia, Transacao.data)
+
+def expressao_categoria():
+    """Categoria exibida no dashboard (apenas categoria da IA)"""
+    return func.coalesce(Transacao.categoria_ia, CATEGORIA_PADRAO)
+
+def expressao_mes(coluna, dialeto):
+    """Chave 'YYYY-MM' portável entre SQLite e Postgres"""
+    if dialeto == 'sqlite':
+        return func.strftime('%Y-%m', coluna)
+    return func.to_char(coluna, 'YYYY-MM')
+
+def montar_condicoes(usuario_id, filtros):
+    """Converte o estado dos filtros do dashboard em condições SQL"""
+    data_vis = expressao_data(filtros.get('fluxo'))
+    condicoes = [Transacao.usuario_id == usuario_id]
+
+    if filtros.get('periodo_meses'):
+        data_inicio = datetime.datetime.now() - datetime.timedelta(days=filtros['periodo_meses'] * 30)
+        condicoes.append(Transacao.data >= data_inicio)
+    if filtros.get('data_inicio'):
+        inicio = datetime.datetime.combine(filtros['data_inicio'], datetime.time.min)
+        condicoes.append(data_vis >= inicio)
+    if filtros.get('data_fim'):
+        fim = datetime.datetime.combine(filtros['data_fim'] + datetime.timedelta(days=1), datetime.time.min)
+        condicoes.append(data_vis < fim)
+    if filtros.get('banco', 'Todos') != 'Todos':
+        condicoes.append(Transacao.banco == filtros['banco'])
+    if filtros.get('categoria', 'Todas') != 'Todas':
+        condicoes.append(expressao_categoria() == filtros['categoria'])
+    if filtros.get('centro_custo', 'Todos') != 'Todos':
+        condicoes.append(func.coalesce(Transacao.centro_custo, CENTRO_PADRAO) == filtros['centro_custo'])
+    if filtros.get('tipo', 'Todos') != 'Todos':
+        condicoes.append(Transacao.tipo == filtros['tipo'])
+    if filtros.get('valor_min'):
+        condicoes.append(func.abs(Transacao.valor) >= filtros['valor_min'])
+
+    return condicoes
+
+def aplicar_filtros_pandas(df, filtros):
+    """Mesmos filtros de montar_condicoes sobre o DataFrame de carregar_dados (fallback)
+
+    O período em meses já vem aplicado por carregar_dados; acrescenta a
+    coluna Data_Vis conforme o fluxo.
+    """
+    df = df.copy()
+    df['Data_Vis'] = df['Data_Compra'] if filtros.get('fluxo') == "Fluxo de Caixa" else df['Data']
+    if df.empty:
+        return df
+    if filtros.get('data_inicio'):
+        df = df[df['Data_Vis'].dt.date >= filtros['data_inicio']]
+    if filtros.get('data_fim'):
+        df = df[df['Data_Vis'].dt.date <= filtros['data_fim']]
+    if filtros.get('banco', 'Todos') != 'Todos':
+        df = df[df['Banco'] == filtros['banco']]
+    if filtros.get('categoria', 'Todas') != 'Todas':
+        df = df[df['Categoria'] == filtros['categoria']]
+    if filtros.get('centro_custo', 'Todos') != 'Todos':
+        df = df[df['Centro_Custo'].fillna(CENTRO_PADRAO) == filtros['centro_custo']]
+    if filtros.get('tipo', 'Todos') != 'Todos':
+        df = df[df['Tipo'] == filtros['tipo']]
+    if filtros.get('valor_min'):
+        df = df[df['Valor_Absoluto'] >= filtros['valor_min']]
+    return df
+
+def calcular_limites_periodo(usuario_id, periodo_meses):
+    """Quantidade de transações e limites de data do período, sem carregar as linhas
+
+    Retorna 'total', 'datas' ({fluxo: (mínima, máxima)}) e 'cartao_max'
+    (última data de competência de cartão de crédito, ou None), usados
+    para montar o filtro de período do dashboard.
+    """
+    session = get_session()
+    try:
+        caixa = expressao_data("Fluxo de Caixa")
+        competencia = expressao_data("Fluxo de Competência")
+        eh_cartao = Transacao.centro_custo.like('Cartao Credito%')
+        total, caixa_min, caixa_max, competencia_min, competencia_max, cartao_max = session.query(
+            func.count(Transacao.id),
+            func.min(caixa), func.max(caixa),
+            func.min(competencia), func.max(competencia),
+            func.max(case((eh_cartao, competencia)))
+        ).filter(*montar_condicoes(usuario_id, {'periodo_meses': periodo_meses})).one()
+        return {
+            'total': int(total or 0),
+            'datas': {
+                "Fluxo de Caixa": (caixa_min, caixa_max),
+                "Fluxo de Competência": (competencia_min, competencia_max)
+            },
+            'cartao_max': cartao_max
+        }
+    finally:
+        session.close()
+
+def calcular_limites_periodo_pandas(df):
+    if df.empty:
+        return {'total': 0, 'datas': {}, 'cartao_max': None}
+    cartao = df[df['Centro_Custo'].fillna('').str.startswith('Cartao Credito')]
+    return {
+        'total': int(len(df)),
+        'datas': {
+            "Fluxo de Caixa": (df['Data_Compra'].min(), df['Data_Compra'].max()),
+            "Fluxo de Competência": (df['Data'].min(), df['Data'].max())
+        },
+        'cartao_max': cartao['Data'].max() if not cartao.empty else None
+    }
+
+def _expressao_opcao(coluna):
+    if coluna == 'banco':
+        return Transacao.banco
+    if coluna == 'categoria':
+        return expressao_categoria()
+    return func.coalesce(Transacao.centro_custo, CENTRO_PADRAO)
+
+def listar_opcoes_filtro(usuario_id, filtros, coluna):
+    """Valores distintos de 'banco', 'categoria' ou 'centro_custo' dentro dos filtros (opções dos seletores)"""
+    session = get_session()
+    try:
+        valor = _expressao_opcao(coluna)
+        linhas = session.query(valor).filter(*montar_condicoes(usuario_id, filtros), valor.isnot(None)).distinct().all()
+        return sorted(v for v, in linhas)
+    finally:
+        session.close()
+
+def listar_opcoes_filtro_pandas(df, coluna):
+    valores = {
+        'banco': df['Banco'],
+        'categoria': df['Categoria'],
+        'centro_custo': df['Centro_Custo'].fillna(CENTRO_PADRAO)
+    }[coluna]
+    return sorted(valores.dropna().unique().tolist())
+
+def _serie(linhas, nome_indice):
+    serie = pd.Series(
+        [float(total or 0) for _, total in linhas],
+        index=pd.Index([chave for chave, _ in linhas], name=nome_indice),
+        name='Valor_Absoluto',
+        dtype='float64'
+    )
+    return serie
+
+def calcular_agregados(usuario_id, filtros):
+    """Calcula métricas, rankings e barras por banco diretamente no banco de dados"""
+    session = get_session()
+    try:
+        condicoes = montar_condicoes(usuario_id, filtros)
+        data_vis = expressao_data(filtros.get('fluxo'))
+        valor_abs = func.abs(Transacao.valor)
+        eh_debito = Transacao.tipo == 'DEBITO'
+        eh_credito = Transacao.tipo == 'CREDITO'
+
+        metricas = session.query(
+            func.sum(case((eh_debito, valor_abs), else_=0)),
+            func.sum(case((eh_credito, valor_abs), else_=0)),
+            func.sum(case((eh_debito, 1), else_=0)),
+            func.min(data_vis),
+            func.max(data_vis),
+            func.count(Transacao.id)
+        ).filter(and_(*condicoes)).one()
+
+        total_gastos, total_ganhos, n_debitos, data_min, data_max, total = metricas
+
+        categoria = expressao_categoria()
+        gastos_categoria = session.query(
+            categoria, func.sum(valor_abs)
+        ).filter(and_(*condicoes), eh_debito).group_by(categoria).order_by(func.sum(valor_abs).desc()).all()
+
+        gastos_banco = session.query(
+            Transacao.banco, func.sum(valor_abs)
+        ).filter(and_(*condicoes), eh_debito).group_by(Transacao.banco).order_by(func.sum(valor_abs).desc()).all()
+
+        ganhos_banco = session.query(
+            Transacao.banco, func.sum(Transacao.valor)
+        ).filter(and_(*condicoes), eh_credito).group_by(Transacao.banco).order_by(Transacao.banco).all()
+
+        return {
+            'total_gastos': float(total_gastos or 0),
+            'total_ganhos': float(total_ganhos or 0),
+            'n_debitos': int(n_debitos or 0),
+            'data_min': data_min,
+            'data_max': data_max,
+            'total': int(total or 0),
+            'gastos_categoria': _serie(gastos_categoria, 'Categoria'),
+            'gastos_banco': _serie(gastos_banco, 'Banco'),
+            'ganhos_banco': _serie(ganhos_banco, 'Banco')
+        }
+    finally:
+        session.close()
+
+def calcular_agregados_pandas(df):
+    """Mesmas agregações de calcular_agregados sobre um DataFrame já filtrado (fallback)"""
+    debitos = df[df['Tipo'] == 'DEBITO']
+    creditos = df[df['Tipo'] == 'CREDITO']
+    return {
+        'total_gastos': float(debitos['Valor_Absoluto'].sum()),
+        'total_ganhos': float(creditos['Valor_Absoluto'].sum()),
+        'n_debitos': int(len(debitos)),
+        'data_min': df['Data_Vis'].min() if not df.empty else None,
+        'data_max': df['Data_Vis'].max() if not df.empty else None,
+        'total': int(len(df)),
+        'gastos_categoria': debitos.groupby('Categoria')['Valor_Absoluto'].sum().sort_values(ascending=False),
+        'gastos_banco': debitos.groupby('Banco')['Valor_Absoluto'].sum().sort_values(ascending=False),
+        'ganhos_banco': creditos.groupby('Banco')['Valor'].sum()
+    }
+
+def _dialeto(session):
+    return session.get_bind().dialect.name
+
+def calcular_evolucao_mensal(usuario_id, filtros):
+    """Totais absolutos por mês (YYYY-MM) e tipo"""
+    session = get_session()
+    try:
+        mes = expressao_mes(expressao_data(filtros.get('fluxo')), _dialeto(session))
+        linhas = session.query(
+            mes, Transacao.tipo, func.sum(func.abs(Transacao.valor))
+        ).filter(*montar_condicoes(usuario_id, filtros)).group_by(mes, Transacao.tipo).all()
+        return pd.DataFrame(linhas, columns=['Mes_Ano', 'Tipo', 'Valor_Absoluto'])
+    finally:
+        session.close()
+
+def calcular_evolucao_mensal_pandas(df):
+    df_mensal = df.copy()
+    df_mensal['Mes_Ano'] = df_mensal['Data_Vis'].dt.strftime('%Y-%m')
+    return df_mensal.groupby(['Mes_Ano', 'Tipo'])['Valor_Absoluto'].sum().reset_index()
+
+def calcular_evolucao_diaria(usuario_id, filtros):
+    """Totais absolutos por dia e tipo"""
+    session = get_session()
+    try:
+        dia = func.date(expressao_data(filtros.get('fluxo')))
+        linhas = session.query(
+            dia, Transacao.tipo, func.sum(func.abs(Transacao.valor))
+        ).filter(*montar_condicoes(usuario_id, filtros)).group_by(dia, Transacao.tipo).all()
+        df = pd.DataFrame(linhas, columns=['Dia', 'Tipo', 'Valor_Absoluto'])
+        df['Dia'] = pd.to_datetime(df['Dia'])
+        return df
+    finally:
+        session.close()
+
+def calcular_evolucao_diaria_pandas(df):
+    df_diario = df.copy()
+    df_diario['Dia'] = df_diario['Data_Vis'].dt.normalize()
+    return df_diario.groupby(['Dia', 'Tipo'])['Valor_Absoluto'].sum().reset_index()
+
+def calcular_gastos_categoria_mes(usuario_id, filtros, data_limite):
+    """Gastos por categoria em cada mês a partir de data_limite"""
+    session = get_session()
+    try:
+        data_vis = expressao_data(filtros.get('fluxo'))
+        mes = expressao_mes(data_vis, _dialeto(session))
+        categoria = expressao_categoria()
+        linhas = session.query(
+            mes, categoria, func.sum(func.abs(Transacao.valor))
+        ).filter(
+            *montar_condicoes(usuario_id, filtros),
+            Transacao.tipo == 'DEBITO',
+            data_vis >= data_limite
+        ).group_by(mes, categoria).all()
+        return pd.DataFrame(linhas, columns=['Mes_Ano', 'Categoria', 'Valor_Absoluto'])
+    finally:
+        session.close()
+
+def calcular_gastos_categoria_mes_pandas(df, data_limite):
+    df_12meses = df[(df['Data_Vis'] >= data_limite) & (df['Tipo'] == 'DEBITO')].copy()
+    df_12meses['Mes_Ano'] = df_12meses['Data_Vis'].dt.strftime('%Y-%m')
+    return df_12meses.groupby(['Mes_Ano', 'Categoria'])['Valor_Absoluto'].sum().reset_index()
+
+def listar_parcelamentos_ativos(usuario_id, filtros):
+    """Compras parceladas que ainda têm parcelas a vencer (uma linha por compra)
+
+    O progresso vem do maior parcela_atual de cada grupo_compra; transações
+    sem grupo (anteriores ao preenchimento) aparecem individualmente.
+    """
+    session = get_session()
+    try:
+        progresso = session.query(
+            Transacao.grupo_compra.label('grupo_compra'),
+            func.max(Transacao.parcela_atual).label('parcela_realizada')
+        ).filter(
+            Transacao.usuario_id == usuario_id,
+            Transacao.grupo_compra.isnot(None)
+        ).group_by(Transacao.grupo_compra).subquery()
+
+        linhas = session.query(
+            Transacao.descricao, Transacao.valor, Transacao.parcela_atual,
+            Transacao.parcela_total, Transacao.banco, expressao_categoria()
+        ).outerjoin(
+            progresso, Transacao.grupo_compra == progresso.c.grupo_compra
+        ).filter(
+            *montar_condicoes(usuario_id, filtros),
+            Transacao.parcelamento.is_(True),
+            Transacao.parcela_atual < Transacao.parcela_total,
+            or_(progresso.c.grupo_compra.is_(None), Transacao.parcela_atual == progresso.c.parcela_realizada)
+        ).order_by(Transacao.data.desc()).all()
+        return pd.DataFrame(linhas, columns=['Descrição', 'Valor', 'Parcela_Atual', 'Parcela_Total', 'Banco', 'Categoria'])
+    finally:
+        session.close()
+
+def listar_parcelamentos_ativos_pandas(df):
+    df_parcelas = df[(df['Parcelamento'] == 'Sim') & df['Parcela'].notna()].copy()
+    partes = df_parcelas['Parcela'].str.split('/', expand=True)
+    if partes.empty:
+        return pd.DataFrame(columns=['Descrição', 'Valor', 'Parcela_Atual', 'Parcela_Total', 'Banco', 'Categoria'])
+    df_parcelas['Parcela_Atual'] = pd.to_numeric(partes[0], errors='coerce')
+    df_parcelas['Parcela_Total'] = pd.to_numeric(partes[1], errors='coerce')
+    df_parcelas = df_parcelas[df_parcelas['Parcela_Atual'] < df_parcelas['Parcela_Total']]
+    return df_parcelas[['Descrição', 'Valor', 'Parcela_Atual', 'Parcela_Total', 'Banco', 'Categoria']]
+
+def calcular_estatisticas_classificacao(usuario_id):
+    """Contagens de classificação do usuário em uma única consulta (SUM(CASE ...))"""
+    session = get_session()
+    try:
+        manual = Transacao.categoria_manual.isnot(None)
+        ia = Transacao.categoria_ia.isnot(None)
+        total, manuais, por_ia, somente_ia = session.query(
+            func.count(Transacao.id),
+            func.sum(case((manual, 1), else_=0)),
+            func.sum(case((ia, 1), else_=0)),
+            func.sum(case((and_(ia, Transacao.categoria_manual.is_(None)), 1), else_=0))
+        ).filter(Transacao.usuario_id == usuario_id).one()
+        return {
+            'total': int(total or 0),
+            'manual': int(manuais or 0),
+            'ia': int(por_ia or 0),
+            'somente_ia': int(somente_ia or 0)  # classificadas pela IA e ainda sem categoria manual
+        }
+    finally:
+        session.close()
+
+def obter_estatisticas_classificacao(usuario_id):
+    """Contagens de classificação a partir da linha de contadores do usuário
+
+    Uma leitura por chave primária traz a versão dos dados e os contadores;
+    só quando eles foram gravados em outra versão a agregação é refeita e a
+    linha regravada com a versão lida antes dela.
+    """
+    session = get_session()
+    try:
+        linha = session.query(VersaoDados.versao, EstatisticasClassificacao).outerjoin(
+            EstatisticasClassificacao, EstatisticasClassificacao.usuario_id == VersaoDados.usuario_id
+        ).filter(VersaoDados.usuario_id == usuario_id).first()
+        if linha is None:
+            # Ainda sem escrita registrada (versão 0)
+            versao, contadores = 0, session.get(EstatisticasClassificacao, usuario_id)
+        else:
+            versao, contadores = linha
+        if contadores is not None and contadores.versao == versao:
+            return {
+                'total': contadores.total,
+                'manual': contadores.manual,
+                'ia': contadores.ia,
+                'somente_ia': contadores.somente_ia
+            }
+
+        estatisticas = calcular_estatisticas_classificacao(usuario_id)
+        try:
+            session.merge(EstatisticasClassificacao(
+                usuario_id=usuario_id, versao=versao, updated_at=datetime.datetime.utcnow(), **estatisticas
+            ))
+            session.commit()
+        except Exception as e:
+            # Outra sessão gravou ao mesmo tempo: as contagens calculadas continuam valendo
+            session.rollback()
+            print(f"Erro ao gravar estatísticas de classificação: {e}")
+        return estatisticas
+    finally:
+        session.close()
+
+# Exportar funções
+__all__ = [
+    'expressao_data',
+    'expressao_categoria',
+    'expressao_mes',
+    'montar_condicoes',
+    'calcular_agregados',
+    'calcular_agregados_pandas',
+    'calcular_evolucao_mensal',
+    'calcular_evolucao_mensal_pandas',
+    'calcular_evolucao_diaria',
+    'calcular_evolucao_diaria_pandas',
+    'calcular_gastos_categoria_mes',
+    'calcular_gastos_categoria_mes_pandas',
+    'listar_parcelamentos_ativos',
+    'listar_parcelamentos_ativos_pandas',
+    'calcular_estatisticas_classificacao',
+    'obter_estatisticas_classificacao'
+]
@@ -5,7 +5,10 @@ try:
     from openai import OpenAI
 except Exception:
     OpenAI = None
-from database import get_session, CacheClassificacao
+from database import get_session, CacheClassificacao, CacheClassificacaoUsuario
+from parcelas import normalizar_descricao
+from configuracao import obter_config_float
+from classificador_local import prever_categorias, LIMIAR_CONFIANCA_PADRAO
 
 class ClassificadorFinanceiro:
     def __init__(self):
@@ -69,20 +72,28 @@ class ClassificadorFinanceiro:
         if df_transacoes.empty:
             return df_transacoes
 
-        client = self._get_openai_client()
-        if client is None:
-            raise RuntimeError("OPENAI_API_KEY nao configurada.")
-
         categorias_validas = list(self.categorias_padrao.keys())
         categorias_validas.sort()
 
         descricoes = df_transacoes['descricao'].fillna("").tolist()
         categorias_result = [None] * len(descricoes)
 
-        # Cache local por descricao
+        # Primeiro as categorias manuais do próprio usuário (por descrição
+        # normalizada, gravadas ao aplicar a semelhantes); depois o cache
+        # global das respostas da API (por descrição exata)
+        normalizadas = normalizar_descricao(descricoes).str[:200].tolist()
+        usuario_id = int(df_transacoes['usuario_id'].iloc[0]) if 'usuario_id' in df_transacoes.columns else None
         session = get_session()
         try:
-            existentes = session.query(CacheClassificacao).filter(CacheClassificacao.descricao.in_(descricoes)).all()
+            cache_usuario = {}
+            if usuario_id is not None:
+                cache_usuario = dict(session.query(CacheClassificacaoUsuario.descricao, CacheClassificacaoUsuario.categoria).filter(
+                    CacheClassificacaoUsuario.usuario_id == usuario_id,
+                    CacheClassificacaoUsuario.descricao.in_(list(set(normalizadas)))
+                ).all())
+            existentes = session.query(CacheClassificacao).filter(
+                CacheClassificacao.descricao.in_(list(set(descricoes)))
+            ).all()
             cache_map = {c.descricao: c.categoria for c in existentes}
         finally:
             session.close()
@@ -90,12 +101,46 @@ class ClassificadorFinanceiro:
         pendentes = []
         pendentes_idx = []
         for idx, desc in enumerate(descricoes):
-            if desc in cache_map:
+            if normalizadas[idx] in cache_usuario:
+                categorias_result[idx] = cache_usuario[normalizadas[idx]]
+            elif desc in cache_map:
                 categorias_result[idx] = cache_map[desc]
             else:
                 pendentes.append(desc)
                 pendentes_idx.append(idx)
 
+        # Modelo local treinado com as categorias manuais: só as linhas com
+        # confiança abaixo de CLASSIFICADOR_LOCAL_LIMIAR seguem para a API
+        confiancas = [None] * len(descricoes)
+        previsao_local = {}
+        if pendentes and usuario_id is not None:
+            try:
+                previsao = prever_categorias(usuario_id, pendentes, categorias_validas)
+            except Exception as e:
+                print(f"Erro no classificador local: {e}")
+                previsao = None
+            if previsao is not None:
+                limiar = obter_config_float('CLASSIFICADOR_LOCAL_LIMIAR', LIMIAR_CONFIANCA_PADRAO)
+                restantes, restantes_idx = [], []
+                for desc, idx, cat, confianca in zip(pendentes, pendentes_idx, *previsao):
+                    previsao_local[idx] = (cat, float(confianca))
+                    if confianca >= limiar:
+                        categorias_result[idx] = cat
+                        confiancas[idx] = float(confianca)
+                    else:
+                        restantes.append(desc)
+                        restantes_idx.append(idx)
+                pendentes, pendentes_idx = restantes, restantes_idx
+
+        client = self._get_openai_client() if pendentes else None
+        if pendentes and client is None:
+            # Sem API: fica a previsão local, mesmo com confiança baixa; sem
+            # previsão (modelo ainda não treinado) a linha fica sem categoria
+            for idx in pendentes_idx:
+                if idx in previsao_local:
+                    categorias_result[idx], confiancas[idx] = previsao_local[idx]
+            pendentes, pendentes_idx = [], []
+
         model = model or os.getenv("OPENAI_MODEL", "gpt-5-nano")
 
         for i in range(0, len(pendentes), batch_size):
@@ -140,10 +185,12 @@ class ClassificadorFinanceiro:
             finally:
                 session.close()
 
-        for i in range(len(categorias_result)):
-            if categorias_result[i] is None:
-                categorias_result[i] = 'OUTROS'
+        # Linhas que a API não devolveu
+        if client is not None:
+            for i in range(len(categorias_result)):
+                if categorias_result[i] is None:
+                    categorias_result[i] = 'OUTROS'
 
         df_transacoes['categoria_ia'] = categorias_result
-        df_transacoes['confianca_ia'] = None
+        df_transacoes['confianca_ia'] = confiancas
         return df_transacoes
@@ -10,15 +10,20 @@ sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 warnings.filterwarnings('ignore')
 
-# Importar módulos - ADICIONE get_session AQUI!
+# Importar módulos
 try:
     from auth import login_page, check_auth, is_admin
     from csv_processor import processar_csv, salvar_transacoes
     from ai_classifier import ClassificadorFinanceiro
-    from dashboard import carregar_dados, criar_dashboard
-    from export import exportar_para_excel, exportar_para_csv, exportar_relatorio_completo
-    from admin import gerenciar_usuarios, gerenciar_categorias, configurar_sistema, backup_dados
-    from database import get_session, Usuario, Transacao, Categoria, ConfigSistema  # get_session JÁ ESTÁ AQUI, mas vamos garantir
+    from dashboard import criar_dashboard, exibir_detalhes, carregar_estatisticas_classificacao
+    from export import exportar_delta_csv, salvar_marca_exportacao
+    from tarefas_exportacao import painel_exportacao
+    from snapshots import iniciar_agendador
+    from configuracao import obter_config, obter_config_int, obter_config_float, definir_configs
+    from classificacao import salvar_categorias_manuais, aplicar_a_semelhantes
+    from paginacao import aplicar_keyset, separar_pagina, controles_paginacao, navegacao_paginacao, reiniciar_paginacao
+    from admin import gerenciar_usuarios, gerenciar_categorias, configurar_sistema, visualizar_auditoria, backup_dados
+    from database import unidade_de_trabalho, incrementar_versao_dados, Usuario, Transacao, Categoria
 except ImportError as e:
     st.error(f"Erro ao importar módulos: {e}")
     st.info("Certifique-se de que todos os arquivos estão no mesmo diretório:")
@@ -49,35 +54,19 @@ def get_classifier():
     classifier = ClassificadorFinanceiro()
     return classifier
 
-def _get_config(chave, default=None):
-    session = get_session()
-    try:
-        cfg = session.query(ConfigSistema).filter_by(chave=chave).first()
-        return cfg.valor if cfg else default
-    finally:
-        session.close()
-
-def _set_config(chave, valor, descricao=None):
-    session = get_session()
-    try:
-        cfg = session.query(ConfigSistema).filter_by(chave=chave).first()
-        if cfg:
-            cfg.valor = str(valor)
-            if descricao:
-                cfg.descricao = descricao
-        else:
-            cfg = ConfigSistema(chave=chave, valor=str(valor), descricao=descricao or "")
-            session.add(cfg)
-        session.commit()
-    finally:
-        session.close()
-
 def _clear_cached_data():
     try:
         st.cache_data.clear()
     except Exception:
         pass
 
+# Agendador de snapshots do SQLite (uma thread por processo; respeita BACKUP_AUTOMATICO)
+@st.cache_resource
+def iniciar_backup_automatico():
+    return iniciar_agendador()
+
+iniciar_backup_automatico()
+
 # Verificar autenticação
 if not check_auth():
     login_page()
@@ -177,9 +166,9 @@ if menu == "📤 Importar CSV":
     
     # Opção de processamento automático
     auto_classificar = st.checkbox("Classificar transações automaticamente com IA (OpenAI)", value=True)
-    openai_model = _get_config("OPENAI_MODEL", os.getenv("OPENAI_MODEL", "gpt-5-nano"))
-    openai_batch = int(_get_config("OPENAI_BATCH", 50))
-    openai_temp = float(_get_config("OPENAI_TEMP", 0.0))
+    openai_model = obter_config("OPENAI_MODEL", os.getenv("OPENAI_MODEL", "gpt-5-nano"))
+    openai_batch = obter_config_int("OPENAI_BATCH", 50)
+    openai_temp = obter_config_float("OPENAI_TEMP", 0.0)
     if auto_classificar:
         if os.getenv("OPENAI_API_KEY"):
             with st.expander("⚙️ Configurações OpenAI", expanded=False):
@@ -190,9 +179,10 @@ if menu == "📤 Importar CSV":
                 col_a, col_b = st.columns(2)
                 with col_a:
                     if st.button("💾 Salvar configurações", use_container_width=True):
-                        _set_config("OPENAI_MODEL", openai_model, "Modelo OpenAI")
-                        _set_config("OPENAI_BATCH", int(openai_batch), "Tamanho do lote OpenAI")
-                        _set_config("OPENAI_TEMP", float(openai_temp), "Temperatura OpenAI")
+                        definir_configs(
+                            {"OPENAI_MODEL": openai_model, "OPENAI_BATCH": int(openai_batch), "OPENAI_TEMP": float(openai_temp)},
+                            {"OPENAI_MODEL": "Modelo OpenAI", "OPENAI_BATCH": "Tamanho do lote OpenAI", "OPENAI_TEMP": "Temperatura OpenAI"}
+                        )
                         st.success("Configurações salvas!")
                 with col_b:
                     if st.button("✅ Validar modelo", use_container_width=True):
@@ -213,8 +203,7 @@ if menu == "📤 Importar CSV":
                         except Exception as e:
                             st.error(f"Falha ao validar modelo: {e}")
         else:
-            st.error("OPENAI_API_KEY não configurada nos Secrets do Streamlit.")
-            auto_classificar = False
+            st.info("OPENAI_API_KEY não configurada: só o classificador local (treinado com as suas categorias manuais) será usado.")
     
     if uploaded_files and st.button("Processar Arquivos", type="primary"):
         classifier = get_classifier()
@@ -316,60 +305,134 @@ elif menu == "📊 Dashboard":
         help="Selecione o número de meses para análise"
     )
     
-    df = carregar_dados(st.session_state['user_id'], periodo)
-    
-    if df.empty:
+    # Criar dashboard (False se não houver transações no período)
+    if not criar_dashboard(st.session_state['user_id'], periodo):
         st.warning("Nenhuma transação encontrada. Importe arquivos CSV primeiro.")
         if st.button("Ir para Importar CSV"):
             st.rerun()
     else:
-        # Criar dashboard
-        df_filtrado = criar_dashboard(df, st.session_state['user_id'])
-        
         # Mostrar tabela com dados filtrados
         with st.expander("📋 Visualizar Dados Detalhados", expanded=False):
-            st.dataframe(
-                df_filtrado.sort_values('Data', ascending=False),
-                use_container_width=True,
-                height=400
-            )
+            exibir_detalhes(st.session_state['user_id'])
 
 # Página: Classificar Manualmente
 elif menu == "🏷️ Classificar Manualmente":
     st.title("🏷️ Classificação Manual de Transações")
     
-    # USAR get_session() AQUI - IMPORTADO DO DATABASE
-    session = get_session()
-    try:
-        # Buscar transações não classificadas manualmente
-        transacoes = session.query(Transacao).filter(
-            Transacao.usuario_id == st.session_state['user_id'],
-            Transacao.categoria_manual.is_(None)
-        ).order_by(Transacao.data.desc()).limit(50).all()
-        
-        if not transacoes:
-            st.info("🎉 Todas as transações já foram classificadas manualmente!")
-            st.info("Para classificar mais transações, importe novos arquivos CSV.")
-        else:
-            st.info(f"📝 {len(transacoes)} transações aguardando classificação")
-            
-            # Buscar categorias existentes do usuário
-            categorias_usuario = session.query(Categoria).filter(
-                Categoria.usuario_id == st.session_state['user_id']
-            ).all()
-            
-            # Lista de categorias
-            categorias_padrao = [
-                'ALIMENTACAO', 'TRANSPORTE', 'MORADIA', 'SAUDE', 
-                'EDUCACAO', 'LAZER', 'VESTUARIO', 'SERVICOS',
-                'SALARIO', 'TRANSFERENCIA', 'INVESTIMENTO', 'OUTROS'
-            ]
-            
-            # Adicionar categorias personalizadas
-            categorias_personalizadas = [cat.nome for cat in categorias_usuario]
-            todas_categorias = list(set(categorias_padrao + categorias_personalizadas))
-            todas_categorias.sort()
+    usuario_id = st.session_state['user_id']
+
+    # Leituras em sessões curtas: nenhuma conexão fica aberta enquanto a página é desenhada
+    pendentes = [Transacao.usuario_id == usuario_id, Transacao.categoria_manual.is_(None)]
+    with unidade_de_trabalho() as session:
+        total_pendentes = session.query(Transacao).filter(*pendentes).count()
+    cursor, tamanho_pagina = controles_paginacao('classificacao', total_pendentes)
+
+    with unidade_de_trabalho() as session:
+        # Buscar transações não classificadas manualmente (paginação keyset)
+        query_pendentes = session.query(
+            Transacao.id, Transacao.descricao, Transacao.data, Transacao.banco,
+            Transacao.valor, Transacao.tipo, Transacao.categoria_ia
+        ).filter(*pendentes)
+        transacoes, proximo_cursor = separar_pagina(
+            aplicar_keyset(query_pendentes, cursor, tamanho_pagina).all(),
+            tamanho_pagina
+        )
+
+        # Buscar categorias existentes do usuário
+        categorias_personalizadas = [
+            nome for (nome,) in session.query(Categoria.nome).filter(Categoria.usuario_id == usuario_id)
+        ]
 
+    # Estatísticas (uma consulta agregada, em cache pela versão dos dados)
+    estatisticas = carregar_estatisticas_classificacao(usuario_id)
+
+    if not transacoes and cursor is not None:
+        reiniciar_paginacao('classificacao')
+        st.rerun()
+
+    if not transacoes:
+        st.info("🎉 Todas as transações já foram classificadas manualmente!")
+        st.info("Para classificar mais transações, importe novos arquivos CSV.")
+    else:
+        st.info(f"📝 {total_pendentes} transações aguardando classificação")
+
+        # Lista de categorias
+        categorias_padrao = [
+            'ALIMENTACAO', 'TRANSPORTE', 'MORADIA', 'SAUDE', 
+            'EDUCACAO', 'LAZER', 'VESTUARIO', 'SERVICOS',
+            'SALARIO', 'TRANSFERENCIA', 'INVESTIMENTO', 'OUTROS'
+        ]
+
+        # Adicionar categorias personalizadas
+        todas_categorias = list(set(categorias_padrao + categorias_personalizadas))
+        todas_categorias.sort()
+
+        modo_grade = st.toggle(
+            "📝 Modo grade (edita várias linhas e salva tudo de uma vez)",
+            value=True,
+            key="classificacao_modo_grade"
+        )
+
+        if modo_grade:
+            ids_pagina = [t.id for t in transacoes]
+            grade = pd.DataFrame({
+                'ID': ids_pagina,
+                'Data': [t.data for t in transacoes],
+                'Descrição': [t.descricao for t in transacoes],
+                'Valor': [t.valor for t in transacoes],
+                'Tipo': [t.tipo for t in transacoes],
+                'Banco': [t.banco for t in transacoes],
+                'Sugestão IA': [t.categoria_ia for t in transacoes],
+                'Categoria': [t.categoria_ia if t.categoria_ia in todas_categorias else None for t in transacoes],
+                'Salvar': False,
+                'Semelhantes': False
+            })
+
+            # Edições ficam no navegador até o envio do formulário (sem rerun por célula);
+            # a chave muda com as linhas da página para não reaplicar edições antigas
+            with st.form("form_grade_classificacao"):
+                editado = st.data_editor(
+                    grade,
+                    key=f"grade_classificacao_{hash(tuple(ids_pagina))}",
+                    hide_index=True,
+                    use_container_width=True,
+                    disabled=['ID', 'Data', 'Descrição', 'Valor', 'Tipo', 'Banco', 'Sugestão IA'],
+                    column_config={
+                        'ID': None,
+                        'Data': st.column_config.DatetimeColumn("Data", format="DD/MM/YYYY"),
+                        'Valor': st.column_config.NumberColumn("Valor", format="R$ %.2f"),
+                        'Categoria': st.column_config.SelectboxColumn("Categoria", options=todas_categorias),
+                        'Salvar': st.column_config.CheckboxColumn(
+                            "Salvar",
+                            help="Grava a categoria da linha mesmo sem alterá-la (linhas alteradas são sempre gravadas)"
+                        ),
+                        'Semelhantes': st.column_config.CheckboxColumn(
+                            "Aplicar a semelhantes",
+                            help="Aplica a categoria a todas as suas transações com a mesma descrição (passadas e futuras)"
+                        )
+                    }
+                )
+                col_salvar, col_todas = st.columns(2)
+                with col_salvar:
+                    salvar_grade = st.form_submit_button("💾 Salvar alterações", type="primary", use_container_width=True)
+                with col_todas:
+                    salvar_todas = st.form_submit_button("✅ Salvar todas as linhas da página", use_container_width=True)
+
+            if salvar_grade or salvar_todas:
+                alteradas = editado['Categoria'].fillna('') != grade['Categoria'].fillna('')
+                gravar = editado['Categoria'].notna() & (alteradas | editado['Salvar'] | salvar_todas)
+                categorias = dict(zip(editado.loc[gravar, 'ID'], editado.loc[gravar, 'Categoria']))
+                semelhantes = editado['Categoria'].notna() & editado['Semelhantes']
+                categorias_semelhantes = dict(zip(editado.loc[semelhantes, 'ID'], editado.loc[semelhantes, 'Categoria']))
+                if not categorias and not categorias_semelhantes:
+                    st.warning("Nenhuma linha alterada ou marcada para salvar.")
+                else:
+                    salvar_categorias_manuais(usuario_id, categorias)
+                    propagadas = aplicar_a_semelhantes(usuario_id, categorias_semelhantes)
+                    st.success(f"Categoria salva em {len(categorias)} transações"
+                               + (f" e aplicada a {propagadas} semelhantes." if categorias_semelhantes else "."))
+                    st.rerun()
+        else:
             # Selecao em massa
             st.markdown("### 🧩 Classificação em Massa")
             bulk_categoria = st.selectbox(
@@ -386,11 +449,12 @@ elif menu == "🏷️ Classificar Manualmente":
                 if not selecionados:
                     st.warning("Nenhuma transação selecionada.")
                 else:
-                    session.query(Transacao).filter(Transacao.id.in_(selecionados)).update(
-                        {"categoria_manual": bulk_categoria},
-                        synchronize_session=False
-                    )
-                    session.commit()
+                    with unidade_de_trabalho() as session:
+                        session.query(Transacao).filter(Transacao.id.in_(selecionados)).update(
+                            {"categoria_manual": bulk_categoria},
+                            synchronize_session=False
+                        )
+                        incrementar_versao_dados(session, usuario_id)
                     st.success(f"Categoria aplicada em {len(selecionados)} transações.")
                     st.rerun()
 
@@ -401,34 +465,35 @@ elif menu == "🏷️ Classificar Manualmente":
                 if not selecionados:
                     st.warning("Nenhuma transação selecionada.")
                 else:
-                    session.query(Transacao).filter(Transacao.id.in_(selecionados)).update(
-                        {"categoria_manual": Transacao.categoria_ia},
-                        synchronize_session=False
-                    )
-                    session.commit()
+                    with unidade_de_trabalho() as session:
+                        session.query(Transacao).filter(Transacao.id.in_(selecionados)).update(
+                            {"categoria_manual": Transacao.categoria_ia},
+                            synchronize_session=False
+                        )
+                        incrementar_versao_dados(session, usuario_id)
                     st.success(f"Categorias da IA salvas em {len(selecionados)} transações.")
                     st.rerun()
-            
+        
             for i, transacao in enumerate(transacoes):
                 with st.container():
-                    col0, col1, col2, col3, col4, col5 = st.columns([0.6, 3, 1, 1, 2, 1])
+                    col0, col1, col2, col3, col4, col5, col6 = st.columns([0.6, 3, 1, 1, 2, 0.6, 0.6])
                     with col0:
                         if selecionar_todos:
                             st.session_state[f"sel_{transacao.id}"] = True
                         st.checkbox("", key=f"sel_{transacao.id}")
-                    
+                
                     with col1:
                         st.markdown(f"**{transacao.descricao}**")
                         st.caption(f"{transacao.data.strftime('%d/%m/%Y')} | {transacao.banco}")
-                    
+                
                     with col2:
                         cor = "green" if transacao.valor > 0 else "red"
                         st.markdown(f"<span style='color:{cor};font-weight:bold'>R$ {abs(transacao.valor):,.2f}</span>", 
                                    unsafe_allow_html=True)
-                    
+                
                     with col3:
                         st.text(transacao.tipo)
-                    
+                
                     with col4:
                         categoria_atual = transacao.categoria_ia or 'OUTROS'
                         nova_categoria = st.selectbox(
@@ -438,46 +503,36 @@ elif menu == "🏷️ Classificar Manualmente":
                             key=f"cat_{transacao.id}",
                             label_visibility="collapsed"
                         )
-                    
+                
                     with col5:
                         if st.button("💾", key=f"btn_{transacao.id}", help="Salvar categoria"):
-                            transacao.categoria_manual = nova_categoria
-                            session.commit()
+                            salvar_categorias_manuais(usuario_id, {transacao.id: nova_categoria})
                             st.success(f"Categoria salva: {nova_categoria}")
                             st.rerun()
-                
+                    
+                    with col6:
+                        if st.button("🔁", key=f"sem_{transacao.id}", help="Aplicar a todas as transações com a mesma descrição"):
+                            propagadas = aplicar_a_semelhantes(usuario_id, {transacao.id: nova_categoria})
+                            st.success(f"Categoria {nova_categoria} aplicada a {propagadas} transações semelhantes")
+                            st.rerun()
+            
                 if i < len(transacoes) - 1:
                     st.divider()
-        
-        # Mostrar estatísticas
-        st.sidebar.markdown("---")
-        st.sidebar.subheader("📊 Estatísticas")
-        
-        total_transacoes = session.query(Transacao).filter_by(
-            usuario_id=st.session_state['user_id']
-        ).count()
-        
-        classificadas_manual = session.query(Transacao).filter(
-            Transacao.usuario_id == st.session_state['user_id'],
-            Transacao.categoria_manual.isnot(None)
-        ).count()
-        
-        classificadas_ia = session.query(Transacao).filter(
-            Transacao.usuario_id == st.session_state['user_id'],
-            Transacao.categoria_ia.isnot(None),
-            Transacao.categoria_manual.is_(None)
-        ).count()
-        
-        st.sidebar.metric("Total Transações", total_transacoes)
-        st.sidebar.metric("Classificadas Manual", classificadas_manual)
-        st.sidebar.metric("Classificadas por IA", classificadas_ia)
-        
-        if total_transacoes > 0:
-            porcentagem = (classificadas_manual / total_transacoes) * 100
-            st.sidebar.progress(int(porcentagem), text=f"Classificação: {porcentagem:.1f}%")
-        
-    finally:
-        session.close()
+
+
+        navegacao_paginacao('classificacao', proximo_cursor)
+    
+    # Mostrar estatísticas
+    st.sidebar.markdown("---")
+    st.sidebar.subheader("📊 Estatísticas")
+    
+    st.sidebar.metric("Total Transações", estatisticas['total'])
+    st.sidebar.metric("Classificadas Manual", estatisticas['manual'])
+    st.sidebar.metric("Classificadas por IA", estatisticas['somente_ia'])
+    
+    if estatisticas['total'] > 0:
+        porcentagem = (estatisticas['manual'] / estatisticas['total']) * 100
+        st.sidebar.progress(int(porcentagem), text=f"Classificação: {porcentagem:.1f}%")
 
 # Página: Exportar
 elif menu == "📥 Exportar":
@@ -485,97 +540,121 @@ elif menu == "📥 Exportar":
     
     st.info("Exporte seus dados financeiros para análise externa ou backup.")
     
-    tab1, tab2, tab3 = st.tabs(["Excel", "CSV", "JSON"])
+    tab1, tab2, tab3, tab4 = st.tabs(["Excel", "CSV", "JSON", "Parquet / Arrow"])
     
     with tab1:
         st.subheader("📊 Exportar para Excel")
         st.write("Exporte todos os seus dados em um arquivo Excel formatado com múltiplas planilhas.")
+        st.caption("O arquivo contém 3 planilhas: transações detalhadas, resumo por categoria e análise mensal.")
         
-        if st.button("Gerar Relatório Excel Completo", use_container_width=True, type="primary"):
-            with st.spinner("Gerando arquivo Excel..."):
-                excel_file = exportar_para_excel(st.session_state['user_id'])
-                
-                if excel_file:
-                    st.download_button(
-                        label="⬇️ Baixar Arquivo Excel",
-                        data=excel_file,
-                        file_name=f"extrato_financeiro_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx",
-                        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                        use_container_width=True,
-                        icon="📊"
-                    )
-                    
-                    st.success("✅ Arquivo Excel gerado com sucesso!")
-                    st.info("O arquivo contém 3 planilhas:\n1. Transações detalhadas\n2. Resumo por categoria\n3. Análise mensal")
-                else:
-                    st.error("❌ Nenhum dado disponível para exportar")
+        painel_exportacao(st.session_state['user_id'], 'excel', "Gerar Relatório Excel Completo", "extrato_financeiro", icone="📊")
     
     with tab2:
         st.subheader("📋 Exportar para CSV")
         st.write("Exporte dados em formato CSV simples para importação em outros sistemas.")
         
-        if st.button("Gerar Arquivo CSV", use_container_width=True, type="primary"):
-            with st.spinner("Gerando arquivo CSV..."):
-                csv_data = exportar_para_csv(st.session_state['user_id'])
+        painel_exportacao(st.session_state['user_id'], 'csv', "Gerar Arquivo CSV", "transacoes", icone="📋")
+        
+        with st.expander("🔄 Exportação incremental (delta)"):
+            st.write("Exporta apenas transações inseridas ou alteradas desde a última exportação deste consumidor.")
+            consumidor = st.text_input("Consumidor", value="relatorio_noturno", max_chars=50, key="consumidor_delta").strip()
+            
+            col_delta, col_reiniciar = st.columns(2)
+            with col_delta:
+                gerar_delta = st.button("Gerar Delta CSV", use_container_width=True, disabled=not consumidor)
+            with col_reiniciar:
+                if st.button("Reiniciar marca", use_container_width=True, disabled=not consumidor):
+                    salvar_marca_exportacao(consumidor, st.session_state['user_id'], None)
+                    st.session_state.pop('delta_gerado', None)
+                    st.success("✅ Marca reiniciada: o próximo delta será completo.")
+            
+            if gerar_delta:
+                with st.spinner("Gerando delta..."):
+                    delta_data, linhas_delta, marca_delta = exportar_delta_csv(st.session_state['user_id'], consumidor)
                 
-                if csv_data:
-                    st.download_button(
-                        label="⬇️ Baixar Arquivo CSV",
-                        data=csv_data,
-                        file_name=f"transacoes_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
-                        mime="text/csv",
-                        use_container_width=True,
-                        icon="📋"
-                    )
-                    
-                    st.success("✅ Arquivo CSV gerado com sucesso!")
+                st.session_state.pop('delta_gerado', None)
+                if delta_data is None:
+                    st.error("❌ Erro ao gerar delta")
+                elif linhas_delta == 0:
+                    st.info("Nenhuma alteração desde a última exportação.")
                 else:
-                    st.error("❌ Nenhum dado disponível para exportar")
+                    st.session_state['delta_gerado'] = {
+                        'consumidor': consumidor,
+                        'dados': delta_data,
+                        'linhas': linhas_delta,
+                        'marca': marca_delta,
+                        'nome': f"delta_{consumidor}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
+                    }
+            
+            delta = st.session_state.get('delta_gerado')
+            if delta and delta['consumidor'] == consumidor:
+                def confirmar_delta(usuario_id=st.session_state['user_id'], delta=delta):
+                    # A marca só avança quando o arquivo é baixado; um delta gerado
+                    # e não baixado volta inteiro no próximo
+                    salvar_marca_exportacao(delta['consumidor'], usuario_id, delta['marca'])
+                    st.session_state.pop('delta_gerado', None)
+                
+                st.download_button(
+                    label=f"⬇️ Baixar Delta ({delta['linhas']} linhas novas)",
+                    data=delta['dados'],
+                    file_name=delta['nome'],
+                    mime="text/csv",
+                    on_click=confirmar_delta,
+                    use_container_width=True,
+                    icon="🔄"
+                )
     
     with tab3:
         st.subheader("📄 Exportar para JSON")
         st.write("Exporte dados em formato JSON estruturado para análise programática.")
         
-        if st.button("Gerar Relatório JSON", use_container_width=True, type="primary"):
-            with st.spinner("Gerando arquivo JSON..."):
-                json_data = exportar_relatorio_completo(st.session_state['user_id'])
-                
-                if json_data:
-                    st.download_button(
-                        label="⬇️ Baixar Arquivo JSON",
-                        data=json_data,
-                        file_name=f"relatorio_financeiro_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json",
-                        mime="application/json",
-                        use_container_width=True,
-                        icon="📄"
-                    )
-                    
-                    st.success("✅ Arquivo JSON gerado com sucesso!")
-                    st.info("O JSON contém metadados, transações, categorias e resumo.")
-                else:
-                    st.error("❌ Nenhum dado disponível para exportar")
+        formato_json = st.radio(
+            "Formato",
+            ["JSON (relatório completo)", "NDJSON (uma transação por linha)"],
+            horizontal=True,
+            key="formato_json"
+        )
+        
+        if formato_json.startswith("NDJSON"):
+            st.caption("Cada linha do arquivo é uma transação em JSON.")
+            painel_exportacao(st.session_state['user_id'], 'ndjson', "Gerar Arquivo NDJSON", "transacoes", icone="📄")
+        else:
+            st.caption("O JSON contém metadados, transações, categorias e resumo.")
+            painel_exportacao(st.session_state['user_id'], 'json', "Gerar Relatório JSON", "relatorio_financeiro", icone="📄")
+    
+    with tab4:
+        st.subheader("🗃️ Exportar para Parquet / Arrow")
+        st.write("Formato colunar tipado, compacto e de leitura rápida em pandas/pyarrow (`pd.read_parquet`).")
+        
+        formato_colunar = st.radio(
+            "Formato",
+            ["Parquet", "Arrow IPC (stream)"],
+            horizontal=True,
+            key="formato_colunar"
+        )
+        particionar = st.checkbox(
+            "Particionar por mês (ZIP com mes=AAAA-MM/transacoes.parquet)",
+            key="particionar_parquet",
+            disabled=formato_colunar != "Parquet"
+        )
+        
+        if formato_colunar != "Parquet":
+            formato = 'arrow'
+        elif particionar:
+            formato = 'parquet_mes'
+        else:
+            formato = 'parquet'
+        painel_exportacao(st.session_state['user_id'], formato, "Gerar Arquivo Colunar", "transacoes", icone="🗃️")
     
     # Estatísticas
     st.markdown("---")
     st.subheader("📈 Estatísticas do Banco de Dados")
     
     try:
-        # USAR get_session() AQUI - IMPORTADO DO DATABASE
-        session = get_session()
-        
-        total_transacoes = session.query(Transacao).filter_by(
-            usuario_id=st.session_state['user_id']
-        ).count()
-        
-        transacoes_classificadas = session.query(Transacao).filter(
-            Transacao.usuario_id == st.session_state['user_id'],
-            Transacao.categoria_manual.isnot(None)
-        ).count()
-        
-        transacoes_ia = session.query(Transacao).filter(
-            Transacao.usuario_id == st.session_state['user_id'],
-            Transacao.categoria_ia.isnot(None)
-        ).count()
+        estatisticas = carregar_estatisticas_classificacao(st.session_state['user_id'])
+        total_transacoes = estatisticas['total']
+        transacoes_classificadas = estatisticas['manual']
+        transacoes_ia = estatisticas['ia']
         
         col1, col2, col3, col4 = st.columns(4)
         with col1:
@@ -590,8 +669,6 @@ elif menu == "📥 Exportar":
                 st.metric("Taxa Classificação", f"{porcentagem:.1f}%")
             else:
                 st.metric("Taxa Classificação", "0%")
-        
-        session.close()
     except Exception as e:
         st.error(f"Erro ao calcular estatísticas: {e}")
 
@@ -603,11 +680,12 @@ elif menu == "⚙️ Configurações":
     else:
         st.title("⚙️ Configurações do Sistema")
         
-        tab1, tab2, tab3, tab4, tab5 = st.tabs([
+        tab1, tab2, tab3, tab4, tab5, tab6 = st.tabs([
             "👥 Usuários", 
             "🏷️ Categorias", 
             "⚙️ Sistema", 
             "💾 Backup", 
+            "📜 Auditoria", 
             "👤 Minha Conta"
         ])
         
@@ -624,52 +702,56 @@ elif menu == "⚙️ Configurações":
             backup_dados()
         
         with tab5:
+            visualizar_auditoria()
+        
+        with tab6:
             # Configurações da conta pessoal do admin
             st.subheader("👤 Minha Conta")
             
-            # USAR get_session() AQUI - IMPORTADO DO DATABASE
-            session = get_session()
-            try:
-                usuario = session.query(Usuario).filter_by(id=st.session_state.user_id).first()
-                if not usuario:
-                    st.error("Usuário não encontrado. Faça login novamente.")
-                    st.stop()
-                
-                col1, col2 = st.columns(2)
-                
-                with col1:
-                    st.info(f"**Usuário:** {usuario.username}")
-                    st.info(f"**Email:** {usuario.email or 'Não cadastrado'}")
-                    st.info(f"**Nível:** {usuario.nivel_acesso}")
-                    st.info(f"**Status:** {'✅ Ativo' if usuario.ativo else '❌ Inativo'}")
-                    st.info(f"**Conta criada em:** {usuario.created_at.strftime('%d/%m/%Y')}")
-                    if usuario.ultimo_login:
-                        st.info(f"**Último login:** {usuario.ultimo_login.strftime('%d/%m/%Y %H:%M')}")
-                
-                with col2:
-                    with st.form("form_alterar_senha"):
-                        st.write("### 🔐 Alterar Senha")
-                        
-                        senha_atual = st.text_input("Senha Atual", type="password")
-                        nova_senha = st.text_input("Nova Senha", type="password")
-                        confirmar_senha = st.text_input("Confirmar Nova Senha", type="password")
-                        
-                        if st.form_submit_button("Alterar Senha", type="primary"):
-                            from auth import verify_password, hash_password
-                            
-                            if not verify_password(senha_atual, usuario.password_hash):
-                                st.error("Senha atual incorreta")
-                            elif nova_senha != confirmar_senha:
-                                st.error("As novas senhas não coincidem")
-                            elif len(nova_senha) < 6:
-                                st.error("A nova senha deve ter pelo menos 6 caracteres")
-                            else:
-                                usuario.password_hash = hash_password(nova_senha)
-                                session.commit()
-                                st.success("✅ Senha alterada com sucesso!")
+            with unidade_de_trabalho() as session:
+                usuario = session.query(
+                    Usuario.username, Usuario.email, Usuario.nivel_acesso, Usuario.ativo,
+                    Usuario.created_at, Usuario.ultimo_login, Usuario.password_hash
+                ).filter_by(id=st.session_state.user_id).first()
+            if not usuario:
+                st.error("Usuário não encontrado. Faça login novamente.")
+                st.stop()
+            
+            col1, col2 = st.columns(2)
             
-            finally:
-                session.close()
+            with col1:
+                st.info(f"**Usuário:** {usuario.username}")
+                st.info(f"**Email:** {usuario.email or 'Não cadastrado'}")
+                st.info(f"**Nível:** {usuario.nivel_acesso}")
+                st.info(f"**Status:** {'✅ Ativo' if usuario.ativo else '❌ Inativo'}")
+                st.info(f"**Conta criada em:** {usuario.created_at.strftime('%d/%m/%Y')}")
+                if usuario.ultimo_login:
+                    st.info(f"**Último login:** {usuario.ultimo_login.strftime('%d/%m/%Y %H:%M')}")
+            
+            with col2:
+                with st.form("form_alterar_senha"):
+                    st.write("### 🔐 Alterar Senha")
+                    
+                    senha_atual = st.text_input("Senha Atual", type="password")
+                    nova_senha = st.text_input("Nova Senha", type="password")
+                    confirmar_senha = st.text_input("Confirmar Nova Senha", type="password")
+                    
+                    if st.form_submit_button("Alterar Senha", type="primary"):
+                        from auth import verify_password, hash_password
+                        
+                        if not verify_password(senha_atual, usuario.password_hash):
+                            st.error("Senha atual incorreta")
+                        elif nova_senha != confirmar_senha:
+                            st.error("As novas senhas não coincidem")
+                        elif len(nova_senha) < 6:
+                            st.error("A nova senha deve ter pelo menos 6 caracteres")
+                        else:
+                            novo_hash = hash_password(nova_senha)
+                            with unidade_de_trabalho() as session:
+                                session.query(Usuario).filter_by(id=st.session_state.user_id).update(
+                                    {Usuario.password_hash: novo_hash}, synchronize_session=False
+                                )
+                            st.success("✅ Senha alterada com sucesso!")
             
             st.divider()
             
@@ -0,0 +1,176 @@
+import time
+import queue
+import atexit
+import datetime
+import threading
+from sqlalchemy import func, or_, and_
+from database import init_db, get_session, RegistroAuditoria, ResumoAuditoria
+from configuracao import obter_config_int
+
+TAMANHO_LOTE_AUDITORIA = 500
+INTERVALO_GRAVACAO = 1.0           # segundos máximos que um evento espera na fila
+MAX_FILA_AUDITORIA = 10000         # eventos além disso são descartados (o login nunca espera)
+RETENCAO_PADRAO_DIAS = 90          # eventos mais antigos viram contagens diárias em audit_log_resumo
+INTERVALO_RETENCAO = 24 * 3600     # segundos entre execuções da retenção pela thread de gravação
+
+EVENTOS_AUDITORIA = {
+    'LOGIN': 'Login',
+    'LOGIN_FALHA': 'Falha de login'
+}
+
+_FILA = queue.Queue(maxsize=MAX_FILA_AUDITORIA)
+_GRAVADOR_LOCK = threading.Lock()
+_GRAVADOR = None
+
+def registrar_evento(evento, usuario_id=None, detalhe=None):
+    """Enfileira um evento de auditoria; a gravação acontece em lote, fora da requisição"""
+    registro = {
+        'ts': datetime.datetime.utcnow(),
+        'usuario_id': usuario_id,
+        'evento': evento[:30],
+        'detalhe': str(detalhe)[:200] if detalhe is not None else None
+    }
+    _iniciar_gravador()
+    try:
+        _FILA.put_nowait(registro)
+    except queue.Full:
+        print(f"Erro ao registrar auditoria: fila cheia, evento {evento} descartado")
+
+def _gravar(lote):
+    try:
+        with init_db().begin() as conn:
+            conn.execute(RegistroAuditoria.__table__.insert(), lote)
+    except Exception as e:
+        print(f"Erro ao gravar {len(lote)} eventos de auditoria: {e}")
+
+def _executar_gravador():
+    ultima_retencao = 0.0
+    while True:
+        lote = [_FILA.get()]
+        limite = time.monotonic() + INTERVALO_GRAVACAO
+        while len(lote) < TAMANHO_LOTE_AUDITORIA:
+            restante = limite - time.monotonic()
+            if restante <= 0:
+                break
+            try:
+                lote.append(_FILA.get(timeout=restante))
+            except queue.Empty:
+                break
+        _gravar(lote)
+        for _ in lote:
+            _FILA.task_done()
+
+        if time.monotonic() - ultima_retencao >= INTERVALO_RETENCAO:
+            ultima_retencao = time.monotonic()
+            try:
+                aplicar_retencao_auditoria()
+            except Exception as e:
+                print(f"Erro na retenção da auditoria: {e}")
+
+def _iniciar_gravador():
+    global _GRAVADOR
+    if _GRAVADOR is not None and _GRAVADOR.is_alive():
+        return
+    with _GRAVADOR_LOCK:
+        if _GRAVADOR is None or not _GRAVADOR.is_alive():
+            _GRAVADOR = threading.Thread(target=_executar_gravador, name='auditoria', daemon=True)
+            _GRAVADOR.start()
+
+def aguardar_gravacao():
+    """Bloqueia até que os eventos já enfileirados tenham sido gravados"""
+    if _GRAVADOR is not None and _GRAVADOR.is_alive():
+        _FILA.join()
+
+atexit.register(aguardar_gravacao)
+
+def aplicar_retencao_auditoria(dias=None):
+    """Agrega em contagens diárias e remove os eventos mais antigos que `dias`; retorna quantos saíram"""
+    if dias is None:
+        dias = obter_config_int('AUDITORIA_RETENCAO_DIAS', RETENCAO_PADRAO_DIAS)
+    limite = datetime.datetime.combine(
+        datetime.datetime.utcnow().date() - datetime.timedelta(days=dias), datetime.time.min
+    )
+    session = get_session()
+    try:
+        dia = func.date(RegistroAuditoria.ts)
+        contagens = session.query(
+            dia, RegistroAuditoria.usuario_id, RegistroAuditoria.evento, func.count(RegistroAuditoria.id)
+        ).filter(RegistroAuditoria.ts < limite).group_by(dia, RegistroAuditoria.usuario_id, RegistroAuditoria.evento).all()
+        if not contagens:
+            return 0
+
+        for data_evento, usuario_id, evento, quantidade in contagens:
+            chave = (str(data_evento)[:10], usuario_id or 0, evento)
+            resumo = session.get(ResumoAuditoria, chave)
+            if resumo:
+                resumo.quantidade += quantidade
+            else:
+                session.add(ResumoAuditoria(dia=chave[0], usuario_id=chave[1], evento=evento, quantidade=quantidade))
+        removidos = session.query(RegistroAuditoria).filter(
+            RegistroAuditoria.ts < limite
+        ).delete(synchronize_session=False)
+        session.commit()
+        return removidos
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+def _filtros(usuario_id=None, evento=None):
+    condicoes = []
+    if usuario_id is not None:
+        condicoes.append(RegistroAuditoria.usuario_id == usuario_id)
+    if evento:
+        condicoes.append(RegistroAuditoria.evento == evento)
+    return condicoes
+
+def listar_auditoria(cursor=None, tamanho=50, usuario_id=None, evento=None):
+    """Página de eventos (mais recentes primeiro) por keyset em (ts, id); traz uma linha a mais"""
+    session = get_session()
+    try:
+        query = session.query(
+            RegistroAuditoria.id, RegistroAuditoria.ts, RegistroAuditoria.usuario_id,
+            RegistroAuditoria.evento, RegistroAuditoria.detalhe
+        ).filter(*_filtros(usuario_id, evento))
+        if cursor:
+            ts_ref, id_ref = cursor
+            query = query.filter(or_(
+                RegistroAuditoria.ts < ts_ref,
+                and_(RegistroAuditoria.ts == ts_ref, RegistroAuditoria.id < id_ref)
+            ))
+        return query.order_by(RegistroAuditoria.ts.desc(), RegistroAuditoria.id.desc()).limit(tamanho + 1).all()
+    finally:
+        session.close()
+
+def contar_auditoria(usuario_id=None, evento=None):
+    session = get_session()
+    try:
+        return session.query(func.count(RegistroAuditoria.id)).filter(*_filtros(usuario_id, evento)).scalar() or 0
+    finally:
+        session.close()
+
+def resumo_auditoria(usuario_id=None):
+    """Contagens diárias dos eventos já removidos pela retenção"""
+    session = get_session()
+    try:
+        query = session.query(ResumoAuditoria)
+        if usuario_id is not None:
+            query = query.filter(ResumoAuditoria.usuario_id == usuario_id)
+        return [
+            {'dia': r.dia, 'usuario_id': r.usuario_id or None, 'evento': r.evento, 'quantidade': r.quantidade}
+            for r in query.order_by(ResumoAuditoria.dia.desc())
+        ]
+    finally:
+        session.close()
+
+# Exportar funções
+__all__ = [
+    'registrar_evento',
+    'aguardar_gravacao',
+    'aplicar_retencao_auditoria',
+    'listar_auditoria',
+    'contar_auditoria',
+    'EVENTOS_AUDITORIA',
+    'resumo_auditoria'
+]
@@ -1,7 +1,8 @@
 import streamlit as st
-import bcrypt
 import datetime
-from database import get_session, Usuario, ConfigSistema
+from database import get_session, Usuario
+from auditoria import registrar_evento
+from senhas import gerar_hash, verificar_senha, precisa_rehash
 
 # Inicialização da sessão
 def init_session():
@@ -15,72 +16,61 @@ def init_session():
     if 'is_admin' not in st.session_state:
         st.session_state.is_admin = False
 
-# Funções de hash e verificação de senha
+# Funções de hash e verificação de senha (executadas no pool de threads de senhas.py)
 def hash_password(password):
     """Hash da senha usando bcrypt"""
-    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+    return gerar_hash(password)
 
 def verify_password(password, hashed):
     """Verifica se a senha corresponde ao hash"""
-    if hashed is None:
-        return False
-    if isinstance(hashed, str):
-        hashed_bytes = hashed.encode('utf-8')
-    else:
-        hashed_bytes = hashed
-    return bcrypt.checkpw(password.encode('utf-8'), hashed_bytes)
+    return verificar_senha(password, hashed)
 
-# Função para criar admin padrão
-def criar_admin_padrao():
-    """Cria usuário admin padrão se não existir"""
+# Função de autenticação CORRIGIDA
+def autenticar_usuario(username, password):
+    """Autentica um usuário"""
+    # O bcrypt roda sem conexão aberta: uma rajada de logins não esgota o pool do banco
     session = get_session()
     try:
-        admin = session.query(Usuario).filter_by(username='admin').first()
-        if not admin:
-            hashed_pw = hash_password('admin123')
-            admin = Usuario(
-                username='admin',
-                password_hash=hashed_pw,
-                email='admin@sistema.com',
-                nivel_acesso='admin',
-                ativo=True
-            )
-            session.add(admin)
-            session.commit()
-            print("✅ Admin padrão criado: admin / admin123")
+        user = session.query(
+            Usuario.id, Usuario.username, Usuario.nivel_acesso, Usuario.email, Usuario.password_hash
+        ).filter_by(username=username, ativo=True).first()
     except Exception as e:
-        session.rollback()
-        print(f"Erro ao criar admin: {e}")
+        print(f"Erro na autenticação: {e}")
+        return False, None
     finally:
         session.close()
 
-# Função de autenticação CORRIGIDA
-def autenticar_usuario(username, password):
-    """Autentica um usuário"""
-    session = get_session()
     try:
-        user = session.query(Usuario).filter_by(username=username, ativo=True).first()
-        if user and verify_password(password, user.password_hash):
-            # Atualizar último login
-            user.ultimo_login = datetime.datetime.utcnow()
-            session.commit()
-            
-            # Salvar os dados do usuário ANTES de fechar a sessão
-            user_data = {
-                'id': user.id,
-                'username': user.username,
-                'nivel_acesso': user.nivel_acesso,
-                'email': user.email
-            }
-            
-            return True, user_data
-        return False, None
+        if not user or not verify_password(password, user.password_hash):
+            return False, None
+
+        # Atualizar último login
+        valores = {Usuario.ultimo_login: datetime.datetime.utcnow()}
+        # Hash com custo diferente de BCRYPT_ROUNDS é refeito com a senha já validada
+        if precisa_rehash(user.password_hash):
+            valores[Usuario.password_hash] = hash_password(password)
     except Exception as e:
         print(f"Erro na autenticação: {e}")
         return False, None
+
+    session = get_session()
+    try:
+        session.query(Usuario).filter(Usuario.id == user.id).update(valores, synchronize_session=False)
+        session.commit()
+    except Exception as e:
+        session.rollback()
+        print(f"Erro ao registrar login: {e}")
     finally:
         session.close()
 
+    user_data = {
+        'id': user.id,
+        'username': user.username,
+        'nivel_acesso': user.nivel_acesso,
+        'email': user.email
+    }
+    return True, user_data
+
 # Funções para verificação de estado
 def check_auth():
     """Verifica se o usuário está autenticado"""
@@ -96,7 +86,6 @@ def is_admin():
 def login_page():
     """Renderiza a página de login"""
     init_session()
-    criar_admin_padrao()
     
     st.title("💰 Sistema de Análise Financeira Pessoal")
     st.markdown("---")
@@ -124,23 +113,12 @@ def login_page():
                             st.session_state.is_admin = (user_data['nivel_acesso'] == 'admin')
                             st.success(f"✅ Bem-vindo, {user_data['username']}!")
                             
-                            # Registrar login no sistema
-                            session = get_session()
-                            try:
-                                config = ConfigSistema(
-                                    chave=f'LOGIN_{user_data["username"]}_{datetime.datetime.now().strftime("%Y%m%d_%H%M%S")}',
-                                    valor='SUCESSO',
-                                    descricao=f'Login realizado por {user_data["username"]}'
-                                )
-                                session.add(config)
-                                session.commit()
-                            except Exception as e:
-                                print(f"Erro ao registrar login: {e}")
-                            finally:
-                                session.close()
+                            # Registrar login no audit_log (gravação assíncrona, fora do caminho do login)
+                            registrar_evento('LOGIN', user_data['id'], user_data['username'])
                             
                             st.rerun()
                         else:
+                            registrar_evento('LOGIN_FALHA', detalhe=username)
                             st.error("❌ Usuário ou senha incorretos")
             
             st.markdown("---")
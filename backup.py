@@ -0,0 +1,392 @@
+import io
+import gzip
+import json
+import tempfile
+import datetime
+from sqlalchemy import select, text, Table, Column, Integer, MetaData, DateTime, Boolean, Float
+from database import get_session, incrementar_versao_dados, Usuario, Transacao, Categoria, ConfigSistema, ParcelaPrevista
+from configuracao import incrementar_versao_config, invalidar_cache_config
+try:
+    import zstandard
+except Exception:
+    zstandard = None
+
+# Incrementar ao mudar o formato do arquivo ou as colunas das tabelas
+VERSAO_ESQUEMA_BACKUP = 1
+TAMANHO_LOTE_BACKUP = 5000
+TABELA_STAGING = 'restauracao_transacoes'
+
+# Nome exibido -> (modelo, filtrar por usuario_id, apenas administradores)
+TABELAS_BACKUP = {
+    "Usuários": (Usuario, False, True),
+    "Transações": (Transacao, True, False),
+    "Categorias": (Categoria, True, False),
+    "Configurações do Sistema": (ConfigSistema, False, True)
+}
+
+EXTENSOES = {'gzip': '.ndjson.gz', 'zstd': '.ndjson.zst'}
+
+def compressoes_disponiveis():
+    return ['gzip', 'zstd'] if zstandard is not None else ['gzip']
+
+def _serializar(valor):
+    if isinstance(valor, (datetime.datetime, datetime.date)):
+        return valor.isoformat()
+    return str(valor)
+
+def _linha(objeto):
+    return (json.dumps(objeto, ensure_ascii=False, default=_serializar) + '\n').encode('utf-8')
+
+def _abrir_compressor(destino, compressao):
+    if compressao == 'zstd':
+        if zstandard is None:
+            raise RuntimeError("Compressão zstd indisponível (pacote zstandard não instalado)")
+        return zstandard.ZstdCompressor(level=3).stream_writer(destino, closefd=False)
+    return gzip.GzipFile(fileobj=destino, mode='wb', compresslevel=6)
+
+def gravar_backup(destino, usuario_id, itens, compressao='gzip', metadata=None, tamanho_lote=TAMANHO_LOTE_BACKUP):
+    """Grava o backup em NDJSON comprimido no arquivo binário `destino`
+
+    Formato: uma linha de cabeçalho (versão do esquema e colunas de cada
+    tabela); para cada tabela, uma linha {"secao": nome}, as linhas de
+    dados como listas na ordem das colunas e {"fim_secao": nome,
+    "linhas": n}. As tabelas são lidas em lotes, então a memória não
+    depende do tamanho do backup. Retorna {tabela: linhas gravadas}.
+    """
+    tabelas = [(item,) + TABELAS_BACKUP[item] for item in itens if item in TABELAS_BACKUP]
+    contagem = {}
+
+    compressor = _abrir_compressor(destino, compressao)
+    session = get_session()
+    try:
+        compressor.write(_linha({
+            'formato': 'backup_financeiro',
+            'versao_esquema': VERSAO_ESQUEMA_BACKUP,
+            'data_backup': datetime.datetime.now().isoformat(),
+            'itens_incluidos': [item for item, *_ in tabelas],
+            'tabelas': {modelo.__tablename__: [c.name for c in modelo.__table__.columns] for _, modelo, _, _ in tabelas},
+            'metadata': metadata or {}
+        }))
+
+        for _, modelo, por_usuario, _ in tabelas:
+            tabela = modelo.__table__
+            nome = tabela.name
+            consulta = select(tabela).order_by(*tabela.primary_key.columns)
+            if por_usuario:
+                consulta = consulta.where(tabela.c.usuario_id == usuario_id)
+
+            compressor.write(_linha({'secao': nome}))
+            linhas = 0
+            bloco = []
+            for registro in session.execute(consulta.execution_options(yield_per=tamanho_lote)):
+                bloco.append(_linha(list(registro)))
+                if len(bloco) >= tamanho_lote:
+                    compressor.write(b''.join(bloco))
+                    linhas += len(bloco)
+                    bloco = []
+            if bloco:
+                compressor.write(b''.join(bloco))
+                linhas += len(bloco)
+            compressor.write(_linha({'fim_secao': nome, 'linhas': linhas}))
+            contagem[nome] = linhas
+    finally:
+        session.close()
+        compressor.close()
+
+    return contagem
+
+def gerar_backup_arquivo(usuario_id, itens, compressao='gzip', metadata=None):
+    """Gera o backup em um arquivo temporário; retorna (caminho, contagem por tabela)"""
+    arquivo = tempfile.NamedTemporaryFile(prefix='backup_financeiro_', suffix=EXTENSOES[compressao], delete=False)
+    try:
+        contagem = gravar_backup(arquivo, usuario_id, itens, compressao, metadata)
+    finally:
+        arquivo.close()
+    return arquivo.name, contagem
+
+def abrir_backup(arquivo):
+    """Abre um backup (gzip, zstd ou sem compressão) para leitura em modo texto, linha a linha"""
+    inicio = arquivo.read(4)
+    arquivo.seek(0)
+    if inicio[:2] == b'\x1f\x8b':
+        binario = gzip.GzipFile(fileobj=arquivo, mode='rb')
+    elif inicio == b'\x28\xb5\x2f\xfd':
+        if zstandard is None:
+            raise RuntimeError("Backup comprimido com zstd, mas o pacote zstandard não está instalado")
+        binario = io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(arquivo, closefd=False))
+    else:
+        binario = arquivo
+    return io.TextIOWrapper(binario, encoding='utf-8')
+
+# Chaves do backup JSON antigo (admin.backup_dados até a versão 1 do esquema) -> tabela
+_SECOES_LEGADO = {'usuarios': 'usuarios', 'transacoes': 'transacoes', 'categorias': 'categorias', 'configuracoes': 'config_sistema'}
+
+def ler_backup(texto, tamanho_lote=TAMANHO_LOTE_BACKUP):
+    """Lê o backup em lotes: gera (cabeçalho, tabela, lista de dicts)
+
+    Aceita o formato NDJSON de gravar_backup e o JSON indentado antigo
+    (carregado inteiro, pois esses arquivos eram gerados em memória).
+    """
+    primeira = texto.readline()
+    try:
+        cabecalho = json.loads(primeira)
+    except json.JSONDecodeError:
+        cabecalho = None
+
+    if not cabecalho or cabecalho.get('formato') != 'backup_financeiro':
+        dados = json.loads(primeira + texto.read())
+        cabecalho = {'versao_esquema': 0, 'metadata': dados.get('metadata', {})}
+        for chave, tabela in _SECOES_LEGADO.items():
+            registros = dados.get(chave) or []
+            for inicio in range(0, len(registros), tamanho_lote):
+                yield cabecalho, tabela, registros[inicio:inicio + tamanho_lote]
+        return
+
+    if cabecalho.get('versao_esquema', 0) > VERSAO_ESQUEMA_BACKUP:
+        raise ValueError(f"Backup com esquema versão {cabecalho['versao_esquema']} é mais novo que o suportado ({VERSAO_ESQUEMA_BACKUP})")
+
+    tabela, colunas, lote = None, None, []
+    for linha in texto:
+        if linha.startswith('['):
+            lote.append(dict(zip(colunas, json.loads(linha))))
+            if len(lote) >= tamanho_lote:
+                yield cabecalho, tabela, lote
+                lote = []
+            continue
+        marcador = json.loads(linha)
+        if 'secao' in marcador:
+            tabela = marcador['secao']
+            colunas = cabecalho['tabelas'][tabela]
+        elif 'fim_secao' in marcador:
+            if lote:
+                yield cabecalho, tabela, lote
+            lote = []
+
+def _conversor(tipo):
+    """Função de conversão de um valor lido do backup para o tipo da coluna"""
+    if isinstance(tipo, DateTime):
+        def converter(valor):
+            if valor is None or valor == '':
+                return None
+            return valor if isinstance(valor, datetime.datetime) else datetime.datetime.fromisoformat(valor)
+    elif isinstance(tipo, Boolean):
+        def converter(valor):
+            if valor is None or valor == '':
+                return None
+            return valor if isinstance(valor, bool) else str(valor).lower() in ('true', '1', 'sim', 't')
+    elif isinstance(tipo, (Float, Integer)):
+        numero = float if isinstance(tipo, Float) else int
+        def converter(valor):
+            if valor is None or valor == '':
+                return None
+            return numero(valor)
+    else:
+        def converter(valor):
+            return None if valor is None else str(valor)
+    return converter
+
+def _validar(registros, tabela, obrigatorias, fixos):
+    """Converte os tipos de cada registro; retorna (válidos, quantidade rejeitada)"""
+    conversores = [(c.name, _conversor(c.type)) for c in tabela.columns if c.name != 'id']
+    validos, rejeitados = [], 0
+    for registro in registros:
+        try:
+            linha = {nome: converter(registro.get(nome)) for nome, converter in conversores}
+        except (ValueError, TypeError):
+            rejeitados += 1
+            continue
+        linha.update(fixos)
+        if any(linha[c] is None for c in obrigatorias):
+            rejeitados += 1
+            continue
+        validos.append(linha)
+    return validos, rejeitados
+
+def _valor_copy(valor):
+    """Valor no formato texto do COPY do Postgres"""
+    if valor is None:
+        return '\\N'
+    if isinstance(valor, bool):
+        return 't' if valor else 'f'
+    if isinstance(valor, datetime.datetime):
+        return valor.isoformat()
+    return str(valor).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+def _valor_sqlite(valor):
+    """Data no mesmo formato texto que o SQLAlchemy grava no SQLite"""
+    return None if valor is None else valor.strftime('%Y-%m-%d %H:%M:%S.%f')
+
+def _carregar_staging(conn, staging, linhas):
+    """Carrega um lote na tabela temporária (COPY no Postgres, executemany nos demais)"""
+    if conn.dialect.name == 'postgresql':
+        colunas = [c.name for c in staging.columns]
+        buffer = io.StringIO()
+        for linha in linhas:
+            buffer.write('\t'.join(_valor_copy(linha.get(c)) for c in colunas) + '\n')
+        buffer.seek(0)
+        cursor = conn.connection.dbapi_connection.cursor()
+        try:
+            cursor.copy_expert(f"COPY {staging.name} ({', '.join(colunas)}) FROM STDIN", buffer)
+        finally:
+            cursor.close()
+    elif conn.dialect.name == 'sqlite':
+        # executemany direto no driver: evita o processamento de parâmetros linha a linha do SQLAlchemy
+        colunas = [c.name for c in staging.columns]
+        conversores = [_valor_sqlite if isinstance(c.type, DateTime) else None for c in staging.columns]
+        valores = [
+            tuple(f(linha.get(c)) if f else linha.get(c) for c, f in zip(colunas, conversores))
+            for linha in linhas
+        ]
+        cursor = conn.connection.dbapi_connection.cursor()
+        try:
+            cursor.executemany(
+                f"INSERT INTO {staging.name} ({', '.join(colunas)}) VALUES ({', '.join('?' * len(colunas))})",
+                valores
+            )
+        finally:
+            cursor.close()
+    else:
+        conn.execute(staging.insert(), linhas)
+
+def _criar_staging(conn):
+    """Tabela temporária com as colunas de transações (exceto id) e a ordem de leitura"""
+    staging = Table(
+        TABELA_STAGING, MetaData(),
+        Column('ordem', Integer),
+        *[Column(c.name, c.type) for c in Transacao.__table__.columns if c.name != 'id'],
+        prefixes=['TEMPORARY']
+    )
+    staging.drop(conn, checkfirst=True)
+    staging.create(conn)
+    return staging
+
+def _mesclar_staging(conn, staging):
+    """Insere da staging só as transações que ainda não existem
+
+    A chave de deduplicação é (usuario_id, data, descricao, valor), a
+    mesma de salvar_transacoes, então restaurar o mesmo backup duas vezes
+    não duplica nada. Retorna a quantidade inserida.
+    """
+    nomes = ', '.join(c.name for c in staging.columns if c.name != 'ordem')
+    inseridas = conn.execute(text(f"""
+        INSERT INTO transacoes ({nomes})
+        SELECT {nomes} FROM {staging.name} s
+        WHERE s.ordem IN (
+            SELECT MIN(ordem) FROM {staging.name}
+            GROUP BY data, COALESCE(descricao, ''), valor
+        )
+        AND NOT EXISTS (
+            SELECT 1 FROM transacoes t
+            WHERE t.usuario_id = s.usuario_id
+              AND t.data = s.data
+              AND COALESCE(t.descricao, '') = COALESCE(s.descricao, '')
+              AND t.valor = s.valor
+        )
+    """)).rowcount
+    staging.drop(conn)
+    return inseridas
+
+def _restaurar_pequena(session, modelo, registros, chave, fixos=None, atualizar=False):
+    """Restauração linha a linha para tabelas pequenas (categorias, configurações, usuários)"""
+    obrigatorias = {'categorias': ('nome',), 'config_sistema': ('chave',), 'usuarios': ('username', 'password_hash')}[modelo.__tablename__]
+    validos, rejeitados = _validar(registros, modelo.__table__, obrigatorias, fixos or {})
+    inseridos = 0
+    for linha in validos:
+        filtro = {c: linha[c] for c in chave}
+        existente = session.query(modelo).filter_by(**filtro).first()
+        if existente is None:
+            session.add(modelo(**linha))
+            inseridos += 1
+        elif atualizar:
+            for campo, valor in linha.items():
+                setattr(existente, campo, valor)
+    session.flush()
+    return inseridos, rejeitados
+
+def restaurar_backup(arquivo, usuario_id, itens, modo='mesclar', admin=False):
+    """Restaura um backup (NDJSON comprimido ou JSON antigo) em uma única transação
+
+    modo='mesclar' mantém os dados atuais e insere o que falta;
+    modo='substituir' apaga antes as transações/categorias do usuário.
+    Transações e categorias são sempre atribuídas a `usuario_id`
+    (remapeando o usuario_id original do backup). Usuários e
+    configurações só são restaurados por administradores. Retorna
+    {tabela: {'inseridas': n, 'rejeitadas': n}}.
+    """
+    tabelas = {TABELAS_BACKUP[item][0].__tablename__ for item in itens
+               if item in TABELAS_BACKUP and (admin or not TABELAS_BACKUP[item][2])}
+    resultado = {tabela: {'inseridas': 0, 'rejeitadas': 0} for tabela in tabelas}
+    agora = datetime.datetime.utcnow()
+
+    session = get_session()
+    try:
+        conn = session.connection()
+        if modo == 'substituir':
+            if 'transacoes' in tabelas:
+                session.query(Transacao).filter(Transacao.usuario_id == usuario_id).delete(synchronize_session=False)
+                session.query(ParcelaPrevista).filter(ParcelaPrevista.usuario_id == usuario_id).delete(synchronize_session=False)
+            if 'categorias' in tabelas:
+                session.query(Categoria).filter(Categoria.usuario_id == usuario_id).delete(synchronize_session=False)
+
+        # Transações vão em lotes para a staging; tabelas pequenas ficam para depois
+        staging = _criar_staging(conn) if 'transacoes' in tabelas else None
+        ordem, outros = 0, []
+        for _, tabela, lote in ler_backup(abrir_backup(arquivo)):
+            if tabela not in tabelas:
+                continue
+            if tabela != 'transacoes':
+                outros.append((tabela, lote))
+                continue
+            validos, rejeitadas = _validar(
+                lote, Transacao.__table__, ('data', 'valor'), {'usuario_id': usuario_id, 'updated_at': agora}
+            )
+            resultado['transacoes']['rejeitadas'] += rejeitadas
+            for linha in validos:
+                ordem += 1
+                linha['ordem'] = ordem
+            if validos:
+                _carregar_staging(conn, staging, validos)
+        if staging is not None:
+            resultado['transacoes']['inseridas'] = _mesclar_staging(conn, staging)
+
+        for tabela, lote in outros:
+            if tabela == 'categorias':
+                contagem = _restaurar_pequena(session, Categoria, lote, ('usuario_id', 'nome'), {'usuario_id': usuario_id})
+            elif tabela == 'config_sistema':
+                contagem = _restaurar_pequena(session, ConfigSistema, lote, ('chave',), atualizar=True)
+            else:
+                contagem = _restaurar_pequena(session, Usuario, lote, ('username',))
+            resultado[tabela]['inseridas'] += contagem[0]
+            resultado[tabela]['rejeitadas'] += contagem[1]
+
+        if 'transacoes' in tabelas or 'categorias' in tabelas:
+            incrementar_versao_dados(session, usuario_id)
+        if 'config_sistema' in tabelas:
+            incrementar_versao_config(session)
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+    if 'config_sistema' in tabelas:
+        invalidar_cache_config()
+    if resultado.get('transacoes', {}).get('inseridas') or modo == 'substituir':
+        from parcelas import reconstruir_cronograma
+        reconstruir_cronograma(usuario_id)
+
+    return resultado
+
+# Exportar funções
+__all__ = [
+    'VERSAO_ESQUEMA_BACKUP',
+    'TABELAS_BACKUP',
+    'EXTENSOES',
+    'compressoes_disponiveis',
+    'gravar_backup',
+    'gerar_backup_arquivo',
+    'abrir_backup',
+    'ler_backup',
+    'restaurar_backup'
+]
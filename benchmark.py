@@ -0,0 +1,224 @@
+import sys
+import os
+import time
+import random
+import tempfile
+import argparse
+import datetime
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+# Banco temporário isolado (precisa ser definido antes de importar database)
+_TMP_DIR = tempfile.mkdtemp(prefix="bench_financeiro_")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(_TMP_DIR, 'bench.db')}")
+
+from database import init_db, Transacao
+
+BANCOS = ["Itaú", "Nubank", "Inter", "Bradesco", "Santander"]
+CATEGORIAS = ['ALIMENTACAO', 'TRANSPORTE', 'MORADIA', 'SAUDE', 'LAZER', 'SERVICOS', 'SALARIO', None]
+CENTROS = ["Conta Corrente", "Transferencia", "Cartao Credito 1234"]
+
+def _cronometrar(nome, funcao, *args, **kwargs):
+    inicio = time.perf_counter()
+    resultado = funcao(*args, **kwargs)
+    print(f"  {nome}: {time.perf_counter() - inicio:.3f}s")
+    return resultado
+
+def popular_transacoes(usuario_id, n, lote=50000):
+    """Insere n transações sintéticas para o usuário"""
+    engine = init_db()
+    rnd = random.Random(42)
+    base = datetime.datetime.now() - datetime.timedelta(days=360)
+    tabela = Transacao.__table__
+    with engine.begin() as conn:
+        for inicio in range(0, n, lote):
+            linhas = []
+            for i in range(inicio, min(n, inicio + lote)):
+                data = base + datetime.timedelta(minutes=rnd.randint(0, 360 * 24 * 60))
+                valor = round(rnd.uniform(-500, 300), 2)
+                parcelado = rnd.random() < 0.1
+                linhas.append({
+                    'usuario_id': usuario_id,
+                    'data': data,
+                    'data_compra': data,
+                    'data_competencia': data,
+                    'descricao': f"LOJA {rnd.randint(1, 5000)}",
+                    'valor': valor,
+                    'tipo': 'CREDITO' if valor > 0 else 'DEBITO',
+                    'banco': rnd.choice(BANCOS),
+                    'centro_custo': rnd.choice(CENTROS),
+                    'categoria_ia': rnd.choice(CATEGORIAS),
+                    'parcelamento': parcelado,
+                    'parcela_atual': rnd.randint(1, 5) if parcelado else None,
+                    'parcela_total': 10 if parcelado else None,
+                    'processado': False
+                })
+            conn.execute(tabela.insert(), linhas)
+
+def bench_agregacoes(n):
+    """Compara métricas do dashboard em pandas (carregar tudo) vs SQL (GROUP BY)"""
+    from agregacoes import calcular_agregados, calcular_agregados_pandas
+    import dashboard
+
+    print(f"== Agregações do dashboard ({n} transações) ==")
+    _cronometrar("popular banco", popular_transacoes, 1, n)
+
+    filtros = {'periodo_meses': 12, 'fluxo': 'Fluxo de Caixa'}
+    carregar = getattr(dashboard.carregar_dados, '__wrapped__', dashboard.carregar_dados)
+
+    def caminho_pandas():
+        df = carregar(1, 12)
+        df['Data_Vis'] = df['Data_Compra']
+        return calcular_agregados_pandas(df)
+
+    resultado_pandas = _cronometrar("pandas (carregar + groupby)", caminho_pandas)
+    resultado_sql = _cronometrar("SQL (GROUP BY)", calcular_agregados, 1, filtros)
+    print(f"  gastos pandas={resultado_pandas['total_gastos']:.2f} sql={resultado_sql['total_gastos']:.2f}")
+
+def bench_restauracao(n):
+    """Backup NDJSON de n transações e restauração em massa em outro usuário (2x, idempotente)"""
+    from backup import gerar_backup_arquivo, restaurar_backup
+
+    print(f"== Backup/restauração ({n} transações) ==")
+    _cronometrar("popular banco", popular_transacoes, 1, n)
+    caminho, _ = _cronometrar("gerar backup (gzip)", gerar_backup_arquivo, 1, ["Transações"])
+    print(f"  tamanho do backup: {os.path.getsize(caminho) / 1024 / 1024:.1f} MB")
+
+    with open(caminho, 'rb') as arquivo:
+        resultado = _cronometrar("restaurar (mesclar, banco vazio)", restaurar_backup, arquivo, 2, ["Transações"])
+    print(f"  inseridas={resultado['transacoes']['inseridas']}")
+    with open(caminho, 'rb') as arquivo:
+        resultado = _cronometrar("restaurar novamente (idempotente)", restaurar_backup, arquivo, 2, ["Transações"])
+    print(f"  inseridas={resultado['transacoes']['inseridas']}")
+    os.remove(caminho)
+
+def _latencias_escrita(duracao, parar=None):
+    """Commits de uma linha cada, pelo tempo indicado (ou até `parar`); retorna as latências em ms"""
+    from database import get_session
+    latencias = []
+    fim = time.perf_counter() + duracao
+    while time.perf_counter() < fim and not (parar and parar.is_set()):
+        session = get_session()
+        try:
+            inicio = time.perf_counter()
+            session.add(Transacao(usuario_id=3, data=datetime.datetime.now(), descricao="ESCRITA CONCORRENTE",
+                                  valor=-1.0, tipo='DEBITO', banco='Itaú'))
+            session.commit()
+            latencias.append((time.perf_counter() - inicio) * 1000)
+        finally:
+            session.close()
+    return latencias
+
+def _resumo_latencias(nome, latencias, unidade="commits"):
+    ordenadas = sorted(latencias)
+    p50 = ordenadas[len(ordenadas) // 2] if ordenadas else 0.0
+    p95 = ordenadas[max(int(len(ordenadas) * 0.95) - 1, 0)] if ordenadas else 0.0
+    print(f"  {nome}: {len(ordenadas)} {unidade}, p50={p50:.1f}ms, p95={p95:.1f}ms, "
+          f"máx={ordenadas[-1] if ordenadas else 0.0:.1f}ms")
+
+def bench_snapshot(n):
+    """Snapshot online do SQLite com escritas concorrentes (latência dos commits durante a cópia)"""
+    import threading
+    import snapshots
+
+    snapshots.DIRETORIO_SNAPSHOTS = os.path.join(_TMP_DIR, "snapshots")
+    print(f"== Snapshot SQLite ({n} transações) ==")
+    _cronometrar("popular banco", popular_transacoes, 1, n)
+    print(f"  tamanho do banco: {os.path.getsize(snapshots.caminho_banco_sqlite()) / 1024 / 1024:.1f} MB")
+    _resumo_latencias("escritas sem snapshot", _latencias_escrita(3.0))
+
+    resultado = {}
+    terminou = threading.Event()
+
+    def executar():
+        try:
+            resultado.update(snapshots.criar_snapshot(retencao=1))
+        finally:
+            terminou.set()
+
+    thread = threading.Thread(target=executar)
+    thread.start()
+    latencias = _latencias_escrita(600.0, terminou)
+    thread.join()
+    print(f"  snapshot: {resultado['duracao']:.3f}s em {resultado['passos']} passos, "
+          f"{resultado['reinicios']} reinícios ({resultado['paginas']} páginas)")
+    _resumo_latencias("escritas durante o snapshot", latencias)
+
+def bench_login(n, concorrencia):
+    """n logins simultâneos (rajada) e latência de uma consulta leve do app durante a rajada"""
+    import threading
+    from concurrent.futures import ThreadPoolExecutor
+    from database import get_session, Usuario
+    from auth import autenticar_usuario
+    from senhas import gerar_hash, custo_do_hash, rounds_configurados, MAX_THREADS_SENHA
+
+    print(f"== Login ({n} logins, {concorrencia} sessões simultâneas, bcrypt custo {rounds_configurados()}, "
+          f"{MAX_THREADS_SENHA} threads de hash) ==")
+    init_db()
+    session = get_session()
+    try:
+        # Metade dos usuários com hash de custo antigo: rehash no primeiro login
+        for i in range(concorrencia):
+            session.add(Usuario(username=f"bench{i}", password_hash=gerar_hash(
+                "senha123", rounds=4 if i % 2 else None), nivel_acesso='usuario'))
+        session.commit()
+    finally:
+        session.close()
+
+    def login(i):
+        inicio = time.perf_counter()
+        sucesso, _ = autenticar_usuario(f"bench{i % concorrencia}", "senha123")
+        assert sucesso
+        return (time.perf_counter() - inicio) * 1000
+
+    terminou = threading.Event()
+    consultas = []
+
+    def consultar():
+        while not terminou.is_set():
+            session = get_session()
+            try:
+                inicio = time.perf_counter()
+                session.query(Transacao.id).filter(Transacao.usuario_id == 1).limit(1).all()
+                consultas.append((time.perf_counter() - inicio) * 1000)
+            finally:
+                session.close()
+            time.sleep(0.005)
+
+    sonda = threading.Thread(target=consultar)
+    sonda.start()
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concorrencia) as sessoes:
+        latencias = list(sessoes.map(login, range(n)))
+    duracao = time.perf_counter() - inicio
+    terminou.set()
+    sonda.join()
+
+    _resumo_latencias("login", latencias, "logins")
+    print(f"  vazão: {n / duracao:.1f} logins/s")
+    _resumo_latencias("consulta leve durante a rajada", consultas, "consultas")
+
+    session = get_session()
+    try:
+        custos = {custo_do_hash(u.password_hash) for u in session.query(Usuario).filter(Usuario.username.like("bench%"))}
+        print(f"  custos após os logins: {sorted(custos)}")
+    finally:
+        session.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks do sistema financeiro")
+    parser.add_argument("cenario", choices=["agregacoes", "restauracao", "snapshot", "login"])
+    parser.add_argument("-n", type=int, default=None,
+                        help="Número de transações sintéticas (padrão 1.000.000) ou de logins (padrão 200)")
+    parser.add_argument("--concorrencia", type=int, default=16, help="Sessões simultâneas no cenário de login")
+    args = parser.parse_args()
+    if args.n is None:
+        args.n = 200 if args.cenario == "login" else 1_000_000
+
+    if args.cenario == "agregacoes":
+        bench_agregacoes(args.n)
+    elif args.cenario == "restauracao":
+        bench_restauracao(args.n)
+    elif args.cenario == "snapshot":
+        bench_snapshot(args.n)
+    elif args.cenario == "login":
+        bench_login(args.n, args.concorrencia)
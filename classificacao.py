@@ -0,0 +1,120 @@
+import datetime
+from sqlalchemy import and_, or_, bindparam
+from database import unidade_de_trabalho, incrementar_versao_dados, Transacao, CacheClassificacaoUsuario
+from parcelas import normalizar_descricao
+
+TAMANHO_LOTE_NORMALIZACAO = 5000
+
+def salvar_categorias_manuais(usuario_id, categorias):
+    """Grava {transacao_id: categoria} de uma vez (executemany em uma transação); retorna quantas foram enviadas
+
+    Só altera transações do próprio usuário; updated_at é atualizado pelo onupdate da coluna.
+    """
+    if not categorias:
+        return 0
+    tabela = Transacao.__table__
+    atualizar = tabela.update().where(and_(
+        tabela.c.id == bindparam('b_id'),
+        tabela.c.usuario_id == usuario_id
+    )).values(categoria_manual=bindparam('b_categoria'))
+    with unidade_de_trabalho() as session:
+        session.execute(atualizar, [
+            {'b_id': int(transacao_id), 'b_categoria': categoria}
+            for transacao_id, categoria in categorias.items()
+        ])
+        incrementar_versao_dados(session, usuario_id)
+    return len(categorias)
+
+def preencher_descricao_normalizada(session, *condicoes, limite=None):
+    """Calcula descricao_normalizada das transações que ainda não a têm; retorna quantas foram preenchidas
+
+    Mantém updated_at (coluna derivada: não conta como alteração para a exportação incremental).
+    """
+    query = session.query(Transacao.id, Transacao.descricao).filter(
+        Transacao.descricao_normalizada.is_(None), *condicoes
+    )
+    if limite:
+        query = query.limit(limite)
+    linhas = query.all()
+    if not linhas:
+        return 0
+    chaves = normalizar_descricao([descricao for _, descricao in linhas]).str[:200]
+    tabela = Transacao.__table__
+    atualizar = tabela.update().where(tabela.c.id == bindparam('b_id')).values(
+        descricao_normalizada=bindparam('b_normalizada'),
+        updated_at=tabela.c.updated_at
+    )
+    session.execute(atualizar, [
+        {'b_id': transacao_id, 'b_normalizada': chave}
+        for (transacao_id, _), chave in zip(linhas, chaves)
+    ])
+    return len(linhas)
+
+def _normalizar_pendentes(usuario_id):
+    """Preenche, em lotes, as descrições normalizadas ainda vazias do usuário (importações antigas, restaurações)"""
+    while True:
+        with unidade_de_trabalho() as session:
+            preenchidas = preencher_descricao_normalizada(
+                session, Transacao.usuario_id == usuario_id, limite=TAMANHO_LOTE_NORMALIZACAO
+            )
+        if preenchidas < TAMANHO_LOTE_NORMALIZACAO:
+            return
+
+def aplicar_a_semelhantes(usuario_id, categorias):
+    """Aplica cada {transacao_id: categoria} a todas as transações do usuário com a mesma descrição normalizada
+
+    Um UPDATE por descrição (pelo índice (usuario_id, descricao_normalizada)),
+    tudo em uma transação. O mapeamento também vai para o cache do usuário
+    (cache_classificacao_usuario), de modo que as próximas importações dele
+    do mesmo estabelecimento sejam classificadas sem chamar a API. Retorna
+    quantas transações mudaram.
+    """
+    if not categorias:
+        return 0
+    with unidade_de_trabalho() as session:
+        descricoes = dict(session.query(Transacao.id, Transacao.descricao).filter(
+            Transacao.usuario_id == usuario_id,
+            Transacao.id.in_([int(transacao_id) for transacao_id in categorias])
+        ).all())
+    chaves = normalizar_descricao([descricoes.get(int(t)) for t in categorias]).str[:200]
+    por_chave = {}
+    for (transacao_id, categoria), chave in zip(categorias.items(), chaves):
+        if int(transacao_id) in descricoes and chave:
+            por_chave[chave] = categoria
+    if not por_chave:
+        return 0
+
+    _normalizar_pendentes(usuario_id)
+    agora = datetime.datetime.utcnow()
+    alteradas = 0
+    with unidade_de_trabalho() as session:
+        for chave, categoria in por_chave.items():
+            alteradas += session.query(Transacao).filter(
+                Transacao.usuario_id == usuario_id,
+                Transacao.descricao_normalizada == chave,
+                or_(Transacao.categoria_manual.is_(None), Transacao.categoria_manual != categoria)
+            ).update({Transacao.categoria_manual: categoria}, synchronize_session=False)
+
+        existentes = {
+            cache.descricao: cache
+            for cache in session.query(CacheClassificacaoUsuario).filter(
+                CacheClassificacaoUsuario.usuario_id == usuario_id,
+                CacheClassificacaoUsuario.descricao.in_(list(por_chave))
+            )
+        }
+        for chave, categoria in por_chave.items():
+            if chave in existentes:
+                existentes[chave].categoria = categoria
+                existentes[chave].updated_at = agora
+            else:
+                session.add(CacheClassificacaoUsuario(usuario_id=usuario_id, descricao=chave, categoria=categoria, updated_at=agora))
+        if alteradas:
+            incrementar_versao_dados(session, usuario_id)
+    return alteradas
+
+# Exportar funções
+__all__ = [
+    'salvar_categorias_manuais',
+    'preencher_descricao_normalizada',
+    'aplicar_a_semelhantes'
+]
@@ -0,0 +1,427 @@
+import os
+import zlib
+import datetime
+import threading
+import numpy as np
+import pandas as pd
+try:
+    from scipy import sparse
+except Exception:
+    sparse = None
+from sqlalchemy import func
+from database import get_session, Transacao
+from parcelas import normalizar_descricao, TAMANHO_LOTE_IN
+
+DIRETORIO_MODELOS = os.path.join('data', 'modelos')
+VERSAO_MODELO = 1
+N_FEATURES = 2 ** 17          # espaço do hashing de n-gramas
+NGRAMAS = (3, 4, 5)           # tamanhos dos n-gramas de caracteres
+ALPHA = 0.1                   # suavização do Naive Bayes
+MIN_ROTULOS = 20              # modelos com menos rótulos não são usados na previsão
+PESO_GLOBAL = 200             # com tantos rótulos, o modelo do usuário pesa o mesmo que o global
+LIMIAR_CONFIANCA_PADRAO = 0.8 # abaixo disso a linha vai para a API (CLASSIFICADOR_LOCAL_LIMIAR)
+FRACAO_CALIBRACAO = 5         # 1 em cada 5 rótulos (por id) calibra a temperatura no treino completo
+MAX_CALIBRACAO = 5000
+# Rótulos gravados pouco antes da marca podem ter sido confirmados depois da
+# última leitura; relê-los é inofensivo (a atualização é idempotente por id)
+MARGEM_MARCA = datetime.timedelta(seconds=5)
+
+_MODELOS_LOCK = threading.Lock()
+_MODELOS = {}
+_TREINOS_LOCK = threading.Lock()
+_TREINOS = {}  # chave -> thread do treino completo em segundo plano
+
+def disponivel():
+    return sparse is not None
+
+def _ngramas(texto):
+    texto = f" {texto} "
+    for n in NGRAMAS:
+        for i in range(len(texto) - n + 1):
+            yield texto[i:i + n]
+    for palavra in texto.split():
+        yield f"#{palavra}"
+
+def _matriz(normalizadas):
+    """Uma linha por descrição normalizada: log(1 + contagem) de cada n-grama (hash crc32, estável entre processos)"""
+    linhas, colunas = [], []
+    for i, texto in enumerate(normalizadas):
+        hashes = [zlib.crc32(ngrama.encode('utf-8')) % N_FEATURES for ngrama in _ngramas(texto)]
+        linhas.extend([i] * len(hashes))
+        colunas.extend(hashes)
+    matriz = sparse.csr_matrix(
+        (np.ones(len(colunas)), (linhas, colunas)),
+        shape=(len(normalizadas), N_FEATURES)
+    )
+    matriz.sum_duplicates()
+    matriz.data = np.log1p(matriz.data)
+    return matriz
+
+def _normalizadas(descricoes):
+    """Descrição normalizada sem os números soltos (códigos, datas, ids da operação), que não indicam categoria"""
+    return (
+        normalizar_descricao(list(descricoes))
+        .str.replace(r'\b\d+\b', ' ', regex=True)
+        .str.replace(r'\s+', ' ', regex=True)
+        .str.strip()
+        .to_numpy(dtype=str)
+    )
+
+def _softmax(logits):
+    logits = logits - logits.max(axis=1, keepdims=True)
+    exp = np.exp(logits)
+    return exp / exp.sum(axis=1, keepdims=True)
+
+class ModeloLocal:
+    """Naive Bayes multinomial sobre n-gramas com hashing, atualizável por transação"""
+
+    def __init__(self):
+        self.classes = []
+        self.contagens = sparse.csr_matrix((0, N_FEATURES))
+        self.ids = np.zeros(0, dtype=np.int64)       # transações contadas (ordenadas)
+        self.rotulos = np.zeros(0, dtype=np.int64)   # classe de cada id
+        self.marca = None                            # início da última leitura dos rótulos
+        self.temperatura = 1.0
+        self.rotulos_calibracao = 0
+        self._parametros = None
+
+    @property
+    def n_rotulos(self):
+        return len(self.ids)
+
+    def rotulos_de(self, ids):
+        """Categoria com que cada transação está contada no modelo (None se não estiver)"""
+        ids = np.asarray(ids, dtype=np.int64)
+        nomes = np.array(self.classes + [None], dtype=object)
+        indices = np.full(len(ids), -1, dtype=np.int64)
+        if len(self.ids):
+            posicoes = np.minimum(np.searchsorted(self.ids, ids), len(self.ids) - 1)
+            existentes = self.ids[posicoes] == ids
+            indices[existentes] = self.rotulos[posicoes[existentes]]
+        return nomes[indices]
+
+    def _indice_classe(self, categoria):
+        if categoria not in self.classes:
+            self.classes.append(categoria)
+            self.contagens = sparse.vstack([self.contagens, sparse.csr_matrix((1, N_FEATURES))]).tocsr()
+        return self.classes.index(categoria)
+
+    def aplicar(self, ids, descricoes, categorias):
+        """Ajusta as contagens para o rótulo atual de cada transação (None = sem rótulo); retorna quantas mudaram"""
+        ids = np.asarray(ids, dtype=np.int64)
+        novas = np.array([-1 if c is None else self._indice_classe(c) for c in categorias], dtype=np.int64)
+        antigas = np.full(len(ids), -1, dtype=np.int64)
+        if len(self.ids):
+            posicoes = np.minimum(np.searchsorted(self.ids, ids), len(self.ids) - 1)
+            existentes = self.ids[posicoes] == ids
+            antigas[existentes] = self.rotulos[posicoes[existentes]]
+        mudou = antigas != novas
+        if not mudou.any():
+            return 0
+
+        sai = mudou & (antigas >= 0)
+        entra = mudou & (novas >= 0)
+        normalizadas = _normalizadas(descricoes)
+        entradas = pd.DataFrame({
+            'descricao': np.concatenate([normalizadas[sai], normalizadas[entra]]),
+            'classe': np.concatenate([antigas[sai], novas[entra]]),
+            'peso': np.concatenate([-np.ones(sai.sum()), np.ones(entra.sum())])
+        }).groupby(['descricao', 'classe'], sort=False)['peso'].sum()
+        entradas = entradas[entradas != 0]
+        if len(entradas):
+            unicas, posicao = np.unique(entradas.index.get_level_values('descricao').to_numpy(dtype=str), return_inverse=True)
+            pesos = sparse.csr_matrix(
+                (entradas.to_numpy(), (entradas.index.get_level_values('classe').to_numpy(), posicao)),
+                shape=(len(self.classes), len(unicas))
+            )
+            self.contagens = (self.contagens + pesos @ _matriz(unicas)).tocsr()
+
+        manter = ~np.isin(self.ids, ids[mudou])
+        self.ids = np.concatenate([self.ids[manter], ids[entra]])
+        self.rotulos = np.concatenate([self.rotulos[manter], novas[entra]])
+        ordem = np.argsort(self.ids, kind='stable')
+        self.ids, self.rotulos = self.ids[ordem], self.rotulos[ordem]
+        self._parametros = None
+        return int(mudou.sum())
+
+    def logits(self, matriz):
+        if self._parametros is None:
+            contagens = np.maximum(self.contagens.toarray(), 0.0)
+            log_theta = np.log(contagens + ALPHA) - np.log(contagens.sum(axis=1, keepdims=True) + ALPHA * N_FEATURES)
+            # N-gramas nunca vistos no treino não entram na conta: pela suavização
+            # eles só puxariam para as classes com menos rótulos, dando confiança
+            # alta a estabelecimentos desconhecidos
+            log_theta[:, contagens.sum(axis=0) == 0] = 0.0
+            frequencia = np.bincount(self.rotulos, minlength=len(self.classes))
+            log_prior = np.where(
+                frequencia > 0,
+                np.log(frequencia + 1.0) - np.log(self.n_rotulos + len(self.classes)),
+                -np.inf
+            )
+            self._parametros = (np.ascontiguousarray(log_theta.T), log_prior)
+        log_theta, log_prior = self._parametros
+        return np.asarray(matriz @ log_theta) + log_prior
+
+    def probabilidades(self, matriz):
+        return _softmax(self.logits(matriz) / self.temperatura)
+
+def _calibrar_temperatura(logits, alvo):
+    """Temperatura que minimiza a log-verossimilhança negativa nos rótulos separados para calibração
+
+    Só suaviza (>= 1): o Naive Bayes já é confiante demais, e com rótulos
+    fáceis a calibração acertaria tudo e pediria probabilidades ainda mais extremas.
+    """
+    melhor, melhor_nll = 1.0, np.inf
+    for temperatura in np.geomspace(1, 100, 41):
+        probabilidades = _softmax(logits / temperatura)
+        nll = -np.mean(np.log(probabilidades[np.arange(len(alvo)), alvo] + 1e-12))
+        if nll < melhor_nll:
+            melhor, melhor_nll = float(temperatura), nll
+    return melhor
+
+def _chave(usuario_id):
+    return 'global' if usuario_id is None else f"usuario_{int(usuario_id)}"
+
+def _filtros(usuario_id):
+    return [] if usuario_id is None else [Transacao.usuario_id == usuario_id]
+
+def _treinar_completo(usuario_id):
+    inicio = datetime.datetime.utcnow()
+    session = get_session()
+    try:
+        linhas = session.query(
+            Transacao.id, Transacao.descricao, Transacao.categoria_manual
+        ).filter(*_filtros(usuario_id), Transacao.categoria_manual.isnot(None)).all()
+    finally:
+        session.close()
+
+    modelo = ModeloLocal()
+    modelo.marca = inicio
+    if not linhas:
+        return modelo
+    ids = np.array([linha.id for linha in linhas], dtype=np.int64)
+    descricoes = [linha.descricao for linha in linhas]
+    categorias = [linha.categoria_manual for linha in linhas]
+
+    # Treina sem uma fração dos rótulos, ajusta a temperatura nela e depois inclui tudo
+    calibracao = np.flatnonzero(ids % FRACAO_CALIBRACAO == 0)[:MAX_CALIBRACAO]
+    treino = np.setdiff1d(np.arange(len(ids)), calibracao)
+    if len(calibracao) >= 30 and len(treino) >= MIN_ROTULOS:
+        modelo.aplicar(ids[treino], [descricoes[i] for i in treino], [categorias[i] for i in treino])
+        conhecidas = [i for i in calibracao if categorias[i] in modelo.classes]
+        if conhecidas:
+            matriz = _matriz(_normalizadas([descricoes[i] for i in conhecidas]))
+            alvo = np.array([modelo.classes.index(categorias[i]) for i in conhecidas])
+            modelo.temperatura = _calibrar_temperatura(modelo.logits(matriz), alvo)
+    modelo.aplicar(ids, descricoes, categorias)
+    modelo.rotulos_calibracao = modelo.n_rotulos
+    return modelo
+
+def _atualizar_incremental(modelo, usuario_id):
+    """Aplica os rótulos alterados desde a marca; retorna (alteradas, precisa_treino_completo)
+
+    Lê só (id, categoria) das linhas alteradas desde a última verificação e
+    busca a descrição apenas das que mudaram de rótulo em relação ao modelo.
+    """
+    inicio = datetime.datetime.utcnow()
+    session = get_session()
+    try:
+        total_rotulos = session.query(func.count(Transacao.id)).filter(
+            *_filtros(usuario_id), Transacao.categoria_manual.isnot(None)
+        ).scalar() or 0
+        # Com o dobro de rótulos desde a calibração o modelo será substituído
+        # pelo treino completo (que refaz a temperatura): não vale aplicar
+        if total_rotulos >= 2 * max(modelo.rotulos_calibracao, MIN_ROTULOS):
+            return 0, True
+
+        query = session.query(Transacao.id, Transacao.categoria_manual).filter(*_filtros(usuario_id))
+        if modelo.marca is not None:
+            query = query.filter(Transacao.updated_at >= modelo.marca - MARGEM_MARCA)
+        linhas = query.all()
+        atuais = np.array([linha.categoria_manual for linha in linhas], dtype=object)
+        mudou = modelo.rotulos_de([linha.id for linha in linhas]) != atuais
+        mudaram = [linha for linha, alterada in zip(linhas, mudou) if alterada]
+        descricoes = {}
+        for posicao in range(0, len(mudaram), TAMANHO_LOTE_IN):
+            lote = [linha.id for linha in mudaram[posicao:posicao + TAMANHO_LOTE_IN]]
+            descricoes.update(session.query(Transacao.id, Transacao.descricao).filter(Transacao.id.in_(lote)).all())
+    finally:
+        session.close()
+
+    alteradas = 0
+    if mudaram:
+        alteradas = modelo.aplicar(
+            [linha.id for linha in mudaram],
+            [descricoes.get(linha.id) for linha in mudaram],
+            [linha.categoria_manual for linha in mudaram]
+        )
+    modelo.marca = inicio
+    # Transações apagadas ou restauradas com updated_at antigo não aparecem pela marca
+    return alteradas, modelo.n_rotulos != total_rotulos
+
+def _caminho(chave):
+    return os.path.join(DIRETORIO_MODELOS, f"{chave}.npz")
+
+def _salvar(chave, modelo):
+    os.makedirs(DIRETORIO_MODELOS, exist_ok=True)
+    caminho = _caminho(chave)
+    parcial = f"{caminho}.parcial"
+    contagens = modelo.contagens.tocsr()
+    with open(parcial, 'wb') as arquivo:
+        np.savez_compressed(
+            arquivo,
+            versao=VERSAO_MODELO,
+            n_features=N_FEATURES,
+            classes=np.array(modelo.classes, dtype=str),
+            dados=contagens.data,
+            indices=contagens.indices,
+            indptr=contagens.indptr,
+            ids=modelo.ids,
+            rotulos=modelo.rotulos,
+            marca=modelo.marca.isoformat() if modelo.marca else '',
+            temperatura=modelo.temperatura,
+            rotulos_calibracao=modelo.rotulos_calibracao
+        )
+    os.replace(parcial, caminho)
+
+def _carregar(chave):
+    caminho = _caminho(chave)
+    if not os.path.exists(caminho):
+        return None
+    try:
+        with np.load(caminho, allow_pickle=False) as dados:
+            if int(dados['versao']) != VERSAO_MODELO or int(dados['n_features']) != N_FEATURES:
+                return None
+            modelo = ModeloLocal()
+            modelo.classes = [str(c) for c in dados['classes']]
+            modelo.contagens = sparse.csr_matrix(
+                (dados['dados'], dados['indices'], dados['indptr']),
+                shape=(len(modelo.classes), N_FEATURES)
+            )
+            modelo.ids = dados['ids'].astype(np.int64)
+            modelo.rotulos = dados['rotulos'].astype(np.int64)
+            marca = str(dados['marca'])
+            modelo.marca = datetime.datetime.fromisoformat(marca) if marca else None
+            modelo.temperatura = float(dados['temperatura'])
+            modelo.rotulos_calibracao = int(dados['rotulos_calibracao'])
+            return modelo
+    except Exception as e:
+        print(f"Erro ao carregar modelo local {chave}: {e}")
+        return None
+
+def _treinar_em_segundo_plano(usuario_id):
+    chave = _chave(usuario_id)
+    try:
+        modelo = _treinar_completo(usuario_id)
+        with _MODELOS_LOCK:
+            _salvar(chave, modelo)
+            _MODELOS[chave] = modelo
+    except Exception as e:
+        print(f"Erro no treino do modelo local {chave}: {e}")
+
+def _agendar_treino_completo(usuario_id):
+    """Inicia o treino completo em uma thread (no máximo um por modelo); o modelo atual segue em uso"""
+    chave = _chave(usuario_id)
+    with _TREINOS_LOCK:
+        treino = _TREINOS.get(chave)
+        if treino is None or not treino.is_alive():
+            treino = threading.Thread(
+                target=_treinar_em_segundo_plano, args=(usuario_id,), name=f"treino_{chave}", daemon=True
+            )
+            _TREINOS[chave] = treino
+            treino.start()
+    return treino
+
+def atualizar_modelo(usuario_id=None, completo=False, em_segundo_plano=False):
+    """Modelo do usuário (usuario_id=None: global) atualizado com as categorias manuais atuais
+
+    Carrega do disco, aplica só os rótulos alterados desde o último treino e
+    retreina do zero quando a contagem de rótulos não bate ou dobrou desde a
+    última calibração. Grava em DIRETORIO_MODELOS se algo mudou. Com
+    em_segundo_plano, o treino completo roda em uma thread e é retornado o
+    último modelo (None se ainda não houver nenhum).
+    """
+    if not disponivel():
+        return None
+    chave = _chave(usuario_id)
+    with _MODELOS_LOCK:
+        modelo = None if completo else (_MODELOS.get(chave) or _carregar(chave))
+        alterado = False
+        precisa_completo = modelo is None
+        if modelo is not None:
+            alteradas, precisa_completo = _atualizar_incremental(modelo, usuario_id)
+            alterado = alteradas > 0
+        if precisa_completo and not em_segundo_plano:
+            modelo = _treinar_completo(usuario_id)
+            alterado = True
+        if alterado:
+            _salvar(chave, modelo)
+        if modelo is not None:
+            _MODELOS[chave] = modelo
+    if precisa_completo and em_segundo_plano:
+        _agendar_treino_completo(usuario_id)
+    return modelo
+
+def retreinar_modelos():
+    """Treino completo do modelo global e de cada usuário com categorias manuais; retorna {chave: rótulos}"""
+    session = get_session()
+    try:
+        usuarios = [u for (u,) in session.query(Transacao.usuario_id).filter(
+            Transacao.categoria_manual.isnot(None)
+        ).distinct()]
+    finally:
+        session.close()
+    resultado = {}
+    for usuario_id in [None] + usuarios:
+        modelo = atualizar_modelo(usuario_id, completo=True)
+        resultado[_chave(usuario_id)] = modelo.n_rotulos
+    return resultado
+
+def prever_categorias(usuario_id, descricoes, categorias_permitidas=None):
+    """Categoria mais provável e confiança calibrada de cada descrição, ou None sem modelo treinado
+
+    Combina o modelo do usuário e o global (peso do usuário cresce com a
+    quantidade de rótulos dele). Do modelo global só entram as
+    `categorias_permitidas` e as categorias que o próprio usuário já usou.
+    """
+    if not disponivel() or len(descricoes) == 0:
+        return None
+    # Treinos completos não bloqueiam a importação: vale o último modelo salvo
+    modelo_usuario = atualizar_modelo(usuario_id, em_segundo_plano=True)
+    modelo_global = atualizar_modelo(None, em_segundo_plano=True)
+    modelos = [m for m in (modelo_usuario, modelo_global) if m is not None and m.n_rotulos >= MIN_ROTULOS]
+    if not modelos:
+        return None
+    if len(modelos) == 2:
+        peso_usuario = modelo_usuario.n_rotulos / (modelo_usuario.n_rotulos + PESO_GLOBAL)
+        pesos = [peso_usuario, 1.0 - peso_usuario]
+    else:
+        pesos = [1.0]
+
+    unicas, inverso = np.unique(_normalizadas(descricoes), return_inverse=True)
+    matriz = _matriz(unicas)
+    classes = sorted(set().union(*(m.classes for m in modelos)))
+    total = np.zeros((len(unicas), len(classes)))
+    for modelo, peso in zip(modelos, pesos):
+        probabilidades = modelo.probabilidades(matriz)
+        if modelo is modelo_global and modelo is not modelo_usuario and categorias_permitidas is not None:
+            permitidas = set(categorias_permitidas) | set(modelo_usuario.classes if modelo_usuario else [])
+            mascara = np.array([c in permitidas for c in modelo.classes])
+            probabilidades = probabilidades * mascara
+            soma = probabilidades.sum(axis=1, keepdims=True)
+            probabilidades = np.divide(probabilidades, soma, out=np.zeros_like(probabilidades), where=soma > 0)
+        indices = [classes.index(c) for c in modelo.classes]
+        total[:, indices] += peso * probabilidades
+
+    melhores = total.argmax(axis=1)
+    confiancas = total[np.arange(len(unicas)), melhores]
+    return [classes[i] for i in melhores[inverso]], confiancas[inverso]
+
+# Exportar funções
+__all__ = [
+    'disponivel',
+    'atualizar_modelo',
+    'retreinar_modelos',
+    'prever_categorias',
+    'LIMIAR_CONFIANCA_PADRAO'
+]
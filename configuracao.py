@@ -0,0 +1,137 @@
+import time
+import threading
+from sqlalchemy import cast, Integer, String
+from database import get_session, ConfigSistema, CHAVE_BOOTSTRAP
+
+CHAVE_VERSAO = 'CONFIG_VERSAO'
+# Intervalo mínimo entre consultas da versão no banco (mudanças feitas por
+# outros processos aparecem em até este tempo; as deste processo, na hora)
+INTERVALO_VERIFICACAO = 5.0
+
+_CACHE_LOCK = threading.Lock()
+_CACHE = {'versao': None, 'verificado_em': 0.0, 'configs': {}}
+
+def _ler_versao(session):
+    valor = session.query(ConfigSistema.valor).filter(ConfigSistema.chave == CHAVE_VERSAO).scalar()
+    return valor or '0'
+
+def _carregar(session):
+    """Lê todas as configurações em uma consulta (a versão vem junto)"""
+    configs = {}
+    versao = '0'
+    for chave, valor, descricao in session.query(ConfigSistema.chave, ConfigSistema.valor, ConfigSistema.descricao):
+        if chave == CHAVE_VERSAO:
+            versao = valor or '0'
+        else:
+            configs[chave] = (valor, descricao)
+    return versao, configs
+
+def _configs():
+    """Configurações em cache; recarrega só quando a versão no banco mudar"""
+    agora = time.monotonic()
+    with _CACHE_LOCK:
+        if _CACHE['versao'] is not None and agora - _CACHE['verificado_em'] < INTERVALO_VERIFICACAO:
+            return _CACHE['configs']
+        versao_cache = _CACHE['versao']
+
+    session = get_session()
+    try:
+        if versao_cache is not None and _ler_versao(session) == versao_cache:
+            with _CACHE_LOCK:
+                _CACHE['verificado_em'] = agora
+                return _CACHE['configs']
+        versao, configs = _carregar(session)
+    finally:
+        session.close()
+
+    with _CACHE_LOCK:
+        _CACHE.update(versao=versao, verificado_em=agora, configs=configs)
+    return configs
+
+def invalidar_cache_config():
+    """Força a releitura das configurações na próxima consulta"""
+    with _CACHE_LOCK:
+        _CACHE.update(versao=None, verificado_em=0.0, configs={})
+
+def incrementar_versao_config(session):
+    """Incrementa CONFIG_VERSAO na sessão atual (chamar antes do commit de qualquer escrita em config_sistema)"""
+    session.flush()
+    atualizados = session.query(ConfigSistema).filter(ConfigSistema.chave == CHAVE_VERSAO).update(
+        {ConfigSistema.valor: cast(cast(ConfigSistema.valor, Integer) + 1, String)},
+        synchronize_session=False
+    )
+    if not atualizados:
+        session.add(ConfigSistema(chave=CHAVE_VERSAO, valor='1', descricao='Versão das configurações (controle de cache)'))
+
+def obter_config(chave, default=None):
+    valor = _configs().get(chave, (None, None))[0]
+    return default if valor is None else valor
+
+def obter_config_int(chave, default=0):
+    try:
+        return int(float(obter_config(chave, default)))
+    except (TypeError, ValueError):
+        return default
+
+def obter_config_float(chave, default=0.0):
+    try:
+        return float(obter_config(chave, default))
+    except (TypeError, ValueError):
+        return default
+
+def obter_config_bool(chave, default=False):
+    valor = obter_config(chave)
+    if valor is None:
+        return default
+    return str(valor).strip().lower() in ('true', '1', 'sim', 's', 'yes')
+
+def listar_configs():
+    """Todas as configurações (sem as linhas internas de versão/bootstrap), ordenadas pela chave"""
+    return [
+        {'chave': chave, 'valor': valor, 'descricao': descricao}
+        for chave, (valor, descricao) in sorted(_configs().items())
+        if chave != CHAVE_BOOTSTRAP
+    ]
+
+def definir_configs(valores, descricoes=None):
+    """Grava várias configurações em uma transação e invalida os caches"""
+    descricoes = descricoes or {}
+    session = get_session()
+    try:
+        existentes = {
+            cfg.chave: cfg
+            for cfg in session.query(ConfigSistema).filter(ConfigSistema.chave.in_(list(valores)))
+        }
+        for chave, valor in valores.items():
+            cfg = existentes.get(chave)
+            if cfg:
+                cfg.valor = str(valor)
+                if descricoes.get(chave):
+                    cfg.descricao = descricoes[chave]
+            else:
+                session.add(ConfigSistema(chave=chave, valor=str(valor), descricao=descricoes.get(chave) or ""))
+        incrementar_versao_config(session)
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+    invalidar_cache_config()
+
+def definir_config(chave, valor, descricao=None):
+    definir_configs({chave: valor}, {chave: descricao} if descricao else None)
+
+# Exportar funções
+__all__ = [
+    'CHAVE_VERSAO',
+    'obter_config',
+    'obter_config_int',
+    'obter_config_float',
+    'obter_config_bool',
+    'listar_configs',
+    'definir_config',
+    'definir_configs',
+    'incrementar_versao_config',
+    'invalidar_cache_config'
+]
@@ -1,7 +1,8 @@
 import pandas as pd
 import io
 import datetime
-from database import get_session, Transacao
+from database import get_session, Transacao, incrementar_versao_dados
+from parcelas import atualizar_cronograma, calcular_grupo_compra, normalizar_descricao, TAMANHO_LOTE_IN
 
 def _add_months(dt, months):
     year = dt.year + (dt.month - 1 + months) // 12
@@ -235,12 +236,34 @@ def salvar_transacoes(df_transacoes):
 
         existentes_set = set((d, desc, float(val)) for d, desc, val in existentes)
 
+        # Grupo de compra calculado em lote; parcelas já gravadas do mesmo
+        # grupo são duplicadas mesmo que a data da fatura seja outra
+        df_transacoes = df_transacoes.copy()
+        if 'parcelamento' in df_transacoes.columns and 'parcela_total' in df_transacoes.columns:
+            df_transacoes['grupo_compra'] = calcular_grupo_compra(df_transacoes)
+        else:
+            df_transacoes['grupo_compra'] = None
+        df_transacoes['descricao_normalizada'] = normalizar_descricao(df_transacoes['descricao']).str[:200].values
+        grupos = df_transacoes['grupo_compra'].dropna().unique().tolist()
+        parcelas_existentes = set()
+        for inicio in range(0, len(grupos), TAMANHO_LOTE_IN):
+            parcelas_existentes.update(session.query(
+                Transacao.grupo_compra, Transacao.parcela_atual
+            ).filter(
+                Transacao.usuario_id == usuario_id,
+                Transacao.grupo_compra.in_(grupos[inicio:inicio + TAMANHO_LOTE_IN])
+            ).all())
+
         novas_transacoes = []
+        novas_linhas = []
         for _, row in df_transacoes.iterrows():
             data_tx = _to_py_datetime(row['data'])
             chave = (data_tx, row['descricao'], float(row['valor']))
+            chave_parcela = None
+            if pd.notna(row['grupo_compra']) and pd.notna(row.get('parcela_atual')):
+                chave_parcela = (row['grupo_compra'], int(row['parcela_atual']))
 
-            if chave in existentes_set:
+            if chave in existentes_set or chave_parcela in parcelas_existentes:
                 transacoes_duplicadas += 1
                 continue
 
@@ -253,13 +276,23 @@ def salvar_transacoes(df_transacoes):
                 transacao_data['parcela_atual'] = None
             if 'parcela_total' in transacao_data and pd.isna(transacao_data['parcela_total']):
                 transacao_data['parcela_total'] = None
+            if pd.isna(transacao_data['grupo_compra']):
+                transacao_data['grupo_compra'] = None
+            if 'confianca_ia' in transacao_data and pd.isna(transacao_data['confianca_ia']):
+                transacao_data['confianca_ia'] = None
 
             novas_transacoes.append(Transacao(**transacao_data))
+            novas_linhas.append(transacao_data)
             existentes_set.add(chave)
+            if chave_parcela:
+                parcelas_existentes.add(chave_parcela)
             transacoes_salvas += 1
 
         if novas_transacoes:
             session.add_all(novas_transacoes)
+            # Cronograma de parcelas futuras (mesma transação da importação)
+            atualizar_cronograma(session, pd.DataFrame(novas_linhas))
+            incrementar_versao_dados(session, usuario_id)
             session.commit()
         
         return {
@@ -4,7 +4,19 @@ import plotly.express as px
 from plotly.subplots import make_subplots
 import streamlit as st
 from datetime import datetime, timedelta
-from database import get_session, Transacao
+from database import get_session, Transacao, obter_versao_dados
+from graficos import serie_linha, exibir_figura, painel_debug
+from parcelas import listar_compras_parceladas, projetar_compromissos
+from agregacoes import (
+    calcular_agregados, calcular_agregados_pandas, montar_condicoes, CATEGORIA_PADRAO,
+    calcular_evolucao_mensal, calcular_evolucao_mensal_pandas,
+    calcular_evolucao_diaria, calcular_evolucao_diaria_pandas,
+    calcular_gastos_categoria_mes, calcular_gastos_categoria_mes_pandas,
+    listar_parcelamentos_ativos, listar_parcelamentos_ativos_pandas,
+    obter_estatisticas_classificacao, expressao_data, aplicar_filtros_pandas,
+    calcular_limites_periodo, calcular_limites_periodo_pandas, listar_opcoes_filtro, listar_opcoes_filtro_pandas
+)
+from paginacao import aplicar_keyset, separar_pagina, controles_paginacao, navegacao_paginacao, reiniciar_paginacao
 import calendar
 
 @st.cache_data(ttl=300)
@@ -66,13 +78,387 @@ def carregar_dados(usuario_id, periodo_meses=12):
     finally:
         session.close()
 
-def criar_dashboard(df, usuario_id):
-    """Cria o dashboard com visualizações"""
+def _dados_filtrados_pandas(usuario_id, filtros):
+    """Linhas do período filtradas em pandas; só os fallbacks (SQL indisponível) carregam as linhas"""
+    return aplicar_filtros_pandas(carregar_dados(usuario_id, filtros.get('periodo_meses', 12)), filtros)
+
+@st.cache_data(ttl=300)
+def carregar_limites_periodo(usuario_id, periodo_meses, versao_dados):
+    """Total e limites de data do período (versao_dados entra só na chave do cache)"""
+    try:
+        return calcular_limites_periodo(usuario_id, periodo_meses)
+    except Exception as e:
+        print(f"Erro nos limites do período SQL, usando pandas: {e}")
+        return calcular_limites_periodo_pandas(carregar_dados(usuario_id, periodo_meses))
+
+@st.cache_data(ttl=300)
+def _opcoes_filtro(usuario_id, filtros, coluna):
+    try:
+        return listar_opcoes_filtro(usuario_id, filtros, coluna)
+    except Exception as e:
+        print(f"Erro nas opções de filtro SQL, usando pandas: {e}")
+        return listar_opcoes_filtro_pandas(_dados_filtrados_pandas(usuario_id, filtros), coluna)
+
+@st.cache_data(ttl=300)
+def _agregados_sql(usuario_id, filtros):
+    return calcular_agregados(usuario_id, filtros)
+
+def carregar_agregados(usuario_id, filtros):
+    """Agregações do dashboard via SQL, com fallback para pandas"""
+    try:
+        return _agregados_sql(usuario_id, filtros)
+    except Exception as e:
+        print(f"Erro nas agregações SQL, usando pandas: {e}")
+        return calcular_agregados_pandas(_dados_filtrados_pandas(usuario_id, filtros))
+
+SECOES_DASHBOARD = [
+    "📈 Análise Geral",
+    "📅 Evolução Mensal",
+    "🏦 Por Banco",
+    "📋 Detalhes"
+]
+
+# Dados de cada seção memorizados por estado dos filtros; as linhas só são
+# carregadas no fallback em pandas
+@st.cache_data(ttl=300)
+def _dados_evolucao(usuario_id, filtros):
+    try:
+        return calcular_evolucao_mensal(usuario_id, filtros)
+    except Exception as e:
+        print(f"Erro na evolução mensal SQL, usando pandas: {e}")
+        return calcular_evolucao_mensal_pandas(_dados_filtrados_pandas(usuario_id, filtros))
+
+@st.cache_data(ttl=300)
+def _dados_categoria_mes(usuario_id, filtros, data_limite):
+    try:
+        return calcular_gastos_categoria_mes(usuario_id, filtros, data_limite)
+    except Exception as e:
+        print(f"Erro no comparativo mensal SQL, usando pandas: {e}")
+        return calcular_gastos_categoria_mes_pandas(_dados_filtrados_pandas(usuario_id, filtros), data_limite)
+
+@st.cache_data(ttl=300)
+def _dados_parcelamentos(usuario_id, filtros):
+    try:
+        return listar_parcelamentos_ativos(usuario_id, filtros)
+    except Exception as e:
+        print(f"Erro nos parcelamentos SQL, usando pandas: {e}")
+        return listar_parcelamentos_ativos_pandas(_dados_filtrados_pandas(usuario_id, filtros))
+
+@st.cache_data(ttl=300)
+def _dados_evolucao_diaria(usuario_id, filtros):
+    try:
+        return calcular_evolucao_diaria(usuario_id, filtros)
+    except Exception as e:
+        print(f"Erro na evolução diária SQL, usando pandas: {e}")
+        return calcular_evolucao_diaria_pandas(_dados_filtrados_pandas(usuario_id, filtros))
+
+@st.cache_data(ttl=300)
+def _dados_compras_parceladas(usuario_id, filtros):
+    return listar_compras_parceladas(usuario_id, filtros.get('banco'), filtros.get('centro_custo'))
+
+@st.cache_data(ttl=300)
+def _dados_projecao_parcelas(usuario_id, filtros):
+    return projetar_compromissos(usuario_id, filtros.get('banco'), filtros.get('centro_custo'))
+
+def carregar_estatisticas_classificacao(usuario_id):
+    """Contagens de classificação (sidebar da classificação manual e página Exportar)
+
+    Vêm da linha de contadores do usuário: a cada rerun uma leitura por
+    chave primária (versão + contadores), sem cache em memória; a contagem
+    é refeita apenas depois de uma escrita nas transações do usuário.
+    """
+    return obter_estatisticas_classificacao(usuario_id)
+
+def _previsao_pelas_transacoes(df_parcelas):
+    """Parcelamentos ativos calculados a partir das próprias transações (fallback)"""
+    if df_parcelas.empty:
+        return pd.DataFrame()
+    restantes = df_parcelas['Parcela_Total'] - df_parcelas['Parcela_Atual']
+    return pd.DataFrame({
+        'Descrição': df_parcelas['Descrição'],
+        'Valor Parcela': df_parcelas['Valor'].abs(),
+        'Parcela': df_parcelas['Parcela_Atual'].astype(int).astype(str) + '/' + df_parcelas['Parcela_Total'].astype(int).astype(str),
+        'Próximas Parcelas': restantes.astype(int),
+        'Total Restante': df_parcelas['Valor'].abs() * restantes,
+        'Banco': df_parcelas['Banco'],
+        'Categoria': df_parcelas['Categoria']
+    })
+
+def _figura_pizza(gastos_por_categoria):
+    if gastos_por_categoria.empty:
+        return None
+    fig = go.Figure(data=[
+        go.Pie(
+            labels=gastos_por_categoria.index,
+            values=gastos_por_categoria.values,
+            hole=0.3,
+            textinfo='label+percent',
+            textposition='inside',
+            marker=dict(colors=px.colors.qualitative.Set3)
+        )
+    ])
+    
+    fig.update_layout(
+        title='',
+        height=400,
+        showlegend=True,
+        legend=dict(
+            orientation="h",
+            yanchor="bottom",
+            y=-0.2,
+            xanchor="center",
+            x=0.5
+        )
+    )
+    return fig
+
+def _figura_evolucao(evolucao, titulo_x):
+    if evolucao.empty:
+        return None
+    fig = go.Figure()
+    
+    if 'DEBITO' in evolucao.columns:
+        fig.add_trace(serie_linha(
+            evolucao.index,
+            evolucao['DEBITO'],
+            mode='lines+markers',
+            name='Gastos',
+            line=dict(color='red', width=3),
+            marker=dict(size=8)
+        ))
+    
+    if 'CREDITO' in evolucao.columns:
+        fig.add_trace(serie_linha(
+            evolucao.index,
+            evolucao['CREDITO'],
+            mode='lines+markers',
+            name='Ganhos',
+            line=dict(color='green', width=3),
+            marker=dict(size=8)
+        ))
+    
+    fig.update_layout(
+        title='',
+        xaxis_title=titulo_x,
+        yaxis_title='Valor (R$)',
+        height=400,
+        hovermode='x unified'
+    )
+    return fig
+
+def _figura_comparativo_mensal(df_12meses, meses_dt, meses):
+    if df_12meses.empty:
+        return None
+    fig = make_subplots(
+        rows=3, cols=4,
+        subplot_titles=meses,
+        vertical_spacing=0.15,
+        horizontal_spacing=0.1
+    )
+    
+    for idx, mes in enumerate(meses):
+        row = idx // 4 + 1
+        col = idx % 4 + 1
+        
+        # Filtrar dados do mês
+        dados_mes = df_12meses[df_12meses['Mes_Ano'] == meses_dt[idx].strftime('%Y-%m')]
+        gastos_categoria = dados_mes.set_index('Categoria')['Valor_Absoluto'].sort_index()
+        
+        if not gastos_categoria.empty:
+            fig.add_trace(
+                go.Bar(
+                    x=gastos_categoria.values,
+                    y=gastos_categoria.index,
+                    orientation='h',
+                    name=mes,
+                    marker_color='lightcoral'
+                ),
+                row=row, col=col
+            )
+        
+        fig.update_xaxes(title_text="Valor (R$)", row=row, col=col, range=[0, gastos_categoria.max() * 1.1 if not gastos_categoria.empty else 0])
+    
+    fig.update_layout(
+        height=900,
+        showlegend=False,
+        title_text="",
+        title_x=0.5
+    )
+    return fig
+
+def _figura_barras_banco(serie, rotulo_y, escala):
+    if serie.empty:
+        return None
+    return px.bar(
+        x=serie.index,
+        y=serie.values,
+        title="",
+        labels={'x': 'Banco', 'y': rotulo_y},
+        color=serie.values,
+        color_continuous_scale=escala
+    )
+
+def _secao_analise_geral(usuario_id, filtros, agregados):
+    # Gráfico 1: Gastos por Categoria (Pizza)
+    st.subheader("📊 Distribuição de Gastos por Categoria")
+    exibir_figura(
+        'pizza_categorias', usuario_id, filtros,
+        lambda: _figura_pizza(agregados['gastos_categoria']),
+        mensagem_vazia="Sem dados de gastos para exibir."
+    )
+    
+    # Gráfico 2: Evolução de Gastos e Ganhos (Linha)
+    st.subheader("📈 Evolução de Gastos e Ganhos")
+    granularidade = st.radio(
+        "Granularidade",
+        ["Mensal", "Diária"],
+        horizontal=True,
+        key="granularidade_evolucao"
+    )
+    
+    def construir():
+        if granularidade == "Diária":
+            dados = _dados_evolucao_diaria(usuario_id, filtros)
+            indice, titulo_x = 'Dia', 'Dia'
+        else:
+            dados = _dados_evolucao(usuario_id, filtros)
+            indice, titulo_x = 'Mes_Ano', 'Mês'
+        evolucao = dados.pivot_table(
+            index=indice, columns='Tipo', values='Valor_Absoluto', aggfunc='sum', fill_value=0
+        ).sort_index()
+        return _figura_evolucao(evolucao, titulo_x)
+    
+    exibir_figura(
+        f'evolucao_{granularidade.lower()}', usuario_id, filtros, construir,
+        mensagem_vazia="Dados insuficientes para evolução."
+    )
+
+def _secao_evolucao_mensal(usuario_id, filtros):
+    # Gráfico 3: Comparativo Mensal (12 meses lado a lado)
+    st.subheader("📅 Comparativo Mensal - Últimos 12 Meses")
+    
+    # Obter últimos 12 meses (baseado no início do mês)
+    hoje = datetime.now()
+    inicio_mes_atual = hoje.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    meses_dt = pd.date_range(end=inicio_mes_atual, periods=12, freq='MS')
+    meses = [d.strftime('%b/%Y') for d in meses_dt]
+    
+    # Gastos por categoria/mês dos últimos 12 meses
+    data_limite = meses_dt[0].to_pydatetime()
+    exibir_figura(
+        f'comparativo_mensal_{meses_dt[-1].strftime("%Y%m")}', usuario_id, filtros,
+        lambda: _figura_comparativo_mensal(_dados_categoria_mes(usuario_id, filtros, data_limite), meses_dt, meses),
+        mensagem_vazia="Dados insuficientes para os últimos 12 meses."
+    )
+
+def _secao_bancos(usuario_id, filtros, agregados):
+    # Gráfico 4: Comparativo entre Bancos
+    st.subheader("🏦 Análise por Banco")
+    
+    col1, col2 = st.columns(2)
+    
+    with col1:
+        # Gastos por banco
+        st.write("#### Gastos por Banco")
+        exibir_figura(
+            'gastos_banco', usuario_id, filtros,
+            lambda: _figura_barras_banco(agregados['gastos_banco'], 'Valor Gasto (R$)', 'Reds'),
+            mensagem_vazia="Sem gastos por banco."
+        )
+    
+    with col2:
+        # Ganhos por banco
+        st.write("#### Ganhos por Banco")
+        exibir_figura(
+            'ganhos_banco', usuario_id, filtros,
+            lambda: _figura_barras_banco(agregados['ganhos_banco'], 'Valor Ganho (R$)', 'Greens'),
+            mensagem_vazia="Sem ganhos por banco."
+        )
+
+def _secao_previsao(usuario_id, filtros, agregados):
+    # Previsão de Gastos Futuros
+    st.subheader("🔮 Previsão de Gastos Futuros")
+    
+    # Parcelas futuras a partir do cronograma materializado na importação
+    try:
+        df_previsao = _dados_compras_parceladas(usuario_id, filtros)
+        projecao = _dados_projecao_parcelas(usuario_id, filtros)
+    except Exception as e:
+        print(f"Erro ao ler cronograma de parcelas, usando transações: {e}")
+        df_previsao = _previsao_pelas_transacoes(_dados_parcelamentos(usuario_id, filtros))
+        projecao = pd.DataFrame()
+    
+    if not df_previsao.empty:
+        st.write("#### Parcelamentos em Andamento")
+        st.dataframe(
+            df_previsao,
+            use_container_width=True,
+            hide_index=True,
+            column_config={
+                "Valor Parcela": st.column_config.NumberColumn(
+                    "Valor Parcela (R$)",
+                    format="R$ %.2f"
+                ),
+                "Total Restante": st.column_config.NumberColumn(
+                    "Total Restante (R$)",
+                    format="R$ %.2f"
+                )
+            }
+        )
+        
+        # Calcular totais
+        col1, col2 = st.columns(2)
+        with col1:
+            total_mensal = projecao['Total'].iloc[0] if not projecao.empty else df_previsao['Valor Parcela'].sum()
+            st.metric("Total Mensal Parcelas", f"R$ {total_mensal:,.2f}")
+        
+        with col2:
+            total_restante = df_previsao['Total Restante'].sum()
+            st.metric("Total Restante", f"R$ {total_restante:,.2f}")
+        
+        if not projecao.empty:
+            st.write("#### Compromissos Futuros por Mês")
+            exibir_figura(
+                'projecao_parcelas', usuario_id, filtros,
+                lambda: px.bar(projecao, x='Mes_Ano', y='Total', labels={'Mes_Ano': 'Mês', 'Total': 'Parcelas (R$)'})
+            )
+    else:
+        st.info("Nenhum parcelamento ativo encontrado.")
+    
+    st.markdown("---")
+    
+    # Previsão com base em média móvel
+    st.write("#### Previsão Baseada em Histórico")
+    
+    if agregados['n_debitos'] >= 3:
+        dados_evolucao = _dados_evolucao(usuario_id, filtros)
+        gastos_mensais = dados_evolucao[dados_evolucao['Tipo'] == 'DEBITO'].sort_values('Mes_Ano')
+        media_gastos = gastos_mensais['Valor_Absoluto'].tail(6).mean()
+        
+        col1, col2, col3 = st.columns(3)
+        
+        for i, mes in enumerate(['Próximo Mês', '2 Meses', '3 Meses']):
+            with [col1, col2, col3][i]:
+                st.metric(
+                    f"Previsão {mes}", 
+                    f"R$ {media_gastos:,.2f}",
+                    delta=None
+                )
+    else:
+        st.info("Dados insuficientes para previsão histórica.")
+
+def criar_dashboard(usuario_id, periodo_meses=12):
+    """Cria o dashboard com visualizações; retorna False se não houver transações no período
+
+    Opções dos filtros, limites de data e agregações vêm de consultas SQL
+    pequenas: as linhas do período não são carregadas para o app.
+    """
+    versao_dados = obter_versao_dados(usuario_id)
+    limites = carregar_limites_periodo(usuario_id, periodo_meses, versao_dados)
     
     # Verificar se há dados
-    if df.empty:
-        st.warning("Nenhuma transação encontrada para o período selecionado.")
-        return pd.DataFrame()
+    if not limites['total']:
+        return False
     
     # Filtros
     st.sidebar.header("🔍 Filtros")
@@ -83,37 +469,21 @@ def criar_dashboard(df, usuario_id):
         options=["Fluxo de Caixa", "Fluxo de Competência"],
         index=0
     )
-
-    df = df.copy()
-    if fluxo == "Fluxo de Caixa":
-        df['Data_Vis'] = df['Data_Compra']
-    else:
-        df['Data_Vis'] = df['Data']  # data_competencia já está em Data
     
-    # Filtro de data
-    min_date = df['Data_Vis'].min().date()
-    max_date = df['Data_Vis'].max().date()
+    # Filtro de data (data de compra no Fluxo de Caixa, de competência no outro)
+    data_min, data_max = limites['datas'][fluxo]
+    min_date = data_min.date()
+    max_date = data_max.date()
 
     # Padrão: último mês completo de cartão de crédito (se houver)
     default_start = max_date - timedelta(days=90)
     default_end = max_date
-    if 'Centro_Custo' in df.columns:
-        df_cartao = df[df['Centro_Custo'].fillna('').str.startswith('Cartao Credito')]
-        if not df_cartao.empty:
-            max_cc = df_cartao['Data'].max().date()
-            default_start = max_cc.replace(day=1)
-            # último dia do mês
-            next_month = (max_cc.replace(day=1) + timedelta(days=32)).replace(day=1)
-            default_end = next_month - timedelta(days=1)
-
-    # Garantir limites válidos para o date_input
-    if default_start < min_date:
-        default_start = min_date
-    if default_end > max_date:
-        default_end = max_date
-    if default_start > default_end:
-        default_start = min_date
-        default_end = max_date
+    if limites['cartao_max'] is not None:
+        max_cc = limites['cartao_max'].date()
+        default_start = max_cc.replace(day=1)
+        # último dia do mês
+        next_month = (max_cc.replace(day=1) + timedelta(days=32)).replace(day=1)
+        default_end = next_month - timedelta(days=1)
 
     # Garantir limites válidos para o date_input
     if default_start < min_date:
@@ -143,36 +513,36 @@ def criar_dashboard(df, usuario_id):
         key="periodo_filtro"
     )
     
+    start_date, end_date = None, None
     if len(date_range) == 2:
         start_date, end_date = date_range
-        df = df[(df['Data_Vis'].dt.date >= start_date) & (df['Data_Vis'].dt.date <= end_date)]
+    
+    # Cada seletor lista os valores que restam com os filtros anteriores
+    filtros = {
+        'periodo_meses': periodo_meses,
+        'fluxo': fluxo,
+        'data_inicio': start_date,
+        'data_fim': end_date,
+        'versao_dados': versao_dados
+    }
     
     # Filtro de banco
-    bancos = ['Todos'] + sorted(df['Banco'].unique().tolist())
+    bancos = ['Todos'] + _opcoes_filtro(usuario_id, filtros, 'banco')
     banco_selecionado = st.sidebar.selectbox('Banco', bancos)
-    
-    if banco_selecionado != 'Todos':
-        df = df[df['Banco'] == banco_selecionado]
+    filtros['banco'] = banco_selecionado
     
     # Filtro de categoria
-    categorias = ['Todas'] + sorted(df['Categoria'].unique().tolist())
+    categorias = ['Todas'] + _opcoes_filtro(usuario_id, filtros, 'categoria')
     categoria_selecionada = st.sidebar.selectbox('Categoria', categorias)
-    
-    if categoria_selecionada != 'Todas':
-        df = df[df['Categoria'] == categoria_selecionada]
+    filtros['categoria'] = categoria_selecionada
 
     # Filtro de centro de custo
-    centros = ['Todos'] + sorted(df['Centro_Custo'].fillna('Não informado').unique().tolist())
+    centros = ['Todos'] + _opcoes_filtro(usuario_id, filtros, 'centro_custo')
     centro_selecionado = st.sidebar.selectbox('Centro de Custo', centros)
-    if centro_selecionado != 'Todos':
-        df = df[df['Centro_Custo'].fillna('Não informado') == centro_selecionado]
     
     # Filtro de tipo
     tipo_selecionado = st.sidebar.selectbox('Tipo', ['Todos', 'DEBITO', 'CREDITO'])
     
-    if tipo_selecionado != 'Todos':
-        df = df[df['Tipo'] == tipo_selecionado]
-    
     # Filtro de valor mínimo
     valor_min = st.sidebar.number_input(
         "Valor Mínimo (R$)", 
@@ -181,20 +551,37 @@ def criar_dashboard(df, usuario_id):
         step=10.0
     )
     
-    if valor_min > 0:
-        df = df[df['Valor_Absoluto'] >= valor_min]
-    
+    filtros = {
+        'periodo_meses': periodo_meses,
+        'fluxo': fluxo,
+        'data_inicio': start_date,
+        'data_fim': end_date,
+        'banco': banco_selecionado,
+        'categoria': categoria_selecionada,
+        'centro_custo': centro_selecionado,
+        'tipo': tipo_selecionado,
+        'valor_min': float(valor_min),
+        'versao_dados': versao_dados
+    }
+    if st.session_state.get('filtros_dashboard') != filtros:
+        reiniciar_paginacao('detalhes')
+    st.session_state['filtros_dashboard'] = filtros
+    agregados = carregar_agregados(usuario_id, filtros)
+
     # Métricas principais (saúde financeira)
     st.subheader("📊 Saúde Financeira (Resumo)")
     
-    total_gastos = df[df['Tipo'] == 'DEBITO']['Valor_Absoluto'].sum()
-    total_ganhos = df[df['Tipo'] == 'CREDITO']['Valor_Absoluto'].sum()
+    total_gastos = agregados['total_gastos']
+    total_ganhos = agregados['total_ganhos']
     saldo = total_ganhos - total_gastos
     taxa_gasto = (total_gastos / total_ganhos) if total_ganhos > 0 else 0.0
     taxa_poupanca = (saldo / total_ganhos) if total_ganhos > 0 else 0.0
-    dias_periodo = (df['Data_Vis'].max().date() - df['Data_Vis'].min().date()).days + 1 if not df.empty else 0
+    if agregados['data_min'] is not None and agregados['data_max'] is not None:
+        dias_periodo = (agregados['data_max'].date() - agregados['data_min'].date()).days + 1
+    else:
+        dias_periodo = 0
     gasto_medio_dia = (total_gastos / dias_periodo) if dias_periodo > 0 else 0.0
-    ticket_medio = df[df['Tipo'] == 'DEBITO']['Valor_Absoluto'].mean() if not df.empty else 0.0
+    ticket_medio = (total_gastos / agregados['n_debitos']) if agregados['n_debitos'] > 0 else 0.0
 
     col1, col2, col3 = st.columns(3)
     with col1:
@@ -215,7 +602,7 @@ def criar_dashboard(df, usuario_id):
     col_a, col_b = st.columns(2)
     with col_a:
         st.write("### 🔎 Principais Categorias de Gasto")
-        top_cats = df[df['Tipo'] == 'DEBITO'].groupby('Categoria')['Valor_Absoluto'].sum().sort_values(ascending=False).head(5)
+        top_cats = agregados['gastos_categoria'].head(5)
         if not top_cats.empty:
             st.dataframe(
                 top_cats.reset_index().rename(columns={'Valor': 'Total'}), 
@@ -226,7 +613,7 @@ def criar_dashboard(df, usuario_id):
             st.info("Sem gastos para exibir.")
     with col_b:
         st.write("### 🏦 Bancos com Mais Gastos")
-        top_bancos = df[df['Tipo'] == 'DEBITO'].groupby('Banco')['Valor_Absoluto'].sum().sort_values(ascending=False).head(5)
+        top_bancos = agregados['gastos_banco'].head(5)
         if not top_bancos.empty:
             st.dataframe(
                 top_bancos.reset_index().rename(columns={'Valor': 'Total'}), 
@@ -236,275 +623,87 @@ def criar_dashboard(df, usuario_id):
         else:
             st.info("Sem gastos para exibir.")
     
-    # Abas para diferentes visualizações
-    tab1, tab2, tab3, tab4 = st.tabs([
-        "📈 Análise Geral", 
-        "📅 Evolução Mensal", 
-        "🏦 Por Banco", 
-        "📋 Detalhes"
-    ])
-    
-    with tab1:
-        # Gráfico 1: Gastos por Categoria (Pizza)
-        st.subheader("📊 Distribuição de Gastos por Categoria")
-        
-        gastos_por_categoria = df[df['Tipo'] == 'DEBITO'].groupby('Categoria')['Valor_Absoluto'].sum()
-        
-        if not gastos_por_categoria.empty:
-            fig1 = go.Figure(data=[
-                go.Pie(
-                    labels=gastos_por_categoria.index,
-                    values=gastos_por_categoria.values,
-                    hole=0.3,
-                    textinfo='label+percent',
-                    textposition='inside',
-                    marker=dict(colors=px.colors.qualitative.Set3)
-                )
-            ])
-            
-            fig1.update_layout(
-                title='',
-                height=400,
-                showlegend=True,
-                legend=dict(
-                    orientation="h",
-                    yanchor="bottom",
-                    y=-0.2,
-                    xanchor="center",
-                    x=0.5
-                )
-            )
-            
-            st.plotly_chart(fig1, use_container_width=True)
-        else:
-            st.info("Sem dados de gastos para exibir.")
-        
-        # Gráfico 2: Evolução de Gastos e Ganhos (Linha)
-        st.subheader("📈 Evolução de Gastos e Ganhos")
-        
-        df_mensal = df.copy()
-        df_mensal['Mes_Ano'] = df_mensal['Data_Vis'].dt.strftime('%Y-%m')
-        
-        evolucao = df_mensal.groupby(['Mes_Ano', 'Tipo'])['Valor_Absoluto'].sum().unstack(fill_value=0)
-        
-        if not evolucao.empty:
-            fig2 = go.Figure()
-            
-            if 'DEBITO' in evolucao.columns:
-                fig2.add_trace(go.Scatter(
-                    x=evolucao.index,
-                    y=evolucao['DEBITO'],
-                    mode='lines+markers',
-                    name='Gastos',
-                    line=dict(color='red', width=3),
-                    marker=dict(size=8)
-                ))
-            
-            if 'CREDITO' in evolucao.columns:
-                fig2.add_trace(go.Scatter(
-                    x=evolucao.index,
-                    y=evolucao['CREDITO'],
-                    mode='lines+markers',
-                    name='Ganhos',
-                    line=dict(color='green', width=3),
-                    marker=dict(size=8)
-                ))
-            
-            fig2.update_layout(
-                title='',
-                xaxis_title='Mês',
-                yaxis_title='Valor (R$)',
-                height=400,
-                hovermode='x unified'
-            )
-            
-            st.plotly_chart(fig2, use_container_width=True)
-        else:
-            st.info("Dados insuficientes para evolução.")
-    
-    with tab2:
-        # Gráfico 3: Comparativo Mensal (12 meses lado a lado)
-        st.subheader("📅 Comparativo Mensal - Últimos 12 Meses")
-        
-        # Obter últimos 12 meses (baseado no início do mês)
-        hoje = datetime.now()
-        inicio_mes_atual = hoje.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-        meses_dt = pd.date_range(end=inicio_mes_atual, periods=12, freq='MS')
-        meses = [d.strftime('%b/%Y') for d in meses_dt]
-        
-        # Filtrar dados dos últimos 12 meses
-        data_limite = meses_dt[0]
-        df_12meses = df[df['Data_Vis'] >= data_limite].copy()
-        
-        if not df_12meses.empty:
-            # Criar subplots
-            fig3 = make_subplots(
-                rows=3, cols=4,
-                subplot_titles=meses,
-                vertical_spacing=0.15,
-                horizontal_spacing=0.1
-            )
-            
-            for idx, mes in enumerate(meses):
-                row = idx // 4 + 1
-                col = idx % 4 + 1
-                
-                # Filtrar dados do mês
-                mes_dt = meses_dt[idx]
-                dados_mes = df_12meses[
-                    (df_12meses['Data_Vis'].dt.month == mes_dt.month) & 
-                    (df_12meses['Data_Vis'].dt.year == mes_dt.year)
-                ]
-                
-                gastos_categoria = dados_mes[dados_mes['Tipo'] == 'DEBITO'].groupby('Categoria')['Valor_Absoluto'].sum()
-                
-                if not gastos_categoria.empty:
-                    fig3.add_trace(
-                        go.Bar(
-                            x=gastos_categoria.values,
-                            y=gastos_categoria.index,
-                            orientation='h',
-                            name=mes,
-                            marker_color='lightcoral'
-                        ),
-                        row=row, col=col
-                    )
-                
-                fig3.update_xaxes(title_text="Valor (R$)", row=row, col=col, range=[0, gastos_categoria.max() * 1.1 if not gastos_categoria.empty else 0])
-            
-            fig3.update_layout(
-                height=900,
-                showlegend=False,
-                title_text="",
-                title_x=0.5
-            )
-            
-            st.plotly_chart(fig3, use_container_width=True)
-        else:
-            st.info("Dados insuficientes para os últimos 12 meses.")
-    
-    with tab3:
-        # Gráfico 4: Comparativo entre Bancos
-        st.subheader("🏦 Análise por Banco")
-        
-        col1, col2 = st.columns(2)
-        
-        with col1:
-            # Gastos por banco
-            st.write("#### Gastos por Banco")
-            gastos_por_banco = df[df['Tipo'] == 'DEBITO'].groupby('Banco')['Valor_Absoluto'].sum()
-            
-            if not gastos_por_banco.empty:
-                fig4a = px.bar(
-                    x=gastos_por_banco.index,
-                    y=gastos_por_banco.values,
-                    title="",
-                    labels={'x': 'Banco', 'y': 'Valor Gasto (R$)'},
-                    color=gastos_por_banco.values,
-                    color_continuous_scale='Reds'
-                )
-                st.plotly_chart(fig4a, use_container_width=True)
-            else:
-                st.info("Sem gastos por banco.")
-        
-        with col2:
-            # Ganhos por banco
-            st.write("#### Ganhos por Banco")
-            ganhos_por_banco = df[df['Tipo'] == 'CREDITO'].groupby('Banco')['Valor'].sum()
-            
-            if not ganhos_por_banco.empty:
-                fig4b = px.bar(
-                    x=ganhos_por_banco.index,
-                    y=ganhos_por_banco.values,
-                    title="",
-                    labels={'x': 'Banco', 'y': 'Valor Ganho (R$)'},
-                    color=ganhos_por_banco.values,
-                    color_continuous_scale='Greens'
-                )
-                st.plotly_chart(fig4b, use_container_width=True)
-            else:
-                st.info("Sem ganhos por banco.")
-    
-    with tab4:
-        # Previsão de Gastos Futuros
-        st.subheader("🔮 Previsão de Gastos Futuros")
-        
-        # Identificar parcelamentos
-        df_parcelas = df[df['Parcelamento'] == 'Sim'].copy()
-        
-        if not df_parcelas.empty:
-            st.write("#### Parcelamentos em Andamento")
-            
-            parcelas_ativas = []
-            for _, row in df_parcelas.iterrows():
-                if row['Parcela']:
-                    atual, total = map(int, row['Parcela'].split('/'))
-                    if atual < total:
-                        parcelas_ativas.append({
-                            'Descrição': row['Descrição'],
-                            'Valor Parcela': abs(row['Valor']),
-                            'Parcela': row['Parcela'],
-                            'Próximas Parcelas': total - atual,
-                            'Total Restante': abs(row['Valor']) * (total - atual),
-                            'Banco': row['Banco'],
-                            'Categoria': row['Categoria']
-                        })
-            
-            if parcelas_ativas:
-                df_previsao = pd.DataFrame(parcelas_ativas)
-                st.dataframe(
-                    df_previsao,
-                    use_container_width=True,
-                    column_config={
-                        "Valor Parcela": st.column_config.NumberColumn(
-                            "Valor Parcela (R$)",
-                            format="R$ %.2f"
-                        ),
-                        "Total Restante": st.column_config.NumberColumn(
-                            "Total Restante (R$)",
-                            format="R$ %.2f"
-                        )
-                    }
-                )
-                
-                # Calcular totais
-                col1, col2 = st.columns(2)
-                with col1:
-                    total_mensal = df_previsao['Valor Parcela'].sum()
-                    st.metric("Total Mensal Parcelas", f"R$ {total_mensal:,.2f}")
-                
-                with col2:
-                    total_restante = df_previsao['Total Restante'].sum()
-                    st.metric("Total Restante", f"R$ {total_restante:,.2f}")
-            else:
-                st.info("Nenhum parcelamento ativo encontrado.")
-        else:
-            st.info("Nenhum parcelamento encontrado.")
-        
-        st.markdown("---")
-        
-        # Previsão com base em média móvel
-        st.write("#### Previsão Baseada em Histórico")
-        
-        df_previsao_historico = df[df['Tipo'] == 'DEBITO'].copy()
-        
-        if len(df_previsao_historico) >= 3:
-            df_previsao_historico['Mes'] = df_previsao_historico['Data_Vis'].dt.to_period('M')
-            
-            media_gastos = df_previsao_historico.groupby('Mes')['Valor_Absoluto'].sum().tail(6).mean()
-            
-            col1, col2, col3 = st.columns(3)
-            
-            for i, mes in enumerate(['Próximo Mês', '2 Meses', '3 Meses']):
-                with [col1, col2, col3][i]:
-                    st.metric(
-                        f"Previsão {mes}", 
-                        f"R$ {media_gastos:,.2f}",
-                        delta=None
-                    )
-        else:
-            st.info("Dados insuficientes para previsão histórica.")
-    
-    # Para tabelas, exibir a data conforme o fluxo escolhido
-    df['Data'] = df['Data_Vis']
-    return df
+    # Seções calculadas sob demanda: apenas a visualização selecionada é processada
+    secao = st.radio(
+        "Visualização",
+        SECOES_DASHBOARD,
+        horizontal=True,
+        label_visibility="collapsed",
+        key="secao_dashboard"
+    )
+
+    if secao == SECOES_DASHBOARD[0]:
+        _secao_analise_geral(usuario_id, filtros, agregados)
+    elif secao == SECOES_DASHBOARD[1]:
+        _secao_evolucao_mensal(usuario_id, filtros)
+    elif secao == SECOES_DASHBOARD[2]:
+        _secao_bancos(usuario_id, filtros, agregados)
+    else:
+        _secao_previsao(usuario_id, filtros, agregados)
+
+    if st.session_state.get('is_admin', False) and st.sidebar.checkbox("🐞 Debug de gráficos", key="debug_graficos_ativo"):
+        painel_debug()
+    return True
+
+def _buscar_pagina_detalhes(usuario_id, filtros, cursor, tamanho):
+    session = get_session()
+    try:
+        # Mesma data da visualização (compra no Fluxo de Caixa, competência no
+        # contrário) que o filtro de período e o caminho em pandas usam
+        data_vis = expressao_data(filtros.get('fluxo'))
+        query = session.query(Transacao, data_vis.label('data_vis')).filter(*montar_condicoes(usuario_id, filtros))
+        linhas, proximo = separar_pagina(
+            aplicar_keyset(query, cursor, tamanho, coluna_data=data_vis).all(), tamanho,
+            chave=lambda linha: (linha.data_vis, linha.Transacao.id)
+        )
+        dados = [{
+            'ID': t.id,
+            'Data': data,
+            'Data_Compra': t.data_compra or t.data,
+            'Descrição': t.descricao,
+            'Valor': t.valor,
+            'Tipo': t.tipo,
+            'Banco': t.banco,
+            'Centro_Custo': t.centro_custo,
+            'Categoria': t.categoria_ia or CATEGORIA_PADRAO,
+            'Confianca_IA': t.confianca_ia,
+            'Categoria_Manual': t.categoria_manual,
+            'Parcelamento': 'Sim' if t.parcelamento else 'Não',
+            'Parcela': f"{t.parcela_atual}/{t.parcela_total}" if t.parcelamento else None
+        } for t, data in linhas]
+        return pd.DataFrame(dados), proximo
+    finally:
+        session.close()
+
+def _pagina_detalhes_pandas(df, cursor, tamanho):
+    df_ordenado = df.sort_values(['Data', 'ID'], ascending=False)
+    if cursor:
+        data_ref, id_ref = cursor
+        df_ordenado = df_ordenado[(df_ordenado['Data'] < data_ref) | ((df_ordenado['Data'] == data_ref) & (df_ordenado['ID'] < id_ref))]
+    pagina = df_ordenado.head(tamanho + 1)
+    if len(pagina) > tamanho:
+        pagina = pagina.head(tamanho)
+        ultima = pagina.iloc[-1]
+        return pagina, (ultima['Data'], ultima['ID'])
+    return pagina, None
+
+def exibir_detalhes(usuario_id):
+    """Tabela detalhada paginada no servidor (keyset por data, id)"""
+    filtros = st.session_state.get('filtros_dashboard')
+    if filtros is None:
+        return
+
+    total = carregar_agregados(usuario_id, filtros)['total']
+    cursor, tamanho = controles_paginacao('detalhes', total)
+
+    try:
+        pagina, proximo = _buscar_pagina_detalhes(usuario_id, filtros, cursor, tamanho)
+    except Exception as e:
+        print(f"Erro na paginação SQL, usando pandas: {e}")
+        df_filtrado = _dados_filtrados_pandas(usuario_id, filtros)
+        # Para tabelas, exibir a data conforme o fluxo escolhido
+        df_filtrado['Data'] = df_filtrado['Data_Vis']
+        pagina, proximo = _pagina_detalhes_pandas(df_filtrado, cursor, tamanho)
+
+    st.dataframe(pagina, use_container_width=True, height=400, hide_index=True)
+    navegacao_paginacao('detalhes', proximo)
@@ -1,18 +1,25 @@
-from sqlalchemy import create_engine, Column, Integer, String, Float, DateTime, Text, Boolean
+from sqlalchemy import create_engine, Column, Integer, String, Float, DateTime, Text, Boolean, Index
 from sqlalchemy.engine import make_url
 from sqlalchemy.pool import NullPool
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 import datetime
 import os
+from contextlib import contextmanager
 import socket
 import threading
+import bcrypt
 
 Base = declarative_base()
 _ENGINE_LOCK = threading.Lock()
 _ENGINE = None
 _SESSIONMAKER = None
 _DB_INITIALIZED = False
+_INIT_LOCK = threading.Lock()
+
+# Incrementar ao mudar o que executar_bootstrap aplica (novas configurações padrão, migrações de dados)
+VERSAO_BOOTSTRAP = 4
+CHAVE_BOOTSTRAP = 'BOOTSTRAP'
 
 class Usuario(Base):
     __tablename__ = 'usuarios'
@@ -46,6 +53,9 @@ class Transacao(Base):
     parcela_total = Column(Integer)
     data_vencimento = Column(DateTime)
     processado = Column(Boolean, default=False)
+    grupo_compra = Column(String(16))  # mesma compra parcelada em faturas diferentes
+    descricao_normalizada = Column(String(200))  # parcelas.normalizar_descricao; chave de "transações semelhantes"
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
 
 class CacheClassificacao(Base):
     __tablename__ = 'cache_classificacao'
@@ -54,6 +64,18 @@ class CacheClassificacao(Base):
     categoria = Column(String(50), nullable=False)
     updated_at = Column(DateTime, default=datetime.datetime.utcnow)
 
+class CacheClassificacaoUsuario(Base):
+    """Categoria manual aplicada a uma descrição normalizada, válida só para as importações do usuário"""
+    __tablename__ = 'cache_classificacao_usuario'
+    id = Column(Integer, primary_key=True)
+    usuario_id = Column(Integer, nullable=False)
+    descricao = Column(String(200), nullable=False)  # parcelas.normalizar_descricao
+    categoria = Column(String(50), nullable=False)
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow)
+    __table_args__ = (
+        Index('ux_cache_classificacao_usuario_descricao', 'usuario_id', 'descricao', unique=True),
+    )
+
 class Categoria(Base):
     __tablename__ = 'categorias'
     id = Column(Integer, primary_key=True)
@@ -69,6 +91,241 @@ class ConfigSistema(Base):  # ADICIONE ESTA CLASSE
     valor = Column(Text)
     descricao = Column(String(200))
 
+class ParcelaPrevista(Base):
+    __tablename__ = 'parcelas_previstas'
+    id = Column(Integer, primary_key=True)
+    usuario_id = Column(Integer, nullable=False)
+    chave_compra = Column(String(40), nullable=False)  # grupo_compra da transação
+    numero_parcela = Column(Integer, nullable=False)
+    parcela_total = Column(Integer, nullable=False)
+    data_compra = Column(DateTime)
+    data_competencia = Column(DateTime, nullable=False)
+    descricao = Column(String(200))
+    valor = Column(Float, nullable=False)
+    banco = Column(String(50))
+    centro_custo = Column(String(100))
+    __table_args__ = (
+        Index('ix_parcelas_previstas_usuario_competencia', 'usuario_id', 'data_competencia'),
+        Index('ix_parcelas_previstas_usuario_chave', 'usuario_id', 'chave_compra'),
+    )
+
+class MarcaExportacao(Base):
+    __tablename__ = 'marcas_exportacao'
+    consumidor = Column(String(50), primary_key=True)
+    usuario_id = Column(Integer, primary_key=True, autoincrement=False)
+    ultimo_updated_at = Column(DateTime)
+    ultimo_id = Column(Integer)
+    exportado_em = Column(DateTime, default=datetime.datetime.utcnow)
+
+class ExecucaoManutencao(Base):
+    __tablename__ = 'execucoes_manutencao'
+    tarefa = Column(String(50), primary_key=True)
+    status = Column(String(20), nullable=False)  # executando | concluida | erro
+    ultimo_id = Column(Integer, default=0)       # maior id já processado (ponto de retomada)
+    id_maximo = Column(Integer, default=0)       # maior id existente quando a execução começou
+    total = Column(Integer, default=0)
+    processadas = Column(Integer, default=0)
+    alteradas = Column(Integer, default=0)
+    erro = Column(Text)
+    iniciado_em = Column(DateTime, default=datetime.datetime.utcnow)
+    atualizado_em = Column(DateTime, default=datetime.datetime.utcnow)
+
+class RegistroAuditoria(Base):
+    __tablename__ = 'audit_log'
+    id = Column(Integer, primary_key=True)
+    ts = Column(DateTime, nullable=False, default=datetime.datetime.utcnow)
+    usuario_id = Column(Integer)
+    evento = Column(String(30), nullable=False)
+    detalhe = Column(String(200))
+    __table_args__ = (
+        Index('ix_audit_log_usuario_ts', 'usuario_id', 'ts'),
+        Index('ix_audit_log_ts', 'ts'),
+    )
+
+class ResumoAuditoria(Base):
+    __tablename__ = 'audit_log_resumo'
+    dia = Column(String(10), primary_key=True)  # YYYY-MM-DD dos eventos agregados pela retenção
+    usuario_id = Column(Integer, primary_key=True, autoincrement=False)  # 0 = sem usuário
+    evento = Column(String(30), primary_key=True)
+    quantidade = Column(Integer, nullable=False, default=0)
+
+class VersaoDados(Base):
+    __tablename__ = 'versao_dados'
+    usuario_id = Column(Integer, primary_key=True, autoincrement=False)
+    versao = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+class EstatisticasClassificacao(Base):
+    """Contadores de classificação do usuário, válidos enquanto versao for a de versao_dados"""
+    __tablename__ = 'estatisticas_classificacao'
+    usuario_id = Column(Integer, primary_key=True, autoincrement=False)
+    versao = Column(Integer, nullable=False)
+    total = Column(Integer, nullable=False, default=0)
+    manual = Column(Integer, nullable=False, default=0)
+    ia = Column(Integer, nullable=False, default=0)
+    somente_ia = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+def _inicializar_banco(engine, db_url):
+    """Esquema, migrações, índices e bootstrap (uma vez por processo, sob _INIT_LOCK)"""
+    Base.metadata.create_all(engine)
+
+    # Migrações simples (SQLite e Postgres)
+    try:
+        from sqlalchemy import text
+        if db_url.startswith("sqlite:///"):
+            with engine.begin() as conn:
+                result = conn.execute(text("PRAGMA table_info(transacoes)"))
+                colunas = [row[1] for row in result.fetchall()]
+                if 'centro_custo' not in colunas:
+                    conn.execute(text("ALTER TABLE transacoes ADD COLUMN centro_custo VARCHAR(100)"))
+                if 'confianca_ia' not in colunas:
+                    conn.execute(text("ALTER TABLE transacoes ADD COLUMN confianca_ia FLOAT"))
+                if 'data_compra' not in colunas:
+                    conn.execute(text("ALTER TABLE transacoes ADD COLUMN data_compra DATETIME"))
+                if 'data_competencia' not in colunas:
+                    conn.execute(text("ALTER TABLE transacoes ADD COLUMN data_competencia DATETIME"))
+                if 'grupo_compra' not in colunas:
+                    conn.execute(text("ALTER TABLE transacoes ADD COLUMN grupo_compra VARCHAR(16)"))
+                if 'descricao_normalizada' not in colunas:
+                    conn.execute(text("ALTER TABLE transacoes ADD COLUMN descricao_normalizada VARCHAR(200)"))
+                if 'updated_at' not in colunas:
+                    conn.execute(text("ALTER TABLE transacoes ADD COLUMN updated_at DATETIME"))
+                    conn.execute(text("UPDATE transacoes SET updated_at = CURRENT_TIMESTAMP"))
+            # Criar cache_classificacao se nao existir
+            with engine.begin() as conn:
+                result = conn.execute(text("SELECT name FROM sqlite_master WHERE type='table' AND name='cache_classificacao'"))
+                if result.fetchone() is None:
+                    conn.execute(text("CREATE TABLE cache_classificacao (id INTEGER PRIMARY KEY, descricao VARCHAR(200) UNIQUE NOT NULL, categoria VARCHAR(50) NOT NULL, updated_at DATETIME)"))
+        else:
+            with engine.begin() as conn:
+                conn.execute(text("ALTER TABLE transacoes ADD COLUMN IF NOT EXISTS centro_custo VARCHAR(100)"))
+                conn.execute(text("ALTER TABLE transacoes ADD COLUMN IF NOT EXISTS confianca_ia FLOAT"))
+                conn.execute(text("ALTER TABLE transacoes ADD COLUMN IF NOT EXISTS data_compra TIMESTAMP"))
+                conn.execute(text("ALTER TABLE transacoes ADD COLUMN IF NOT EXISTS data_competencia TIMESTAMP"))
+                conn.execute(text("ALTER TABLE transacoes ADD COLUMN IF NOT EXISTS grupo_compra VARCHAR(16)"))
+                conn.execute(text("ALTER TABLE transacoes ADD COLUMN IF NOT EXISTS descricao_normalizada VARCHAR(200)"))
+                existe_updated_at = conn.execute(text(
+                    "SELECT 1 FROM information_schema.columns WHERE table_name='transacoes' AND column_name='updated_at'"
+                )).first()
+                if not existe_updated_at:
+                    conn.execute(text("ALTER TABLE transacoes ADD COLUMN updated_at TIMESTAMP"))
+                    conn.execute(text("UPDATE transacoes SET updated_at = CURRENT_TIMESTAMP AT TIME ZONE 'UTC'"))
+                conn.execute(text("CREATE TABLE IF NOT EXISTS cache_classificacao (id SERIAL PRIMARY KEY, descricao VARCHAR(200) UNIQUE NOT NULL, categoria VARCHAR(50) NOT NULL, updated_at TIMESTAMP)"))
+    except Exception as e:
+        print(f"Erro ao aplicar migração simples: {e}")
+
+    # Índices usados pelas agregações do dashboard
+    try:
+        from sqlalchemy import text
+        with engine.begin() as conn:
+            conn.execute(text("CREATE INDEX IF NOT EXISTS ix_transacoes_usuario_data ON transacoes (usuario_id, data)"))
+            conn.execute(text("CREATE INDEX IF NOT EXISTS ix_transacoes_usuario_grupo ON transacoes (usuario_id, grupo_compra)"))
+            conn.execute(text("CREATE INDEX IF NOT EXISTS ix_transacoes_usuario_updated ON transacoes (usuario_id, updated_at)"))
+            conn.execute(text("CREATE INDEX IF NOT EXISTS ix_transacoes_usuario_descricao_norm ON transacoes (usuario_id, descricao_normalizada)"))
+            # Data de visualização (agregacoes.expressao_data) com id: paginação keyset da tabela de detalhes
+            conn.execute(text("CREATE INDEX IF NOT EXISTS ix_transacoes_usuario_data_compra_vis ON transacoes (usuario_id, (coalesce(data_compra, data)), id)"))
+            conn.execute(text("CREATE INDEX IF NOT EXISTS ix_transacoes_usuario_data_competencia_vis ON transacoes (usuario_id, (coalesce(data_competencia, data)), id)"))
+    except Exception as e:
+        print(f"Erro ao criar índices: {e}")
+
+    session = _SESSIONMAKER()
+    try:
+        executar_bootstrap(session)
+    except Exception as e:
+        print(f"Erro no bootstrap do banco: {e}")
+        session.rollback()
+    finally:
+        session.close()
+
+def _configuracoes_padrao():
+    """Configurações criadas pelo bootstrap quando ainda não existem"""
+    return [
+        ConfigSistema(
+            chave='SISTEMA_ATIVO',
+            valor='true',
+            descricao='Sistema ativo'
+        ),
+        ConfigSistema(
+            chave='MAX_UPLOAD_MB',
+            valor='10',
+            descricao='Tamanho máximo upload (MB)'
+        ),
+        ConfigSistema(
+            chave='BACKUP_AUTOMATICO',
+            valor='false',
+            descricao='Backup automático'
+        ),
+        ConfigSistema(
+            chave='BACKUP_INTERVALO_HORAS',
+            valor='24',
+            descricao='Intervalo entre snapshots automáticos (horas)'
+        ),
+        ConfigSistema(
+            chave='SNAPSHOT_RETENCAO',
+            valor='7',
+            descricao='Quantidade de snapshots mantidos'
+        ),
+        ConfigSistema(
+            chave='AUDITORIA_RETENCAO_DIAS',
+            valor='90',
+            descricao='Dias de eventos de auditoria detalhados (os anteriores viram contagens diárias)'
+        ),
+        ConfigSistema(
+            chave='BCRYPT_ROUNDS',
+            valor=os.getenv('BCRYPT_ROUNDS', '12'),
+            descricao='Custo do bcrypt (senhas com outro custo são refeitas no próximo login)'
+        ),
+        ConfigSistema(
+            chave='CLASSIFICADOR_LOCAL_LIMIAR',
+            valor='0.8',
+            descricao='Confiança mínima do classificador local (abaixo dela a transação vai para a API)'
+        ),
+    ]
+
+def executar_bootstrap(session):
+    """Configurações padrão, admin inicial e migrações de dados pendentes
+
+    Roda uma vez por VERSAO_BOOTSTRAP: a versão aplicada fica na linha
+    BOOTSTRAP de config_sistema e, enquanto for a atual, só essa linha é
+    lida. Retorna True se algo foi aplicado.
+    """
+    marca = session.query(ConfigSistema).filter_by(chave=CHAVE_BOOTSTRAP).first()
+    if marca and marca.valor == str(VERSAO_BOOTSTRAP):
+        return False
+
+    existentes = {chave for (chave,) in session.query(ConfigSistema.chave).all()}
+    for config in _configuracoes_padrao():
+        if config.chave not in existentes:
+            session.add(config)
+
+    # Admin inicial apenas se não houver nenhum administrador
+    if session.query(Usuario.id).filter_by(nivel_acesso='admin').first() is None \
+            and session.query(Usuario.id).filter_by(username='admin').first() is None:
+        session.add(Usuario(
+            username='admin',
+            password_hash=bcrypt.hashpw('admin123'.encode('utf-8'), bcrypt.gensalt()).decode('utf-8'),
+            email='admin@sistema.com',
+            nivel_acesso='admin',
+            ativo=True
+        ))
+        print("✅ Admin padrão criado: admin / admin123")
+
+    # Logins antigos gravados como configuração vão para o audit_log
+    _migrar_logins_config(session)
+
+    # Categorias manuais gravadas no cache global vão para o cache do usuário
+    _migrar_cache_manual(session)
+
+    if marca is None:
+        session.add(ConfigSistema(chave=CHAVE_BOOTSTRAP, valor=str(VERSAO_BOOTSTRAP), descricao='Versão do bootstrap aplicada'))
+    else:
+        marca.valor = str(VERSAO_BOOTSTRAP)
+    from configuracao import incrementar_versao_config
+    incrementar_versao_config(session)
+    session.commit()
+    return True
+
 def init_db():
     """Inicializa o banco de dados"""
     global _ENGINE
@@ -125,75 +382,114 @@ def init_db():
         if _SESSIONMAKER is None:
             _SESSIONMAKER = sessionmaker(bind=engine)
     if not _DB_INITIALIZED:
-        Base.metadata.create_all(engine)
+        with _INIT_LOCK:
+            if not _DB_INITIALIZED:
+                _inicializar_banco(engine, db_url)
+                _DB_INITIALIZED = True
 
-        # Migrações simples (SQLite e Postgres)
-        try:
-            if db_url.startswith("sqlite:///"):
-                with engine.connect() as conn:
-                    result = conn.execute("PRAGMA table_info(transacoes)")
-                    colunas = [row[1] for row in result.fetchall()]
-                    if 'centro_custo' not in colunas:
-                        conn.execute("ALTER TABLE transacoes ADD COLUMN centro_custo VARCHAR(100)")
-                if 'confianca_ia' not in colunas:
-                    conn.execute("ALTER TABLE transacoes ADD COLUMN confianca_ia FLOAT")
-                if 'data_compra' not in colunas:
-                    conn.execute("ALTER TABLE transacoes ADD COLUMN data_compra DATETIME")
-                if 'data_competencia' not in colunas:
-                    conn.execute("ALTER TABLE transacoes ADD COLUMN data_competencia DATETIME")
-                # Criar cache_classificacao se nao existir
-                with engine.connect() as conn:
-                    result = conn.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='cache_classificacao'")
-                    if result.fetchone() is None:
-                        conn.execute("CREATE TABLE cache_classificacao (id INTEGER PRIMARY KEY, descricao VARCHAR(200) UNIQUE NOT NULL, categoria VARCHAR(50) NOT NULL, updated_at DATETIME)")
-            else:
-                from sqlalchemy import text
-                with engine.begin() as conn:
-                    conn.execute(text("ALTER TABLE transacoes ADD COLUMN IF NOT EXISTS centro_custo VARCHAR(100)"))
-                    conn.execute(text("ALTER TABLE transacoes ADD COLUMN IF NOT EXISTS confianca_ia FLOAT"))
-                    conn.execute(text("ALTER TABLE transacoes ADD COLUMN IF NOT EXISTS data_compra TIMESTAMP"))
-                    conn.execute(text("ALTER TABLE transacoes ADD COLUMN IF NOT EXISTS data_competencia TIMESTAMP"))
-                    conn.execute(text("CREATE TABLE IF NOT EXISTS cache_classificacao (id SERIAL PRIMARY KEY, descricao VARCHAR(200) UNIQUE NOT NULL, categoria VARCHAR(50) NOT NULL, updated_at TIMESTAMP)"))
-        except Exception as e:
-            print(f"Erro ao aplicar migração simples: {e}")
-    
-        # Criar configurações padrão
-        session = _SESSIONMAKER()
-        try:
-            # Verifica se já existem configurações
-            configs = session.query(ConfigSistema).first()
-            if not configs:
-                configuracoes_padrao = [
-                    ConfigSistema(
-                        chave='SISTEMA_ATIVO',
-                        valor='true',
-                        descricao='Sistema ativo'
-                    ),
-                    ConfigSistema(
-                        chave='MAX_UPLOAD_MB',
-                        valor='10',
-                        descricao='Tamanho máximo upload (MB)'
-                    ),
-                    ConfigSistema(
-                        chave='BACKUP_AUTOMATICO',
-                        valor='false',
-                        descricao='Backup automático'
-                    ),
-                ]
-                for config in configuracoes_padrao:
-                    session.add(config)
-                session.commit()
-        except Exception as e:
-            print(f"Erro ao criar configurações padrão: {e}")
-            session.rollback()
-        finally:
-            session.close()
-
-        _DB_INITIALIZED = True
-    
     return engine
 
+def _migrar_logins_config(session):
+    """Move as linhas LOGIN_<usuario>_<AAAAMMDD_HHMMSS> de config_sistema para audit_log"""
+    filtro = ConfigSistema.chave.like('LOGIN\\_%', escape='\\')
+    chaves = [chave for (chave,) in session.query(ConfigSistema.chave).filter(filtro)]
+    if not chaves:
+        return 0
+    usuarios = {username: id_ for id_, username in session.query(Usuario.id, Usuario.username)}
+    registros = []
+    for chave in chaves:
+        username, _, momento = chave[len('LOGIN_'):].rpartition('_')
+        username, _, dia = username.rpartition('_')
+        try:
+            # As chaves usavam a hora local; o audit_log grava em UTC
+            ts = datetime.datetime.strptime(f"{dia}_{momento}", '%Y%m%d_%H%M%S')
+            ts = ts.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+        except ValueError:
+            username, ts = chave[len('LOGIN_'):], datetime.datetime.utcnow()
+        registros.append({'ts': ts, 'usuario_id': usuarios.get(username), 'evento': 'LOGIN', 'detalhe': username[:200]})
+    session.execute(RegistroAuditoria.__table__.insert(), registros)
+    session.query(ConfigSistema).filter(filtro).delete(synchronize_session=False)
+    return len(registros)
+
+def _migrar_cache_manual(session):
+    """Move de cache_classificacao para cache_classificacao_usuario as categorias manuais aplicadas a semelhantes
+
+    Essas linhas têm como chave a descrição normalizada; cada uma vai para os
+    usuários que têm transações com essa descrição e essa categoria manual.
+    """
+    vinculos = session.query(
+        Transacao.usuario_id, CacheClassificacao.descricao, CacheClassificacao.categoria
+    ).join(Transacao, (Transacao.descricao_normalizada == CacheClassificacao.descricao)
+           & (Transacao.categoria_manual == CacheClassificacao.categoria)).distinct().all()
+    if not vinculos:
+        return 0
+    existentes = set(session.query(CacheClassificacaoUsuario.usuario_id, CacheClassificacaoUsuario.descricao))
+    agora = datetime.datetime.utcnow()
+    for usuario_id, descricao, categoria in vinculos:
+        if (usuario_id, descricao) not in existentes:
+            existentes.add((usuario_id, descricao))
+            session.add(CacheClassificacaoUsuario(usuario_id=usuario_id, descricao=descricao, categoria=categoria, updated_at=agora))
+    session.query(CacheClassificacao).filter(
+        CacheClassificacao.descricao.in_({descricao for _, descricao, _ in vinculos})
+    ).delete(synchronize_session=False)
+    return len(vinculos)
+
 def get_session():
     """Retorna uma sessão do banco de dados"""
     engine = init_db()
     return _SESSIONMAKER()
+
+@contextmanager
+def unidade_de_trabalho():
+    """Sessão de curta duração: commit ao fim do bloco, rollback em erro, conexão sempre devolvida
+
+    Nas páginas, leia os dados para objetos simples (linhas/dicts) dentro do
+    bloco e desenhe os widgets fora dele; escritas abrem um bloco próprio
+    apenas na ação do botão. Objetos não expiram no commit, então o que foi
+    lido continua acessível após o bloco.
+    """
+    init_db()
+    session = _SESSIONMAKER(expire_on_commit=False)
+    try:
+        yield session
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+def obter_versao_dados(usuario_id):
+    """Retorna a versão atual dos dados do usuário (0 se nunca houve escrita)"""
+    session = get_session()
+    try:
+        registro = session.query(VersaoDados).filter_by(usuario_id=usuario_id).first()
+        return registro.versao if registro else 0
+    finally:
+        session.close()
+
+def incrementar_versao_dados(session, usuario_id=None):
+    """Incrementa a versão dos dados na sessão atual (usuario_id=None: todos os usuários)
+
+    Deve ser chamada antes do commit de qualquer escrita em transações ou
+    categorias (que entram no relatório JSON), para invalidar caches
+    chaveados por versão. Na forma global, usuários
+    com transações e ainda sem linha em versao_dados (versão 0) passam
+    para a versão 1; chame antes de apagar as transações.
+    """
+    from sqlalchemy import select, exists, literal
+    agora = datetime.datetime.utcnow()
+    query = session.query(VersaoDados)
+    if usuario_id is not None:
+        query = query.filter(VersaoDados.usuario_id == usuario_id)
+    atualizados = query.update(
+        {VersaoDados.versao: VersaoDados.versao + 1, VersaoDados.updated_at: agora},
+        synchronize_session=False
+    )
+    if usuario_id is not None and not atualizados:
+        session.add(VersaoDados(usuario_id=usuario_id, versao=1, updated_at=agora))
+    elif usuario_id is None:
+        sem_versao = select(Transacao.usuario_id, literal(1), literal(agora)).where(
+            ~exists().where(VersaoDados.usuario_id == Transacao.usuario_id)
+        ).distinct()
+        session.execute(VersaoDados.__table__.insert().from_select(['usuario_id', 'versao', 'updated_at'], sem_versao))
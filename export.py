@@ -1,80 +1,123 @@
-import pandas as pd
-from datetime import datetime
-from database import get_session, Transacao, Usuario, Categoria
+from datetime import datetime, timedelta
+from sqlalchemy import func, case
+from openpyxl import Workbook
+from database import get_session, Transacao, Usuario, Categoria, MarcaExportacao
+from agregacoes import expressao_mes
 import io
+import csv
 import json
+import zipfile
+import tempfile
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except Exception:
+    pa = None
+    pq = None
 
-def exportar_para_excel(usuario_id):
-    """Exporta dados do usuário para Excel"""
+# Linhas lidas do banco por lote nas exportações em streaming
+TAMANHO_LOTE_EXPORT = 5000
+
+# exportar_para_csv mantém o arquivo em memória até este tamanho; acima, em disco
+LIMITE_MEMORIA_CSV = 8 * 1024 * 1024
+
+# updated_at é gravado quando o comando roda, não no commit: uma importação
+# longa pode confirmar linhas com updated_at anterior à marca de um delta já
+# lido. O delta relê essa janela antes da marca (o consumidor deduplica por id).
+MARGEM_MARCA_DELTA = timedelta(minutes=10)
+
+COLUNAS_CSV = [
+    'data', 'data_compra', 'data_competencia', 'descricao', 'valor', 'tipo', 'banco',
+    'centro_custo', 'categoria_ia', 'confianca_ia', 'categoria_manual', 'parcelamento',
+    'parcela_atual', 'parcela_total', 'data_vencimento', 'tags'
+]
+
+COLUNAS_EXCEL = [
+    'Data', 'Data Compra', 'Data Competencia', 'Descrição', 'Valor', 'Tipo', 'Banco',
+    'Centro de Custo', 'Categoria IA', 'Confianca IA', 'Categoria Manual', 'Parcelamento',
+    'Parcela', 'Tags'
+]
+
+# Colunas com poucos valores distintos são gravadas com dictionary encoding
+COLUNAS_DICIONARIO = {'tipo', 'banco', 'centro_custo', 'categoria_ia', 'categoria_manual'}
+
+# Limite de linhas de uma planilha do Excel (1.048.576, incluindo o cabeçalho)
+MAX_LINHAS_PLANILHA = 1048575
+
+def _linha_excel(t):
+    return [
+        t.data.strftime('%Y-%m-%d') if t.data else '',
+        t.data_compra.strftime('%Y-%m-%d') if t.data_compra else '',
+        t.data_competencia.strftime('%Y-%m-%d') if t.data_competencia else '',
+        t.descricao or '',
+        float(t.valor),
+        t.tipo or '',
+        t.banco or '',
+        t.centro_custo or '',
+        t.categoria_ia or '',
+        t.confianca_ia if t.confianca_ia is not None else '',
+        t.categoria_manual or '',
+        'Sim' if t.parcelamento else 'Não',
+        f"{t.parcela_atual}/{t.parcela_total}" if t.parcelamento and t.parcela_atual and t.parcela_total else '',
+        t.tags or ''
+    ]
+
+def resumo_categorias(session, usuario_id):
+    """Total, quantidade e exemplo por categoria (manual, senão IA)"""
+    categoria = func.coalesce(func.nullif(Transacao.categoria_manual, ''), Transacao.categoria_ia, '')
+    return session.query(
+        categoria, func.round(func.sum(Transacao.valor), 2), func.count(Transacao.id), func.min(Transacao.descricao)
+    ).filter(Transacao.usuario_id == usuario_id).group_by(categoria).order_by(categoria).all()
+
+def resumo_mensal(session, usuario_id):
+    """Total e número de transações por mês (YYYY-MM) da data da transação"""
+    mes = expressao_mes(Transacao.data, session.get_bind().dialect.name)
+    return session.query(
+        mes, func.round(func.sum(Transacao.valor), 2), func.count(Transacao.id)
+    ).filter(Transacao.usuario_id == usuario_id).group_by(mes).order_by(mes).all()
+
+def exportar_para_excel(usuario_id, progresso=None):
+    """Exporta dados do usuário para Excel
+
+    A planilha de transações é gravada em modo write-only (streaming) e
+    dividida em "Transações 2", "Transações 3"... ao passar do limite de
+    linhas do Excel; os resumos vêm de agregações SQL.
+    """
     session = get_session()
     
     try:
-        # Buscar transações do usuário
-        transacoes = session.query(Transacao).filter_by(usuario_id=usuario_id).all()
-        
-        if not transacoes:
+        if not session.query(Transacao.id).filter_by(usuario_id=usuario_id).first():
             return None
-        
-        # Preparar dados
-        dados = []
-        for t in transacoes:
-            dados.append({
-                'Data': t.data.strftime('%Y-%m-%d') if t.data else '',
-                'Data Compra': t.data_compra.strftime('%Y-%m-%d') if t.data_compra else '',
-                'Data Competencia': t.data_competencia.strftime('%Y-%m-%d') if t.data_competencia else '',
-                'Descrição': t.descricao or '',
-                'Valor': float(t.valor),
-                'Tipo': t.tipo or '',
-                'Banco': t.banco or '',
-                'Centro de Custo': t.centro_custo or '',
-                'Categoria IA': t.categoria_ia or '',
-                'Confianca IA': t.confianca_ia if t.confianca_ia is not None else '',
-                'Categoria Manual': t.categoria_manual or '',
-                'Parcelamento': 'Sim' if t.parcelamento else 'Não',
-                'Parcela': f"{t.parcela_atual}/{t.parcela_total}" if t.parcelamento and t.parcela_atual and t.parcela_total else '',
-                'Tags': t.tags or ''
-            })
-        
-        df = pd.DataFrame(dados)
-        
-        # Criar arquivo Excel
+
+        wb = Workbook(write_only=True)
+
+        # Planilha 1: Transações (uma nova a cada MAX_LINHAS_PLANILHA linhas)
+        planilha, linhas_planilha, numero_planilha = None, 0, 0
+        for t in _com_progresso(_query_transacoes(session, usuario_id), progresso):
+            if planilha is None or linhas_planilha >= MAX_LINHAS_PLANILHA:
+                numero_planilha += 1
+                nome = 'Transações' if numero_planilha == 1 else f'Transações {numero_planilha}'
+                planilha = wb.create_sheet(nome)
+                planilha.append(COLUNAS_EXCEL)
+                linhas_planilha = 0
+            planilha.append(_linha_excel(t))
+            linhas_planilha += 1
+
+        # Planilha 2: Resumo por categoria
+        planilha = wb.create_sheet('Resumo Categorias')
+        planilha.append(['Categoria', 'Total', 'Quantidade', 'Exemplo'])
+        for categoria, total, quantidade, exemplo in resumo_categorias(session, usuario_id):
+            planilha.append([categoria, float(total or 0), int(quantidade), exemplo or ''])
+
+        # Planilha 3: Resumo mensal
+        planilha = wb.create_sheet('Resumo Mensal')
+        planilha.append(['Mês', 'Total Mensal', 'Número de Transações'])
+        for mes, total, quantidade in resumo_mensal(session, usuario_id):
+            if mes:
+                planilha.append([mes, float(total or 0), int(quantidade)])
+
         output = io.BytesIO()
-        
-        with pd.ExcelWriter(output, engine='openpyxl') as writer:
-            # Planilha 1: Transações
-            df.to_excel(writer, sheet_name='Transações', index=False)
-            
-            # Planilha 2: Resumo por categoria
-            if not df.empty:
-                resumo_df = df.copy()
-                resumo_df['Categoria'] = resumo_df['Categoria Manual'].fillna(resumo_df['Categoria IA'])
-                
-                resumo_categoria = resumo_df.groupby('Categoria').agg({
-                    'Valor': ['sum', 'count'],
-                    'Descrição': 'first'
-                }).round(2)
-                
-                resumo_categoria.columns = ['Total', 'Quantidade', 'Exemplo']
-                resumo_categoria = resumo_categoria.reset_index()
-                resumo_categoria.to_excel(writer, sheet_name='Resumo Categorias', index=False)
-            
-            # Planilha 3: Resumo mensal
-            if not df.empty and 'Data' in df.columns:
-                try:
-                    df['Data'] = pd.to_datetime(df['Data'])
-                    df['Mês'] = df['Data'].dt.strftime('%Y-%m')
-                    
-                    resumo_mensal = df.groupby('Mês').agg({
-                        'Valor': 'sum',
-                        'Descrição': 'count'
-                    }).round(2)
-                    
-                    resumo_mensal.columns = ['Total Mensal', 'Número de Transações']
-                    resumo_mensal = resumo_mensal.reset_index()
-                    resumo_mensal.to_excel(writer, sheet_name='Resumo Mensal', index=False)
-                except:
-                    pass
-        
+        wb.save(output)
         output.seek(0)
         return output
         
@@ -84,130 +127,451 @@ def exportar_para_excel(usuario_id):
     finally:
         session.close()
 
-def exportar_para_csv(usuario_id):
-    """Exporta dados para CSV"""
+def _query_transacoes(session, usuario_id, tamanho_lote=TAMANHO_LOTE_EXPORT, por_data=False):
+    """Transações do usuário, lidas em lotes (cursor do lado do servidor no Postgres)
+
+    Na ordem de inserção (id); com por_data, na ordem (data, id), que usa o
+    índice (usuario_id, data) e mantém cada mês contíguo.
+    """
+    ordem = (Transacao.data, Transacao.id) if por_data else (Transacao.id,)
+    return session.query(
+        Transacao.id, Transacao.data, Transacao.data_compra, Transacao.data_competencia, Transacao.descricao,
+        Transacao.valor, Transacao.tipo, Transacao.banco, Transacao.centro_custo,
+        Transacao.categoria_ia, Transacao.confianca_ia, Transacao.categoria_manual,
+        Transacao.parcelamento, Transacao.parcela_atual, Transacao.parcela_total,
+        Transacao.data_vencimento, Transacao.tags
+    ).filter(
+        Transacao.usuario_id == usuario_id
+    ).order_by(*ordem).execution_options(yield_per=tamanho_lote)
+
+def _com_progresso(linhas, progresso, passo=TAMANHO_LOTE_EXPORT):
+    """Repassa as linhas chamando progresso(n) a cada `passo` linhas e ao final"""
+    if progresso is None:
+        yield from linhas
+        return
+    n = 0
+    for linha in linhas:
+        yield linha
+        n += 1
+        if n % passo == 0:
+            progresso(n)
+    progresso(n)
+
+def _linha_csv(t):
+    return [
+        t.data.strftime('%Y-%m-%d %H:%M:%S') if t.data else '',
+        t.data_compra.strftime('%Y-%m-%d %H:%M:%S') if t.data_compra else '',
+        t.data_competencia.strftime('%Y-%m-%d %H:%M:%S') if t.data_competencia else '',
+        t.descricao or '',
+        str(t.valor).replace('.', ','),
+        t.tipo or '',
+        t.banco or '',
+        t.centro_custo or '',
+        t.categoria_ia or '',
+        t.confianca_ia if t.confianca_ia is not None else '',
+        t.categoria_manual or '',
+        'Sim' if t.parcelamento else 'Não',
+        str(t.parcela_atual) if t.parcela_atual else '',
+        str(t.parcela_total) if t.parcela_total else '',
+        t.data_vencimento.strftime('%Y-%m-%d') if t.data_vencimento else '',
+        t.tags or ''
+    ]
+
+def iterar_csv(usuario_id, tamanho_lote=TAMANHO_LOTE_EXPORT, progresso=None):
+    """Gera o CSV (formato brasileiro, separador ';') em blocos de bytes UTF-8"""
+    session = get_session()
+    try:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, delimiter=';', lineterminator='\n')
+        writer.writerow(COLUNAS_CSV)
+
+        for i, t in enumerate(_com_progresso(_query_transacoes(session, usuario_id, tamanho_lote), progresso), 1):
+            writer.writerow(_linha_csv(t))
+            if i % tamanho_lote == 0:
+                yield buffer.getvalue().encode('utf-8')
+                buffer.seek(0)
+                buffer.truncate()
+
+        yield buffer.getvalue().encode('utf-8')
+    finally:
+        session.close()
+
+def exportar_para_csv(usuario_id, tamanho_memoria=LIMITE_MEMORIA_CSV):
+    """Exporta dados para CSV
+
+    Retorna um arquivo binário posicionado no início (leia com read() ou
+    shutil.copyfileobj), ou None sem dados. O CSV é escrito em blocos num
+    SpooledTemporaryFile: até `tamanho_memoria` bytes fica em memória,
+    acima disso vai para um arquivo temporário em disco.
+    """
     session = get_session()
     
     try:
-        # Buscar transações do usuário
-        transacoes = session.query(Transacao).filter_by(usuario_id=usuario_id).all()
-        
-        if not transacoes:
-            return None
-        
-        # Preparar dados para CSV
-        dados = []
-        for t in transacoes:
-            dados.append({
-                'data': t.data.strftime('%Y-%m-%d %H:%M:%S') if t.data else '',
-                'data_compra': t.data_compra.strftime('%Y-%m-%d %H:%M:%S') if t.data_compra else '',
-                'data_competencia': t.data_competencia.strftime('%Y-%m-%d %H:%M:%S') if t.data_competencia else '',
-                'descricao': t.descricao or '',
-                'valor': str(t.valor).replace('.', ','),
-                'tipo': t.tipo or '',
-                'banco': t.banco or '',
-                'centro_custo': t.centro_custo or '',
-                'categoria_ia': t.categoria_ia or '',
-                'confianca_ia': t.confianca_ia if t.confianca_ia is not None else '',
-                'categoria_manual': t.categoria_manual or '',
-                'parcelamento': 'Sim' if t.parcelamento else 'Não',
-                'parcela_atual': str(t.parcela_atual) if t.parcela_atual else '',
-                'parcela_total': str(t.parcela_total) if t.parcela_total else '',
-                'data_vencimento': t.data_vencimento.strftime('%Y-%m-%d') if t.data_vencimento else '',
-                'tags': t.tags or ''
-            })
-        
-        # Criar DataFrame
-        df = pd.DataFrame(dados)
-        
-        # Converter para CSV (formato brasileiro)
-        csv_buffer = io.StringIO()
-        df.to_csv(csv_buffer, index=False, sep=';', encoding='utf-8-sig')
-        csv_data = csv_buffer.getvalue()
-        
-        return csv_data.encode('utf-8')
-        
+        existe = session.query(Transacao.id).filter_by(usuario_id=usuario_id).first()
     except Exception as e:
         print(f"Erro ao exportar para CSV: {e}")
         return None
     finally:
         session.close()
 
-def exportar_relatorio_completo(usuario_id):
-    """Exporta relatório completo em JSON"""
+    if not existe:
+        return None
+
+    arquivo = tempfile.SpooledTemporaryFile(max_size=tamanho_memoria)
+    try:
+        for bloco in iterar_csv(usuario_id):
+            arquivo.write(bloco)
+        arquivo.seek(0)
+        return arquivo
+    except Exception as e:
+        arquivo.close()
+        print(f"Erro ao exportar para CSV: {e}")
+        return None
+
+def obter_marca_exportacao(consumidor, usuario_id):
+    """Retorna (updated_at, id) da última linha entregue ao consumidor, ou None"""
+    session = get_session()
+    try:
+        marca = session.query(MarcaExportacao).filter_by(consumidor=consumidor, usuario_id=usuario_id).first()
+        if marca is None or marca.ultimo_updated_at is None:
+            return None
+        return marca.ultimo_updated_at, marca.ultimo_id
+    finally:
+        session.close()
+
+def salvar_marca_exportacao(consumidor, usuario_id, marca):
+    """Grava a marca (updated_at, id) do consumidor; marca=None reinicia (próximo delta é completo)"""
+    session = get_session()
+    try:
+        registro = session.query(MarcaExportacao).filter_by(consumidor=consumidor, usuario_id=usuario_id).first()
+        if registro is None:
+            registro = MarcaExportacao(consumidor=consumidor, usuario_id=usuario_id)
+            session.add(registro)
+        registro.ultimo_updated_at, registro.ultimo_id = marca if marca else (None, None)
+        registro.exportado_em = datetime.utcnow()
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+def iterar_delta_csv(usuario_id, marca=None, resultado=None, tamanho_lote=TAMANHO_LOTE_EXPORT, margem=MARGEM_MARCA_DELTA):
+    """Gera em CSV as transações inseridas/alteradas depois da marca (updated_at, id)
+
+    Mesmo formato de iterar_csv com as colunas id e updated_at a mais, para
+    o consumidor aplicar como upsert. As linhas dos últimos `margem` antes
+    da marca são reenviadas. Se `resultado` (dict) for informado, recebe
+    'linhas', 'novas' (linhas depois da marca) e 'marca' (nova marca) ao final.
+    """
+    session = get_session()
+    try:
+        query = _query_transacoes(session, usuario_id, tamanho_lote).add_columns(
+            Transacao.updated_at
+        ).filter(Transacao.updated_at.isnot(None)).order_by(None).order_by(Transacao.updated_at, Transacao.id)
+        if marca:
+            query = query.filter(Transacao.updated_at >= marca[0] - margem)
+
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, delimiter=';', lineterminator='\n')
+        writer.writerow(['id'] + COLUNAS_CSV + ['updated_at'])
+
+        linhas, novas, nova_marca = 0, 0, marca
+        for t in query:
+            writer.writerow([t.id] + _linha_csv(t) + [t.updated_at.strftime('%Y-%m-%d %H:%M:%S.%f')])
+            linhas += 1
+            if marca is None or (t.updated_at, t.id) > tuple(marca):
+                novas += 1
+                nova_marca = (t.updated_at, t.id)
+            if linhas % tamanho_lote == 0:
+                yield buffer.getvalue().encode('utf-8')
+                buffer.seek(0)
+                buffer.truncate()
+
+        yield buffer.getvalue().encode('utf-8')
+        if resultado is not None:
+            resultado['linhas'] = linhas
+            resultado['novas'] = novas
+            resultado['marca'] = nova_marca
+    finally:
+        session.close()
+
+def exportar_delta_csv(usuario_id, consumidor):
+    """Exporta em CSV só o que mudou desde a última exportação do consumidor
+
+    Retorna (bytes, linhas novas, nova marca). Sem marca anterior o delta é
+    a exportação completa. A marca não é gravada aqui: depois que o
+    consumidor confirmar o recebimento, grave-a com salvar_marca_exportacao.
+    Exclusões não aparecem no delta.
+    """
+    try:
+        resultado = {}
+        dados = b''.join(iterar_delta_csv(usuario_id, obter_marca_exportacao(consumidor, usuario_id), resultado))
+        return dados, resultado['novas'], resultado['marca']
+    except Exception as e:
+        print(f"Erro ao exportar delta CSV: {e}")
+        return None, 0, None
+
+def _transacao_json(t):
+    return {
+        'id': t.id,
+        'data': t.data.strftime('%Y-%m-%d %H:%M:%S') if t.data else '',
+        'data_compra': t.data_compra.strftime('%Y-%m-%d %H:%M:%S') if t.data_compra else '',
+        'data_competencia': t.data_competencia.strftime('%Y-%m-%d %H:%M:%S') if t.data_competencia else '',
+        'descricao': t.descricao,
+        'valor': float(t.valor),
+        'tipo': t.tipo,
+        'banco': t.banco,
+        'centro_custo': t.centro_custo,
+        'categoria_ia': t.categoria_ia,
+        'confianca_ia': t.confianca_ia,
+        'categoria_manual': t.categoria_manual,
+        'parcelamento': t.parcelamento,
+        'parcela_atual': t.parcela_atual,
+        'parcela_total': t.parcela_total
+    }
+
+def _json(valor, nivel=1):
+    """json.dumps com indent=2, reindentado para o nível de aninhamento no relatório"""
+    texto = json.dumps(valor, indent=2, ensure_ascii=False, default=str)
+    return texto.replace('\n', '\n' + '  ' * nivel)
+
+def resumo_relatorio(session, usuario_id):
+    """Totais de gastos/ganhos, saldo e média mensal de gastos calculados no banco"""
+    gastos, ganhos, total = session.query(
+        func.sum(case((Transacao.valor < 0, Transacao.valor), else_=0)),
+        func.sum(case((Transacao.valor > 0, Transacao.valor), else_=0)),
+        func.count(Transacao.id)
+    ).filter(Transacao.usuario_id == usuario_id).one()
+    if not total:
+        return {}
+
+    mes = expressao_mes(Transacao.data, session.get_bind().dialect.name)
+    por_mes = session.query(
+        mes.label('mes'), func.sum(func.abs(Transacao.valor)).label('total')
+    ).filter(
+        Transacao.usuario_id == usuario_id,
+        Transacao.valor < 0,
+        Transacao.data.isnot(None)
+    ).group_by(mes).subquery()
+    media_mensal = session.query(func.avg(por_mes.c.total)).scalar()
+
+    gastos = float(gastos or 0)
+    ganhos = float(ganhos or 0)
+    return {
+        'total_gastos': abs(gastos),
+        'total_ganhos': ganhos,
+        'saldo': ganhos + gastos,  # gastos é negativo
+        'media_mensal': float(media_mensal or 0.0)
+    }
+
+def iterar_relatorio_json(usuario_id, tamanho_lote=TAMANHO_LOTE_EXPORT, progresso=None):
+    """Gera o relatório completo em JSON (indent=2) em blocos de bytes
+
+    As transações são lidas e serializadas em lotes; o resumo vem de
+    agregações SQL, então o relatório nunca fica inteiro em memória.
+    """
     session = get_session()
-    
     try:
-        # Buscar dados do usuário
         usuario = session.query(Usuario).filter_by(id=usuario_id).first()
-        transacoes = session.query(Transacao).filter_by(usuario_id=usuario_id).all()
+        total_transacoes = session.query(func.count(Transacao.id)).filter(Transacao.usuario_id == usuario_id).scalar()
         categorias = session.query(Categoria).filter_by(usuario_id=usuario_id).all()
-        
-        # Preparar relatório
-        relatorio = {
-            'metadata': {
-                'usuario': usuario.username if usuario else '',
-                'data_exportacao': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                'total_transacoes': len(transacoes),
-                'total_categorias': len(categorias)
-            },
-            'transacoes': [],
-            'categorias': [],
-            'resumo': {}
+
+        metadata = {
+            'usuario': usuario.username if usuario else '',
+            'data_exportacao': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'total_transacoes': total_transacoes,
+            'total_categorias': len(categorias)
         }
-        
-        # Adicionar transações
-        for t in transacoes:
-            relatorio['transacoes'].append({
-                'id': t.id,
-                'data': t.data.strftime('%Y-%m-%d %H:%M:%S') if t.data else '',
-                'data_compra': t.data_compra.strftime('%Y-%m-%d %H:%M:%S') if t.data_compra else '',
-                'data_competencia': t.data_competencia.strftime('%Y-%m-%d %H:%M:%S') if t.data_competencia else '',
-                'descricao': t.descricao,
-                'valor': float(t.valor),
-                'tipo': t.tipo,
-                'banco': t.banco,
-                'centro_custo': t.centro_custo,
-                'categoria_ia': t.categoria_ia,
-                'confianca_ia': t.confianca_ia,
-                'categoria_manual': t.categoria_manual,
-                'parcelamento': t.parcelamento,
-                'parcela_atual': t.parcela_atual,
-                'parcela_total': t.parcela_total
-            })
-        
-        # Adicionar categorias
-        for c in categorias:
-            relatorio['categorias'].append({
-                'id': c.id,
-                'nome': c.nome,
-                'tipo': c.tipo,
-                'palavras_chave': c.palavras_chave
-            })
-        
-        # Calcular resumo
-        if transacoes:
-            valores = [float(t.valor) for t in transacoes]
-            gastos = sum(v for v in valores if v < 0)
-            ganhos = sum(v for v in valores if v > 0)
-            
-            relatorio['resumo'] = {
-                'total_gastos': abs(gastos),
-                'total_ganhos': ganhos,
-                'saldo': ganhos + gastos,  # gastos é negativo
-                'media_mensal': calcular_media_mensal(transacoes)
-            }
-        
-        # Converter para JSON
-        json_data = json.dumps(relatorio, indent=2, ensure_ascii=False, default=str)
-        
-        return json_data.encode('utf-8')
-        
+        partes = ['{\n  "metadata": ' + _json(metadata) + ',\n  "transacoes": ']
+
+        # Transações em lotes
+        if total_transacoes:
+            partes.append('[')
+            for i, t in enumerate(_com_progresso(_query_transacoes(session, usuario_id, tamanho_lote), progresso)):
+                partes.append(('\n    ' if i == 0 else ',\n    ') + _json(_transacao_json(t), 2))
+                if len(partes) >= tamanho_lote:
+                    yield ''.join(partes).encode('utf-8')
+                    partes = []
+            partes.append('\n  ]')
+        else:
+            partes.append('[]')
+
+        # Categorias
+        categorias = [{
+            'id': c.id,
+            'nome': c.nome,
+            'tipo': c.tipo,
+            'palavras_chave': c.palavras_chave
+        } for c in categorias]
+        partes.append(',\n  "categorias": ' + _json(categorias))
+
+        # Resumo calculado no banco
+        partes.append(',\n  "resumo": ' + _json(resumo_relatorio(session, usuario_id)) + '\n}')
+        yield ''.join(partes).encode('utf-8')
+    finally:
+        session.close()
+
+def iterar_ndjson(usuario_id, tamanho_lote=TAMANHO_LOTE_EXPORT, progresso=None):
+    """Gera as transações em NDJSON (um objeto JSON por linha) em blocos de bytes"""
+    session = get_session()
+    try:
+        linhas = []
+        for t in _com_progresso(_query_transacoes(session, usuario_id, tamanho_lote), progresso):
+            linhas.append(json.dumps(_transacao_json(t), ensure_ascii=False, default=str))
+            if len(linhas) >= tamanho_lote:
+                yield ('\n'.join(linhas) + '\n').encode('utf-8')
+                linhas = []
+        if linhas:
+            yield ('\n'.join(linhas) + '\n').encode('utf-8')
+    finally:
+        session.close()
+
+def esquema_arrow():
+    """Esquema tipado das transações para Parquet/Arrow"""
+    texto_dict = pa.dictionary(pa.int32(), pa.string())
+    return pa.schema([
+        ('id', pa.int64()),
+        ('data', pa.timestamp('us')),
+        ('data_compra', pa.timestamp('us')),
+        ('data_competencia', pa.timestamp('us')),
+        ('descricao', pa.string()),
+        ('valor', pa.float64()),
+        ('tipo', texto_dict),
+        ('banco', texto_dict),
+        ('centro_custo', texto_dict),
+        ('categoria_ia', texto_dict),
+        ('confianca_ia', pa.float64()),
+        ('categoria_manual', texto_dict),
+        ('parcelamento', pa.bool_()),
+        ('parcela_atual', pa.int32()),
+        ('parcela_total', pa.int32()),
+        ('data_vencimento', pa.timestamp('us')),
+        ('tags', pa.string())
+    ])
+
+def _lote_arrow(linhas, esquema):
+    colunas = list(zip(*linhas))
+    arrays = []
+    for campo, valores in zip(esquema, colunas):
+        if campo.name in COLUNAS_DICIONARIO:
+            arrays.append(pa.array(valores, pa.string()).dictionary_encode())
+        else:
+            arrays.append(pa.array(valores, campo.type))
+    return pa.RecordBatch.from_arrays(arrays, schema=esquema)
+
+def iterar_lotes_arrow(usuario_id, tamanho_lote=TAMANHO_LOTE_EXPORT, progresso=None, por_data=False):
+    """Gera RecordBatches Arrow lidos em lotes direto do banco (por_data: ordenados por data, id)"""
+    esquema = esquema_arrow()
+    session = get_session()
+    try:
+        linhas = []
+        for t in _com_progresso(_query_transacoes(session, usuario_id, tamanho_lote, por_data), progresso):
+            linhas.append(tuple(t))
+            if len(linhas) >= tamanho_lote:
+                yield _lote_arrow(linhas, esquema)
+                linhas = []
+        if linhas:
+            yield _lote_arrow(linhas, esquema)
+    finally:
+        session.close()
+
+def _lotes_por_mes(lotes):
+    """Divide os lotes em (mês 'YYYY-MM', lote); os lotes precisam vir ordenados por data (por_data=True)"""
+    for lote in lotes:
+        meses = [d.strftime('%Y-%m') if d else 'sem-data' for d in lote.column('data').to_pylist()]
+        inicio = 0
+        for i in range(1, len(meses) + 1):
+            if i == len(meses) or meses[i] != meses[inicio]:
+                yield meses[inicio], lote.slice(inicio, i - inicio)
+                inicio = i
+
+def exportar_para_parquet(usuario_id, particionar_por_mes=False, progresso=None):
+    """Exporta as transações em Parquet (zstd)
+
+    Com particionar_por_mes, retorna um ZIP com um arquivo por mês no
+    layout mes=YYYY-MM/transacoes.parquet (legível por pandas/pyarrow
+    como dataset particionado). Retorna None sem dados ou sem pyarrow.
+    """
+    if pa is None:
+        return None
+
+    try:
+        esquema = esquema_arrow()
+        output = io.BytesIO()
+        total = 0
+
+        if not particionar_por_mes:
+            writer = None
+            for lote in iterar_lotes_arrow(usuario_id, progresso=progresso):
+                if writer is None:
+                    writer = pq.ParquetWriter(output, esquema, compression='zstd')
+                writer.write_batch(lote)
+                total += lote.num_rows
+            if writer is not None:
+                writer.close()
+        else:
+            with zipfile.ZipFile(output, 'w', compression=zipfile.ZIP_STORED) as zf:
+                mes_atual, arquivo, writer = None, None, None
+                meses_gravados = set()
+                for mes, lote in _lotes_por_mes(iterar_lotes_arrow(usuario_id, progresso=progresso, por_data=True)):
+                    if mes != mes_atual:
+                        if writer is not None:
+                            writer.close()
+                            arquivo.close()
+                        if mes in meses_gravados:
+                            # Um segundo membro com o mesmo nome esconderia as linhas do primeiro
+                            raise RuntimeError(f"Lotes fora de ordem: mês {mes} reapareceu")
+                        meses_gravados.add(mes)
+                        arquivo = zf.open(f"mes={mes}/transacoes.parquet", 'w')
+                        writer = pq.ParquetWriter(arquivo, esquema, compression='zstd')
+                        mes_atual = mes
+                    writer.write_batch(lote)
+                    total += lote.num_rows
+                if writer is not None:
+                    writer.close()
+                    arquivo.close()
+
+        return output.getvalue() if total else None
+
+    except Exception as e:
+        print(f"Erro ao exportar para Parquet: {e}")
+        return None
+
+def exportar_para_arrow(usuario_id, progresso=None):
+    """Exporta as transações como stream Arrow IPC (.arrows)"""
+    if pa is None:
+        return None
+
+    try:
+        output = io.BytesIO()
+        total = 0
+        with pa.ipc.new_stream(output, esquema_arrow()) as writer:
+            for lote in iterar_lotes_arrow(usuario_id, progresso=progresso):
+                writer.write_batch(lote)
+                total += lote.num_rows
+        return output.getvalue() if total else None
+
+    except Exception as e:
+        print(f"Erro ao exportar para Arrow: {e}")
+        return None
+
+def exportar_relatorio_completo(usuario_id):
+    """Exporta relatório completo em JSON"""
+    try:
+        return b''.join(iterar_relatorio_json(usuario_id))
     except Exception as e:
         print(f"Erro ao exportar relatório completo: {e}")
         return None
-    finally:
-        session.close()
+
+def exportar_ndjson(usuario_id):
+    """Exporta as transações em NDJSON (uma transação por linha)"""
+    try:
+        dados = b''.join(iterar_ndjson(usuario_id))
+        return dados or None
+    except Exception as e:
+        print(f"Erro ao exportar NDJSON: {e}")
+        return None
 
 def calcular_media_mensal(transacoes):
     """Calcula média mensal de gastos"""
@@ -230,6 +594,21 @@ def calcular_media_mensal(transacoes):
 __all__ = [
     'exportar_para_excel',
     'exportar_para_csv',
+    'iterar_csv',
+    'iterar_delta_csv',
+    'exportar_delta_csv',
+    'obter_marca_exportacao',
+    'salvar_marca_exportacao',
+    'resumo_categorias',
+    'resumo_mensal',
     'exportar_relatorio_completo',
+    'exportar_ndjson',
+    'iterar_relatorio_json',
+    'iterar_ndjson',
+    'resumo_relatorio',
+    'esquema_arrow',
+    'iterar_lotes_arrow',
+    'exportar_para_parquet',
+    'exportar_para_arrow',
     'calcular_media_mensal'
 ]
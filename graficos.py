@@ -0,0 +1,160 @@
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+import streamlit as st
+
+# Séries com mais pontos que isso são reduzidas via LTTB antes de plotar
+LIMITE_AMOSTRAGEM = 5000
+# A partir deste número de pontos plotados usa-se WebGL (Scattergl)
+LIMITE_WEBGL = 1000
+# Quantidade máxima de figuras mantidas em memória no processo
+MAX_FIGURAS_CACHE = 64
+
+_CACHE_LOCK = threading.Lock()
+_CACHE_FIGURAS = OrderedDict()
+
+def lttb(x, y, alvo):
+    """Largest-Triangle-Three-Buckets: reduz a série a `alvo` pontos preservando a forma
+
+    x precisa ser numérico e crescente; retorna os índices escolhidos.
+    """
+    n = len(x)
+    if alvo >= n or alvo < 3:
+        return np.arange(n)
+
+    x = np.asarray(x, dtype='float64')
+    y = np.asarray(y, dtype='float64')
+    indices = np.empty(alvo, dtype='int64')
+    indices[0] = 0
+    indices[-1] = n - 1
+
+    limites = np.linspace(1, n - 1, alvo - 1).astype('int64')
+    anterior = 0
+    for i in range(alvo - 2):
+        inicio, fim = limites[i], limites[i + 1]
+        prox_inicio, prox_fim = limites[i + 1], limites[i + 2] if i + 2 < len(limites) else n
+        media_x = x[prox_inicio:prox_fim].mean()
+        media_y = y[prox_inicio:prox_fim].mean()
+
+        bx = x[inicio:fim]
+        by = y[inicio:fim]
+        areas = np.abs(
+            (x[anterior] - media_x) * (by - y[anterior]) -
+            (x[anterior] - bx) * (media_y - y[anterior])
+        )
+        anterior = inicio + int(areas.argmax())
+        indices[i + 1] = anterior
+
+    return indices
+
+def serie_linha(x, y, **kwargs):
+    """Cria um trace de linha, reduzindo com LTTB e usando WebGL para séries grandes"""
+    x = pd.Series(x).reset_index(drop=True)
+    y = pd.Series(y).reset_index(drop=True)
+
+    if len(x) > LIMITE_AMOSTRAGEM:
+        if pd.api.types.is_datetime64_any_dtype(x):
+            x_num = x.astype('int64')
+        else:
+            x_num = pd.to_numeric(x, errors='coerce')
+        if x_num.notna().all():
+            idx = lttb(x_num.values, y.values, LIMITE_AMOSTRAGEM)
+            x, y = x.iloc[idx], y.iloc[idx]
+        else:
+            passo = int(np.ceil(len(x) / LIMITE_AMOSTRAGEM))
+            x, y = x.iloc[::passo], y.iloc[::passo]
+
+    if len(x) > LIMITE_WEBGL:
+        kwargs.pop('marker', None)
+        return go.Scattergl(x=x, y=y, **kwargs)
+    return go.Scatter(x=x, y=y, **kwargs)
+
+def _contar_pontos(fig):
+    total = 0
+    for trace in fig.data:
+        for eixo in ('x', 'y', 'values'):
+            valores = getattr(trace, eixo, None)
+            if valores is not None:
+                total += len(valores)
+                break
+    return total
+
+def _obter_figura(chave, construtor):
+    with _CACHE_LOCK:
+        if chave in _CACHE_FIGURAS:
+            _CACHE_FIGURAS.move_to_end(chave)
+            return _CACHE_FIGURAS[chave], True
+
+    inicio = time.perf_counter()
+    fig = construtor()
+    info = {
+        'construcao_ms': (time.perf_counter() - inicio) * 1000,
+        'payload_kb': len(fig.to_json()) / 1024 if fig is not None else 0.0,
+        'pontos': _contar_pontos(fig) if fig is not None else 0,
+        'webgl': fig is not None and any(isinstance(t, go.Scattergl) for t in fig.data)
+    }
+    entrada = (fig, info)
+
+    with _CACHE_LOCK:
+        _CACHE_FIGURAS[chave] = entrada
+        _CACHE_FIGURAS.move_to_end(chave)
+        while len(_CACHE_FIGURAS) > MAX_FIGURAS_CACHE:
+            _CACHE_FIGURAS.popitem(last=False)
+    return entrada, False
+
+def exibir_figura(grafico_id, usuario_id, filtros, construtor, mensagem_vazia=None):
+    """Renderiza uma figura Plotly usando o cache (usuário, filtros, gráfico)
+
+    `filtros` deve incluir a versão dos dados do usuário, de forma que
+    qualquer escrita invalide as figuras. `construtor` retorna a figura
+    ou None quando não houver dados. Retorna True se algo foi plotado.
+    """
+    chave = (usuario_id, tuple(sorted(filtros.items())), grafico_id)
+    (fig, info), hit = _obter_figura(chave, construtor)
+
+    if fig is None:
+        if mensagem_vazia:
+            st.info(mensagem_vazia)
+        return False
+
+    inicio = time.perf_counter()
+    st.plotly_chart(fig, use_container_width=True, key=f"grafico_{grafico_id}")
+    render_ms = (time.perf_counter() - inicio) * 1000
+
+    st.session_state.setdefault('debug_graficos', {})[grafico_id] = {
+        'Gráfico': grafico_id,
+        'Pontos': info['pontos'],
+        'Payload (KB)': round(info['payload_kb'], 1),
+        'Construção (ms)': round(info['construcao_ms'], 1) if not hit else 0.0,
+        'Render (ms)': round(render_ms, 1),
+        'WebGL': 'Sim' if info['webgl'] else 'Não',
+        'Cache': 'hit' if hit else 'miss'
+    }
+    return True
+
+def painel_debug():
+    """Tabela com tamanho de payload e tempos de cada gráfico desta execução"""
+    registros = st.session_state.pop('debug_graficos', {})
+    with st.expander("🐞 Debug de renderização", expanded=False):
+        if registros:
+            st.dataframe(pd.DataFrame(list(registros.values())), use_container_width=True, hide_index=True)
+        else:
+            st.caption("Nenhum gráfico renderizado nesta execução.")
+        with _CACHE_LOCK:
+            st.caption(f"Figuras em cache: {len(_CACHE_FIGURAS)}/{MAX_FIGURAS_CACHE}")
+
+def limpar_cache_figuras():
+    with _CACHE_LOCK:
+        _CACHE_FIGURAS.clear()
+
+# Exportar funções
+__all__ = [
+    'lttb',
+    'serie_linha',
+    'exibir_figura',
+    'painel_debug',
+    'limpar_cache_figuras'
+]
@@ -0,0 +1,210 @@
+import datetime
+import threading
+import pandas as pd
+from sqlalchemy import func, text, bindparam
+from database import get_session, incrementar_versao_dados, Transacao, ExecucaoManutencao
+from parcelas import adicionar_meses, reconstruir_cronograma
+from classificacao import preencher_descricao_normalizada
+
+TAMANHO_BLOCO_MANUTENCAO = 5000  # transações por bloco (um commit por bloco)
+
+_EXECUTANDO_LOCK = threading.Lock()
+_EXECUTANDO = set()
+
+FAIXA_ID = "id > :inicio AND id <= :fim"
+
+def _corrigir_tipo_cartao(session, parametros):
+    """Cartão de crédito: valor positivo é débito (compra) e negativo é crédito (estorno/pagamento)"""
+    alteradas = session.execute(text(
+        f"UPDATE transacoes SET tipo='DEBITO', updated_at=:agora "
+        f"WHERE {FAIXA_ID} AND centro_custo LIKE 'Cartao Credito%' AND valor > 0 AND (tipo IS NULL OR tipo <> 'DEBITO')"
+    ), parametros).rowcount
+    alteradas += session.execute(text(
+        f"UPDATE transacoes SET tipo='CREDITO', updated_at=:agora "
+        f"WHERE {FAIXA_ID} AND centro_custo LIKE 'Cartao Credito%' AND valor < 0 AND (tipo IS NULL OR tipo <> 'CREDITO')"
+    ), parametros).rowcount
+    return alteradas
+
+def _corrigir_sinais(session, parametros):
+    """Débito negativo / crédito positivo"""
+    alteradas = session.execute(text(
+        f"UPDATE transacoes SET valor = -ABS(valor), updated_at = :agora WHERE {FAIXA_ID} AND tipo='DEBITO' AND valor > 0"
+    ), parametros).rowcount
+    alteradas += session.execute(text(
+        f"UPDATE transacoes SET valor = ABS(valor), updated_at = :agora WHERE {FAIXA_ID} AND tipo='CREDITO' AND valor < 0"
+    ), parametros).rowcount
+    return alteradas
+
+def _recalcular_competencia_parcelas(session, parametros):
+    """data_competencia = data = data_compra + (parcela_atual - 1) meses, dia limitado ao fim do mês"""
+    if session.get_bind().dialect.name == 'postgresql':
+        competencia = "(data_compra + (interval '1 month' * (parcela_atual - 1)))"
+        return session.execute(text(f"""
+            UPDATE transacoes
+            SET data_competencia = {competencia}, data = {competencia}, updated_at = :agora
+            WHERE {FAIXA_ID} AND parcelamento = true AND parcela_atual IS NOT NULL AND data_compra IS NOT NULL
+              AND (data_competencia IS DISTINCT FROM {competencia} OR data IS DISTINCT FROM {competencia})
+        """), parametros).rowcount
+
+    # Demais bancos (SQLite) não têm aritmética de meses equivalente: calcula no Python
+    linhas = session.query(
+        Transacao.id, Transacao.data, Transacao.data_compra, Transacao.data_competencia, Transacao.parcela_atual
+    ).filter(
+        Transacao.id > parametros['inicio'],
+        Transacao.id <= parametros['fim'],
+        Transacao.parcelamento.is_(True),
+        Transacao.parcela_atual.isnot(None),
+        Transacao.data_compra.isnot(None)
+    ).all()
+    if not linhas:
+        return 0
+    df = pd.DataFrame(linhas, columns=['id', 'data', 'data_compra', 'data_competencia', 'parcela_atual'])
+    df['competencia'] = adicionar_meses(df['data_compra'], df['parcela_atual'] - 1).values
+    df = df[(df['data_competencia'] != df['competencia']) | (df['data'] != df['competencia'])]
+    if df.empty:
+        return 0
+    competencias = df['competencia'].dt.to_pydatetime()
+    tabela = Transacao.__table__
+    atualizar = tabela.update().where(tabela.c.id == bindparam('b_id')).values(
+        data_competencia=bindparam('b_competencia'),
+        data=bindparam('b_competencia'),
+        updated_at=parametros['agora']
+    )
+    session.execute(atualizar, [
+        {'b_id': int(i), 'b_competencia': c} for i, c in zip(df['id'], competencias)
+    ])
+    return len(df)
+
+def _recalcular_competencia(session, parametros):
+    alteradas = _recalcular_competencia_parcelas(session, parametros)
+    alteradas += session.execute(text(
+        f"UPDATE transacoes SET data_competencia = data, updated_at = :agora WHERE {FAIXA_ID} AND data_competencia IS NULL"
+    ), parametros).rowcount
+    alteradas += session.execute(text(
+        f"UPDATE transacoes SET data_compra = data, updated_at = :agora WHERE {FAIXA_ID} AND data_compra IS NULL"
+    ), parametros).rowcount
+    return alteradas
+
+def _normalizar_descricoes(session, parametros):
+    """Preenche descricao_normalizada (chave de "aplicar a semelhantes") das transações antigas"""
+    return preencher_descricao_normalizada(
+        session, Transacao.id > parametros['inicio'], Transacao.id <= parametros['fim']
+    )
+
+# tarefa -> (rótulo, função aplicada a cada bloco (session, {'inicio', 'fim', 'agora'}) -> linhas alteradas,
+#            se altera campos copiados para parcelas_previstas (cronograma refeito ao concluir))
+TAREFAS_MANUTENCAO = {
+    'corrigir_tipo_cartao': ("🧾 Corrigir tipo para cartão de crédito", _corrigir_tipo_cartao, True),
+    'recalcular_competencia': ("🗓️ Recalcular datas de competência (parcelas)", _recalcular_competencia, True),
+    'corrigir_sinais': ("🔁 Corrigir sinais (débito negativo / crédito positivo)", _corrigir_sinais, True),
+    'normalizar_descricoes': ("🔤 Preencher descrições normalizadas (transações semelhantes)", _normalizar_descricoes, False)
+}
+
+def _estado_dict(estado):
+    if estado is None:
+        return None
+    return {
+        'tarefa': estado.tarefa,
+        'status': estado.status,
+        'ultimo_id': estado.ultimo_id,
+        'id_maximo': estado.id_maximo,
+        'total': estado.total,
+        'processadas': estado.processadas,
+        'alteradas': estado.alteradas,
+        'erro': estado.erro,
+        'iniciado_em': estado.iniciado_em,
+        'atualizado_em': estado.atualizado_em
+    }
+
+def obter_estado_manutencao(tarefa):
+    """Situação da última execução da tarefa (None se nunca executada)"""
+    session = get_session()
+    try:
+        return _estado_dict(session.get(ExecucaoManutencao, tarefa))
+    finally:
+        session.close()
+
+def execucao_pendente(tarefa):
+    """Execução interrompida (ou com erro) que pode ser retomada"""
+    estado = obter_estado_manutencao(tarefa)
+    with _EXECUTANDO_LOCK:
+        em_andamento = tarefa in _EXECUTANDO
+    return estado if estado and estado['status'] != 'concluida' and not em_andamento else None
+
+def _fim_do_bloco(session, inicio, id_maximo, tamanho_bloco):
+    fim = session.query(Transacao.id).filter(
+        Transacao.id > inicio, Transacao.id <= id_maximo
+    ).order_by(Transacao.id).offset(tamanho_bloco - 1).limit(1).scalar()
+    return fim if fim is not None else id_maximo
+
+def executar_manutencao(tarefa, tamanho_bloco=TAMANHO_BLOCO_MANUTENCAO, progresso=None, retomar=True):
+    """Executa a correção em blocos de ids, com commit e registro de progresso por bloco
+
+    Se a execução anterior não terminou (processo encerrado, erro), ela é
+    retomada do último bloco confirmado quando `retomar` é True.
+    `progresso(estado)` é chamado após cada bloco. Ao concluir com linhas
+    alteradas, tarefas que mexem em data/valor/tipo refazem o cronograma de parcelas.
+    """
+    if tarefa not in TAREFAS_MANUTENCAO:
+        raise ValueError(f"Tarefa de manutenção desconhecida: {tarefa}")
+    with _EXECUTANDO_LOCK:
+        if tarefa in _EXECUTANDO:
+            raise RuntimeError("Esta correção já está em execução")
+        _EXECUTANDO.add(tarefa)
+
+    _, aplicar, altera_cronograma = TAREFAS_MANUTENCAO[tarefa]
+    session = get_session()
+    try:
+        estado = session.get(ExecucaoManutencao, tarefa)
+        if estado is None or estado.status == 'concluida' or not retomar:
+            id_maximo = session.query(func.max(Transacao.id)).scalar() or 0
+            total = session.query(func.count(Transacao.id)).scalar() or 0
+            if estado is None:
+                estado = ExecucaoManutencao(tarefa=tarefa)
+                session.add(estado)
+            estado.ultimo_id, estado.id_maximo, estado.total = 0, id_maximo, total
+            estado.processadas, estado.alteradas = 0, 0
+            estado.iniciado_em = datetime.datetime.utcnow()
+        estado.status, estado.erro = 'executando', None
+        estado.atualizado_em = datetime.datetime.utcnow()
+        session.commit()
+
+        try:
+            while estado.ultimo_id < estado.id_maximo:
+                fim = _fim_do_bloco(session, estado.ultimo_id, estado.id_maximo, tamanho_bloco)
+                agora = datetime.datetime.utcnow()
+                alteradas = aplicar(session, {'inicio': estado.ultimo_id, 'fim': fim, 'agora': agora})
+                if alteradas:
+                    incrementar_versao_dados(session)
+                estado.processadas = min(estado.processadas + tamanho_bloco, estado.total)
+                estado.alteradas += alteradas
+                estado.ultimo_id = fim
+                estado.atualizado_em = agora
+                session.commit()
+                if progresso:
+                    progresso(_estado_dict(estado))
+            if altera_cronograma and estado.alteradas:
+                reconstruir_cronograma()
+        except Exception as e:
+            session.rollback()
+            estado.status, estado.erro = 'erro', str(e)
+            estado.atualizado_em = datetime.datetime.utcnow()
+            session.commit()
+            raise
+
+        estado.status = 'concluida'
+        estado.processadas = estado.total
+        session.commit()
+        return _estado_dict(estado)
+    finally:
+        session.close()
+        with _EXECUTANDO_LOCK:
+            _EXECUTANDO.discard(tarefa)
+
+# Exportar funções
+__all__ = [
+    'TAREFAS_MANUTENCAO',
+    'obter_estado_manutencao',
+    'execucao_pendente',
+    'executar_manutencao'
+]
@@ -0,0 +1,87 @@
+import streamlit as st
+from sqlalchemy import or_, and_
+from database import Transacao
+
+TAMANHOS_PAGINA = [25, 50, 100, 200, 500]
+
+def aplicar_keyset(query, cursor=None, tamanho=50, coluna_data=None):
+    """Aplica paginação keyset ordenada por (data, id) decrescente
+
+    `coluna_data` troca a data da chave (padrão Transacao.data), por exemplo
+    pela data de visualização do fluxo escolhido. Busca uma linha a mais que
+    o tamanho da página para saber se existe próxima página sem precisar de OFFSET.
+    """
+    coluna_data = Transacao.data if coluna_data is None else coluna_data
+    if cursor:
+        data_ref, id_ref = cursor
+        query = query.filter(or_(
+            coluna_data < data_ref,
+            and_(coluna_data == data_ref, Transacao.id < id_ref)
+        ))
+    return query.order_by(coluna_data.desc(), Transacao.id.desc()).limit(tamanho + 1)
+
+def separar_pagina(linhas, tamanho, chave=lambda linha: (linha.data, linha.id)):
+    """Retorna (linhas da página, cursor da próxima página ou None)"""
+    if len(linhas) > tamanho:
+        pagina = linhas[:tamanho]
+        return pagina, chave(pagina[-1])
+    return linhas, None
+
+def controles_paginacao(prefixo, total=None):
+    """Renderiza seletor de tamanho e navegação; retorna (cursor, tamanho)
+
+    Os cursores das páginas já visitadas ficam em st.session_state para
+    permitir voltar sem refazer a contagem.
+    """
+    chave_pilha = f"{prefixo}_cursores"
+    chave_tamanho = f"{prefixo}_tamanho"
+
+    if chave_pilha not in st.session_state:
+        st.session_state[chave_pilha] = [None]
+
+    tamanho = st.selectbox(
+        "Itens por página",
+        TAMANHOS_PAGINA,
+        index=TAMANHOS_PAGINA.index(50),
+        key=chave_tamanho,
+        on_change=reiniciar_paginacao,
+        args=(prefixo,)
+    )
+
+    pilha = st.session_state[chave_pilha]
+    pagina_atual = len(pilha)
+    if total is not None:
+        total_paginas = max(1, -(-total // tamanho))
+        st.caption(f"Página {pagina_atual} de {total_paginas} · {total} registros")
+    else:
+        st.caption(f"Página {pagina_atual}")
+
+    return pilha[-1], tamanho
+
+def navegacao_paginacao(prefixo, proximo_cursor):
+    """Botões de página anterior/próxima (chamar após buscar a página)"""
+    chave_pilha = f"{prefixo}_cursores"
+    pilha = st.session_state[chave_pilha]
+
+    col_ant, col_prox = st.columns(2)
+    with col_ant:
+        if st.button("⬅️ Anterior", key=f"{prefixo}_anterior", disabled=len(pilha) <= 1, use_container_width=True):
+            pilha.pop()
+            st.rerun()
+    with col_prox:
+        if st.button("Próxima ➡️", key=f"{prefixo}_proxima", disabled=proximo_cursor is None, use_container_width=True):
+            pilha.append(proximo_cursor)
+            st.rerun()
+
+def reiniciar_paginacao(prefixo):
+    """Volta para a primeira página (ex.: quando filtros mudam)"""
+    st.session_state[f"{prefixo}_cursores"] = [None]
+
+# Exportar funções
+__all__ = [
+    'aplicar_keyset',
+    'separar_pagina',
+    'controles_paginacao',
+    'navegacao_paginacao',
+    'reiniciar_paginacao'
+]
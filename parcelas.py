@@ -0,0 +1,296 @@
+import datetime
+import numpy as np
+import pandas as pd
+from sqlalchemy import func, bindparam
+from database import get_session, Transacao, ParcelaPrevista, incrementar_versao_dados
+from agregacoes import expressao_mes
+
+TAMANHO_LOTE_IN = 500
+
+# Marcador de parcela embutido na descrição ("PARC 02/10", "2/10")
+_REGEX_PARCELA = r'\b(?:parc(?:ela)?\.?\s*)?\d{1,2}\s*/\s*\d{1,2}\b'
+
+def normalizar_descricao(descricoes):
+    """Descrição em minúsculas, sem acentos, sem marcador de parcela e com espaços simples"""
+    return (
+        pd.Series(descricoes).fillna('').astype(str)
+        .str.normalize('NFKD').str.encode('ascii', 'ignore').str.decode('ascii')
+        .str.lower()
+        .str.replace(_REGEX_PARCELA, ' ', regex=True)
+        .str.replace(r'[^a-z0-9]+', ' ', regex=True)
+        .str.strip()
+    )
+
+def calcular_grupo_compra(df):
+    """Identificador da compra parcelada, igual em todas as faturas em que ela aparece
+
+    Derivado de (data da compra, descrição normalizada, valor da parcela,
+    total de parcelas, centro de custo). Linhas que não são parcelamento
+    recebem None.
+    """
+    if df.empty:
+        return pd.Series([], index=df.index, dtype=object)
+    data_compra = df['data_compra'] if 'data_compra' in df.columns else df['data']
+    data_compra = pd.to_datetime(data_compra.fillna(df['data']))
+    centro = df['centro_custo'] if 'centro_custo' in df.columns else pd.Series('', index=df.index)
+    base = pd.DataFrame({
+        'data_compra': data_compra.dt.normalize(),
+        'descricao': normalizar_descricao(df['descricao']).values,
+        'valor': pd.to_numeric(df['valor'], errors='coerce').abs().round(2),
+        'parcela_total': pd.to_numeric(df['parcela_total'], errors='coerce').fillna(0).astype('int64'),
+        'centro_custo': centro.fillna('').astype(str).str.strip().str.lower()
+    }, index=df.index)
+    grupos = pd.util.hash_pandas_object(base, index=False).map('{:016x}'.format)
+
+    parcelado = df['parcelamento'].fillna(False).astype(bool) & df['parcela_total'].notna()
+    return grupos.where(parcelado, None)
+
+def adicionar_meses(datas, meses):
+    """Versão vetorizada de csv_processor._add_months (dia limitado ao fim do mês)"""
+    datas = pd.to_datetime(datas).reset_index(drop=True)
+    meses = pd.Series(meses).reset_index(drop=True).astype('int64')
+    total_meses = datas.dt.year * 12 + (datas.dt.month - 1) + meses
+    primeiro_dia = pd.to_datetime(pd.DataFrame({
+        'year': total_meses // 12,
+        'month': total_meses % 12 + 1,
+        'day': 1
+    }))
+    dia = np.minimum(datas.dt.day, primeiro_dia.dt.days_in_month)
+    hora = datas - datas.dt.normalize()
+    return primeiro_dia + pd.to_timedelta(dia - 1, unit='D') + hora
+
+def expandir_cronograma(df):
+    """Expande cada compra parcelada nas parcelas futuras a partir da última conhecida
+
+    Espera as colunas usuario_id, chave_compra, data_compra, descricao, valor,
+    banco, centro_custo, parcela_atual e parcela_total (uma linha por compra).
+    """
+    colunas = ['usuario_id', 'chave_compra', 'numero_parcela', 'parcela_total', 'data_compra',
+               'data_competencia', 'descricao', 'valor', 'banco', 'centro_custo']
+    restantes = (df['parcela_total'] - df['parcela_atual']).clip(lower=0).astype('int64')
+    df = df[restantes > 0]
+    restantes = restantes[restantes > 0]
+    if df.empty:
+        return pd.DataFrame(columns=colunas)
+
+    expandido = df.loc[df.index.repeat(restantes)].reset_index(drop=True)
+    deslocamento = expandido.groupby('chave_compra').cumcount() + 1
+    expandido['numero_parcela'] = (expandido['parcela_atual'].astype('int64') + deslocamento).astype('int64')
+    expandido['data_competencia'] = adicionar_meses(expandido['data_compra'], expandido['numero_parcela'] - 1)
+    expandido['parcela_total'] = expandido['parcela_total'].astype('int64')
+    return expandido[colunas]
+
+def _lotes(valores, tamanho=TAMANHO_LOTE_IN):
+    valores = list(valores)
+    for i in range(0, len(valores), tamanho):
+        yield valores[i:i + tamanho]
+
+def _registros(df):
+    registros = df.to_dict('records')
+    for r in registros:
+        for campo in ('data_compra', 'data_competencia'):
+            if isinstance(r.get(campo), pd.Timestamp):
+                r[campo] = r[campo].to_pydatetime()
+        for campo in ('usuario_id', 'numero_parcela', 'parcela_total'):
+            r[campo] = int(r[campo])
+        r['valor'] = float(r['valor'])
+    return registros
+
+def progresso_grupos(session, usuario_id, grupos):
+    """Última parcela já registrada de cada grupo de compra (consulta pelo índice)
+
+    Retorna DataFrame com colunas grupo_compra e parcela_realizada.
+    """
+    linhas = []
+    for lote in _lotes(set(grupos)):
+        linhas.extend(session.query(
+            Transacao.grupo_compra, func.max(Transacao.parcela_atual)
+        ).filter(
+            Transacao.usuario_id == int(usuario_id),
+            Transacao.grupo_compra.in_(lote)
+        ).group_by(Transacao.grupo_compra).all())
+    return pd.DataFrame(linhas, columns=['grupo_compra', 'parcela_realizada'])
+
+def atualizar_cronograma(session, df_transacoes):
+    """Atualiza as parcelas previstas das compras presentes em df_transacoes
+
+    Executa na sessão recebida (mesma transação da importação). O progresso
+    de cada compra vem de um join com os grupos já gravados; as parcelas
+    seguintes à última realizada são regeneradas.
+    """
+    if df_transacoes.empty or 'parcelamento' not in df_transacoes.columns:
+        return 0
+
+    df = df_transacoes[
+        df_transacoes['parcelamento'].fillna(False).astype(bool) &
+        df_transacoes['parcela_atual'].notna() &
+        df_transacoes['parcela_total'].notna()
+    ].copy()
+    if df.empty:
+        return 0
+
+    # Colunas opcionais para quem chama salvar_transacoes com um DataFrame próprio
+    for coluna in ('data_compra', 'banco', 'centro_custo'):
+        if coluna not in df.columns:
+            df[coluna] = None
+    df['data_compra'] = pd.to_datetime(df['data_compra'].fillna(df['data']))
+    df['parcela_atual'] = df['parcela_atual'].astype('int64')
+    df['parcela_total'] = df['parcela_total'].astype('int64')
+    if 'grupo_compra' not in df.columns or df['grupo_compra'].isna().any():
+        df['grupo_compra'] = calcular_grupo_compra(df)
+    df['chave_compra'] = df['grupo_compra']
+
+    # Uma linha por compra: a parcela mais avançada importada
+    df = df.sort_values('parcela_atual').drop_duplicates(['usuario_id', 'chave_compra'], keep='last')
+
+    total_inserido = 0
+    for usuario_id, df_usuario in df.groupby('usuario_id'):
+        grupos = df_usuario['chave_compra'].tolist()
+
+        progresso = progresso_grupos(session, usuario_id, grupos)
+        df_usuario = df_usuario.merge(progresso, how='left', on='grupo_compra')
+        realizadas = df_usuario['parcela_realizada'].fillna(0).astype('int64')
+        df_usuario['parcela_atual'] = np.maximum(df_usuario['parcela_atual'], realizadas)
+
+        for lote in _lotes(grupos):
+            session.query(ParcelaPrevista).filter(
+                ParcelaPrevista.usuario_id == int(usuario_id),
+                ParcelaPrevista.chave_compra.in_(lote)
+            ).delete(synchronize_session=False)
+
+        cronograma = expandir_cronograma(df_usuario)
+        if not cronograma.empty:
+            session.execute(ParcelaPrevista.__table__.insert(), _registros(cronograma))
+            total_inserido += len(cronograma)
+
+    return total_inserido
+
+def atribuir_grupos_compra(session, usuario_id=None):
+    """Preenche grupo_compra das transações parceladas gravadas sem ele"""
+    query = session.query(
+        Transacao.id, Transacao.data, Transacao.data_compra, Transacao.descricao, Transacao.valor,
+        Transacao.centro_custo, Transacao.parcelamento, Transacao.parcela_total
+    ).filter(
+        Transacao.parcelamento.is_(True),
+        Transacao.parcela_total.isnot(None),
+        Transacao.grupo_compra.is_(None)
+    )
+    if usuario_id is not None:
+        query = query.filter(Transacao.usuario_id == usuario_id)
+
+    df = pd.DataFrame(query.all(), columns=[
+        'id', 'data', 'data_compra', 'descricao', 'valor', 'centro_custo', 'parcelamento', 'parcela_total'
+    ])
+    if df.empty:
+        return 0
+
+    df['grupo_compra'] = calcular_grupo_compra(df)
+    tabela = Transacao.__table__
+    atualizar = tabela.update().where(tabela.c.id == bindparam('b_id')).values(grupo_compra=bindparam('b_grupo'))
+    registros = [{'b_id': int(i), 'b_grupo': g} for i, g in zip(df['id'], df['grupo_compra'])]
+    for inicio in range(0, len(registros), TAMANHO_LOTE_IN):
+        session.execute(atualizar, registros[inicio:inicio + TAMANHO_LOTE_IN])
+    return len(registros)
+
+def reconstruir_cronograma(usuario_id=None):
+    """Preenche grupos de compra faltantes e recria o cronograma a partir das transações gravadas"""
+    session = get_session()
+    try:
+        if atribuir_grupos_compra(session, usuario_id):
+            incrementar_versao_dados(session, usuario_id)
+
+        query_delete = session.query(ParcelaPrevista)
+        query = session.query(
+            Transacao.usuario_id, Transacao.data, Transacao.data_compra, Transacao.descricao,
+            Transacao.valor, Transacao.banco, Transacao.centro_custo, Transacao.parcelamento,
+            Transacao.parcela_atual, Transacao.parcela_total, Transacao.grupo_compra
+        ).filter(
+            Transacao.parcelamento.is_(True),
+            Transacao.parcela_atual.isnot(None),
+            Transacao.parcela_total.isnot(None)
+        )
+        if usuario_id is not None:
+            query_delete = query_delete.filter(ParcelaPrevista.usuario_id == usuario_id)
+            query = query.filter(Transacao.usuario_id == usuario_id)
+
+        query_delete.delete(synchronize_session=False)
+        df = pd.DataFrame(query.all(), columns=[
+            'usuario_id', 'data', 'data_compra', 'descricao', 'valor', 'banco',
+            'centro_custo', 'parcelamento', 'parcela_atual', 'parcela_total', 'grupo_compra'
+        ])
+        total = atualizar_cronograma(session, df) if not df.empty else 0
+        session.commit()
+        return total
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+def _inicio_mes_atual():
+    return datetime.datetime.now().replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+def _condicoes(usuario_id, banco=None, centro_custo=None):
+    condicoes = [
+        ParcelaPrevista.usuario_id == usuario_id,
+        ParcelaPrevista.data_competencia >= _inicio_mes_atual()
+    ]
+    if banco and banco != 'Todos':
+        condicoes.append(ParcelaPrevista.banco == banco)
+    if centro_custo and centro_custo != 'Todos':
+        condicoes.append(func.coalesce(ParcelaPrevista.centro_custo, 'Não informado') == centro_custo)
+    return condicoes
+
+def projetar_compromissos(usuario_id, banco=None, centro_custo=None):
+    """Total de parcelas previstas por mês de competência (a partir do mês atual)"""
+    session = get_session()
+    try:
+        mes = expressao_mes(ParcelaPrevista.data_competencia, session.get_bind().dialect.name)
+        linhas = session.query(
+            mes, func.sum(func.abs(ParcelaPrevista.valor)), func.count(ParcelaPrevista.id)
+        ).filter(*_condicoes(usuario_id, banco, centro_custo)).group_by(mes).order_by(mes).all()
+        return pd.DataFrame(linhas, columns=['Mes_Ano', 'Total', 'Parcelas'])
+    finally:
+        session.close()
+
+def listar_compras_parceladas(usuario_id, banco=None, centro_custo=None):
+    """Compras com parcelas ainda previstas, agregadas por compra"""
+    session = get_session()
+    try:
+        linhas = session.query(
+            ParcelaPrevista.descricao,
+            func.max(func.abs(ParcelaPrevista.valor)),
+            func.min(ParcelaPrevista.numero_parcela),
+            ParcelaPrevista.parcela_total,
+            func.count(ParcelaPrevista.id),
+            func.sum(func.abs(ParcelaPrevista.valor)),
+            func.min(ParcelaPrevista.data_competencia),
+            ParcelaPrevista.banco
+        ).filter(*_condicoes(usuario_id, banco, centro_custo)).group_by(
+            ParcelaPrevista.chave_compra, ParcelaPrevista.descricao,
+            ParcelaPrevista.parcela_total, ParcelaPrevista.banco
+        ).order_by(func.min(ParcelaPrevista.data_competencia)).all()
+        df = pd.DataFrame(linhas, columns=[
+            'Descrição', 'Valor Parcela', 'Proxima_Parcela', 'Parcela_Total',
+            'Próximas Parcelas', 'Total Restante', 'Próxima Competência', 'Banco'
+        ])
+        if not df.empty:
+            df.insert(2, 'Próxima Parcela', df['Proxima_Parcela'].astype(str) + '/' + df['Parcela_Total'].astype(str))
+            df = df.drop(columns=['Proxima_Parcela', 'Parcela_Total'])
+        return df
+    finally:
+        session.close()
+
+# Exportar funções
+__all__ = [
+    'normalizar_descricao',
+    'calcular_grupo_compra',
+    'adicionar_meses',
+    'expandir_cronograma',
+    'progresso_grupos',
+    'atualizar_cronograma',
+    'atribuir_grupos_compra',
+    'reconstruir_cronograma',
+    'projetar_compromissos',
+    'listar_compras_parceladas'
+]
@@ -0,0 +1,63 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+import bcrypt
+from configuracao import obter_config_int
+
+# bcrypt libera o GIL: os hashes rodam em paralelo nas threads do pool,
+# que limita quantos núcleos um pico de logins pode ocupar
+MAX_THREADS_SENHA = max(1, min(4, os.cpu_count() or 1))
+TEMPO_MAXIMO_SENHA = 30  # segundos
+ROUNDS_PADRAO = 12
+ROUNDS_MIN, ROUNDS_MAX = 4, 16
+
+_EXECUTOR = ThreadPoolExecutor(max_workers=MAX_THREADS_SENHA, thread_name_prefix='bcrypt')
+
+def rounds_configurados():
+    """Custo do bcrypt (BCRYPT_ROUNDS nas configurações, ou variável de ambiente)"""
+    padrao = int(os.getenv('BCRYPT_ROUNDS', ROUNDS_PADRAO))
+    return min(max(obter_config_int('BCRYPT_ROUNDS', padrao), ROUNDS_MIN), ROUNDS_MAX)
+
+def _hash(senha, rounds):
+    return bcrypt.hashpw(senha.encode('utf-8'), bcrypt.gensalt(rounds)).decode('utf-8')
+
+def _verificar(senha, hashed):
+    try:
+        return bcrypt.checkpw(senha.encode('utf-8'), hashed)
+    except ValueError:
+        # Hash inválido/corrompido no banco
+        return False
+
+def gerar_hash(senha, rounds=None):
+    """Hash bcrypt calculado no pool de threads de senha"""
+    rounds = rounds or rounds_configurados()
+    return _EXECUTOR.submit(_hash, senha, rounds).result(timeout=TEMPO_MAXIMO_SENHA)
+
+def verificar_senha(senha, hashed):
+    """Confere a senha com o hash no pool de threads de senha"""
+    if not hashed:
+        return False
+    if isinstance(hashed, str):
+        hashed = hashed.encode('utf-8')
+    return _EXECUTOR.submit(_verificar, senha, hashed).result(timeout=TEMPO_MAXIMO_SENHA)
+
+def custo_do_hash(hashed):
+    """Custo gravado no hash ($2b$<custo>$...), ou None se não for bcrypt"""
+    if isinstance(hashed, bytes):
+        hashed = hashed.decode('utf-8', 'ignore')
+    partes = (hashed or '').split('$')
+    if len(partes) < 4 or not partes[2].isdigit():
+        return None
+    return int(partes[2])
+
+def precisa_rehash(hashed):
+    """Hash gerado com custo diferente do configurado (refazer após login bem-sucedido)"""
+    return custo_do_hash(hashed) != rounds_configurados()
+
+# Exportar funções
+__all__ = [
+    'rounds_configurados',
+    'gerar_hash',
+    'verificar_senha',
+    'custo_do_hash',
+    'precisa_rehash'
+]
@@ -0,0 +1,183 @@
+import os
+import glob
+import time
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+from database import init_db
+from configuracao import obter_config_int, obter_config_float, obter_config_bool
+
+DIRETORIO_SNAPSHOTS = os.path.join('data', 'snapshots')
+PAGINAS_POR_PASSO = 1024   # páginas copiadas a cada passo da API de backup
+PAUSA_ENTRE_PASSOS = 0.01  # segundos livres para os escritores entre passos
+RETENCAO_PADRAO = 7        # snapshots mantidos quando SNAPSHOT_RETENCAO não está configurado
+INTERVALO_PADRAO_HORAS = 24
+VERIFICACAO_AGENDADOR = 60  # segundos entre verificações do agendador
+# Cada escrita de outra conexão faz a API de backup recomeçar a cópia; após
+# tantos recomeços o restante é copiado em uma única etapa
+MAX_REINICIOS = 5
+
+_SNAPSHOT_LOCK = threading.Lock()
+_AGENDADOR_LOCK = threading.Lock()
+_AGENDADOR = None
+
+def caminho_banco_sqlite():
+    """Arquivo do banco SQLite em uso (None se o banco não for SQLite em arquivo)"""
+    engine = init_db()
+    if engine.dialect.name != 'sqlite':
+        return None
+    banco = engine.url.database
+    if not banco or banco == ':memory:':
+        return None
+    return os.path.abspath(banco)
+
+def snapshots_disponiveis():
+    return caminho_banco_sqlite() is not None
+
+class _CopiaReiniciada(Exception):
+    pass
+
+def _copiar(origem, destino, paginas, pausa, passos):
+    """Executa a cópia página a página; levanta _CopiaReiniciada se os escritores a reiniciarem demais"""
+    def progresso(status, restantes, total):
+        if restantes > passos['restantes']:
+            passos['reinicios'] += 1
+            if passos['reinicios'] > MAX_REINICIOS:
+                raise _CopiaReiniciada()
+        passos['quantidade'] += 1
+        passos['restantes'] = restantes
+        passos['paginas'] = total
+
+    conexao_origem = sqlite3.connect(origem, timeout=30)
+    conexao_destino = sqlite3.connect(destino)
+    try:
+        conexao_origem.backup(conexao_destino, pages=paginas, progress=progresso, sleep=pausa)
+    finally:
+        conexao_destino.close()
+        conexao_origem.close()
+
+def _verificar_integridade(caminho):
+    """Executa PRAGMA integrity_check no arquivo; retorna a lista de problemas (vazia se íntegro)"""
+    conexao = sqlite3.connect(caminho)
+    try:
+        resultado = [linha[0] for linha in conexao.execute("PRAGMA integrity_check").fetchall()]
+    finally:
+        conexao.close()
+    return [] if resultado == ['ok'] else resultado
+
+def criar_snapshot(paginas=PAGINAS_POR_PASSO, pausa=PAUSA_ENTRE_PASSOS, retencao=None):
+    """Cópia online do banco SQLite com a API de backup, em passos de `paginas` páginas
+
+    Entre os passos o bloqueio de leitura é liberado, então escritas
+    concorrentes não ficam bloqueadas durante a cópia; se elas reiniciarem
+    a cópia mais de MAX_REINICIOS vezes, o restante é feito em uma etapa.
+    O arquivo só recebe o nome final depois de passar pelo integrity_check.
+    """
+    origem = caminho_banco_sqlite()
+    if origem is None:
+        raise RuntimeError("Snapshots só estão disponíveis para banco SQLite em arquivo")
+    if not _SNAPSHOT_LOCK.acquire(blocking=False):
+        raise RuntimeError("Já existe um snapshot em andamento")
+    nome = f"database_{datetime.now().strftime('%Y%m%d_%H%M%S')}.db"
+    destino = os.path.join(DIRETORIO_SNAPSHOTS, nome)
+    parcial = f"{destino}.parcial"
+    passos = {'quantidade': 0, 'paginas': 0, 'restantes': float('inf'), 'reinicios': 0}
+
+    try:
+        os.makedirs(DIRETORIO_SNAPSHOTS, exist_ok=True)
+        inicio = time.perf_counter()
+        try:
+            _copiar(origem, parcial, paginas, pausa, passos)
+        except _CopiaReiniciada:
+            # Escritas contínuas: conclui com uma etapa única (bloqueia escritores só durante a cópia)
+            passos['restantes'] = float('inf')
+            _copiar(origem, parcial, -1, 0, passos)
+
+        problemas = _verificar_integridade(parcial)
+        if problemas:
+            raise RuntimeError(f"Snapshot falhou no integrity_check: {'; '.join(problemas[:5])}")
+        os.replace(parcial, destino)
+    finally:
+        if os.path.exists(parcial):
+            os.remove(parcial)
+        _SNAPSHOT_LOCK.release()
+
+    return {
+        'arquivo': nome,
+        'caminho': destino,
+        'tamanho': os.path.getsize(destino),
+        'paginas': passos['paginas'],
+        'passos': passos['quantidade'],
+        'reinicios': passos['reinicios'],
+        'duracao': time.perf_counter() - inicio,
+        'removidos': aplicar_retencao(retencao)
+    }
+
+def listar_snapshots():
+    """Snapshots existentes, do mais recente para o mais antigo"""
+    snapshots = []
+    for caminho in glob.glob(os.path.join(DIRETORIO_SNAPSHOTS, 'database_*.db')):
+        snapshots.append({
+            'arquivo': os.path.basename(caminho),
+            'caminho': caminho,
+            'tamanho': os.path.getsize(caminho),
+            'criado_em': datetime.fromtimestamp(os.path.getmtime(caminho))
+        })
+    return sorted(snapshots, key=lambda s: s['arquivo'], reverse=True)
+
+def aplicar_retencao(manter=None):
+    """Remove os snapshots mais antigos além dos `manter` mais recentes; retorna os removidos"""
+    if manter is None:
+        manter = obter_config_int('SNAPSHOT_RETENCAO', RETENCAO_PADRAO)
+    removidos = []
+    for snapshot in listar_snapshots()[max(manter, 1):]:
+        try:
+            os.remove(snapshot['caminho'])
+            removidos.append(snapshot['arquivo'])
+        except OSError as e:
+            print(f"Erro ao remover snapshot antigo {snapshot['arquivo']}: {e}")
+    return removidos
+
+def backup_automatico_ativo():
+    return obter_config_bool('BACKUP_AUTOMATICO')
+
+def snapshot_pendente(agora=None):
+    """Indica se o agendador deve gerar um snapshot agora"""
+    if not snapshots_disponiveis() or not backup_automatico_ativo():
+        return False
+    snapshots = listar_snapshots()
+    if not snapshots:
+        return True
+    intervalo = timedelta(hours=obter_config_float('BACKUP_INTERVALO_HORAS', INTERVALO_PADRAO_HORAS))
+    return (agora or datetime.now()) - snapshots[0]['criado_em'] >= intervalo
+
+def _executar_agendador():
+    while True:
+        try:
+            if snapshot_pendente():
+                resultado = criar_snapshot()
+                print(f"Snapshot automático criado: {resultado['arquivo']} ({resultado['duracao']:.1f}s)")
+        except Exception as e:
+            print(f"Erro no backup automático: {e}")
+        time.sleep(VERIFICACAO_AGENDADOR)
+
+def iniciar_agendador():
+    """Inicia (uma vez por processo) a thread que gera snapshots conforme BACKUP_AUTOMATICO"""
+    global _AGENDADOR
+    with _AGENDADOR_LOCK:
+        if _AGENDADOR is None or not _AGENDADOR.is_alive():
+            _AGENDADOR = threading.Thread(target=_executar_agendador, name='backup_automatico', daemon=True)
+            _AGENDADOR.start()
+    return _AGENDADOR
+
+# Exportar funções
+__all__ = [
+    'caminho_banco_sqlite',
+    'snapshots_disponiveis',
+    'criar_snapshot',
+    'listar_snapshots',
+    'aplicar_retencao',
+    'backup_automatico_ativo',
+    'snapshot_pendente',
+    'iniciar_agendador'
+]
@@ -0,0 +1,183 @@
+import os
+import glob
+import time
+import threading
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+import streamlit as st
+from database import get_session, obter_versao_dados, Transacao
+from export import (
+    exportar_para_excel, iterar_csv, iterar_relatorio_json, iterar_ndjson,
+    exportar_para_parquet, exportar_para_arrow
+)
+
+DIRETORIO_EXPORTS = os.path.join('data', 'exports')
+MAX_EXPORTACOES_SIMULTANEAS = 2
+INTERVALO_PROGRESSO = 1.0  # segundos entre atualizações da barra de progresso
+
+def _em_blocos(dados):
+    """Adapta as exportações que retornam bytes/BytesIO para o formato de blocos"""
+    if dados is None:
+        raise RuntimeError("exportação não gerou dados")
+    yield dados.getvalue() if hasattr(dados, 'getvalue') else dados
+
+# formato -> (extensão, mime, gerador de blocos de bytes (usuario_id, progresso))
+FORMATOS = {
+    'excel': ('xlsx', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+              lambda u, p: _em_blocos(exportar_para_excel(u, p))),
+    'csv': ('csv', 'text/csv', lambda u, p: iterar_csv(u, progresso=p)),
+    'json': ('json', 'application/json', lambda u, p: iterar_relatorio_json(u, progresso=p)),
+    'ndjson': ('ndjson', 'application/x-ndjson', lambda u, p: iterar_ndjson(u, progresso=p)),
+    'parquet': ('parquet', 'application/vnd.apache.parquet',
+                lambda u, p: _em_blocos(exportar_para_parquet(u, progresso=p))),
+    'parquet_mes': ('zip', 'application/zip',
+                    lambda u, p: _em_blocos(exportar_para_parquet(u, particionar_por_mes=True, progresso=p))),
+    'arrow': ('arrows', 'application/vnd.apache.arrow.stream',
+              lambda u, p: _em_blocos(exportar_para_arrow(u, progresso=p)))
+}
+
+_EXECUTOR = ThreadPoolExecutor(max_workers=MAX_EXPORTACOES_SIMULTANEAS, thread_name_prefix='exportacao')
+_TAREFAS_LOCK = threading.Lock()
+_TAREFAS = {}
+
+def caminho_artefato(usuario_id, formato, versao):
+    extensao = FORMATOS[formato][0]
+    return os.path.join(DIRETORIO_EXPORTS, f"{usuario_id}_{formato}_v{versao}.{extensao}")
+
+def _remover_superados(usuario_id, formato, versao):
+    """Apaga artefatos do mesmo usuário/formato gerados para outra versão dos dados"""
+    atual = caminho_artefato(usuario_id, formato, versao)
+    extensao = FORMATOS[formato][0]
+    for caminho in glob.glob(os.path.join(DIRETORIO_EXPORTS, f"{usuario_id}_{formato}_v*.{extensao}")):
+        if caminho != atual:
+            try:
+                os.remove(caminho)
+            except OSError as e:
+                print(f"Erro ao remover exportação antiga {caminho}: {e}")
+
+def artefato_disponivel(usuario_id, formato, versao):
+    """Caminho do artefato já gerado para esta versão dos dados (ou None)"""
+    _remover_superados(usuario_id, formato, versao)
+    caminho = caminho_artefato(usuario_id, formato, versao)
+    return caminho if os.path.exists(caminho) else None
+
+def _executar(tarefa, usuario_id, formato, versao):
+    destino = caminho_artefato(usuario_id, formato, versao)
+    temporario = f"{destino}.tmp"
+
+    def progresso(linhas):
+        tarefa['linhas'] = linhas
+
+    try:
+        session = get_session()
+        try:
+            tarefa['total'] = session.query(Transacao.id).filter(Transacao.usuario_id == usuario_id).count()
+        finally:
+            session.close()
+        if not tarefa['total']:
+            tarefa['status'] = 'vazia'
+            return
+
+        os.makedirs(DIRETORIO_EXPORTS, exist_ok=True)
+        with open(temporario, 'wb') as arquivo:
+            for bloco in FORMATOS[formato][2](usuario_id, progresso):
+                arquivo.write(bloco)
+        os.replace(temporario, destino)
+        _remover_superados(usuario_id, formato, versao)
+        tarefa['status'] = 'concluida'
+    except Exception as e:
+        print(f"Erro na exportação em segundo plano ({formato}): {e}")
+        tarefa['status'] = 'erro'
+        tarefa['erro'] = str(e)
+        if os.path.exists(temporario):
+            os.remove(temporario)
+    finally:
+        tarefa['fim'] = time.time()
+
+def iniciar_exportacao(usuario_id, formato, versao=None):
+    """Enfileira a exportação (se ainda não houver uma igual em andamento) e retorna a tarefa"""
+    if versao is None:
+        versao = obter_versao_dados(usuario_id)
+    chave = (usuario_id, formato, versao)
+    with _TAREFAS_LOCK:
+        tarefa = _TAREFAS.get(chave)
+        if tarefa and tarefa['status'] == 'executando':
+            return tarefa
+        # Descarta tarefas de versões anteriores deste usuário/formato
+        for outra in [c for c in _TAREFAS if c[:2] == chave[:2] and c != chave]:
+            if _TAREFAS[outra]['status'] != 'executando':
+                del _TAREFAS[outra]
+        tarefa = {'status': 'executando', 'linhas': 0, 'total': None, 'erro': None,
+                  'inicio': time.time(), 'fim': None}
+        _TAREFAS[chave] = tarefa
+    _EXECUTOR.submit(_executar, tarefa, usuario_id, formato, versao)
+    return tarefa
+
+def obter_tarefa(usuario_id, formato, versao):
+    with _TAREFAS_LOCK:
+        return _TAREFAS.get((usuario_id, formato, versao))
+
+@st.fragment(run_every=INTERVALO_PROGRESSO)
+def _acompanhar_tarefa(usuario_id, formato, versao):
+    """Barra de progresso atualizada periodicamente até a tarefa terminar"""
+    tarefa = obter_tarefa(usuario_id, formato, versao)
+    if tarefa is None or tarefa['status'] != 'executando':
+        st.rerun()
+    total = tarefa['total']
+    if total:
+        fracao = min(tarefa['linhas'] / total, 1.0)
+        st.progress(fracao, text=f"Gerando... {tarefa['linhas']:,} de {total:,} transações".replace(',', '.'))
+    else:
+        st.progress(0.0, text="Preparando exportação...")
+
+def painel_exportacao(usuario_id, formato, rotulo_botao, nome_arquivo, icone=None):
+    """Botão de geração em segundo plano + download do artefato em cache
+
+    O artefato é reaproveitado enquanto a versão dos dados do usuário não
+    mudar; ao mudar, o arquivo anterior é descartado e um novo é gerado.
+    """
+    extensao, mime, _ = FORMATOS[formato]
+    versao = obter_versao_dados(usuario_id)
+    caminho = artefato_disponivel(usuario_id, formato, versao)
+
+    if caminho:
+        def ler_artefato():
+            # Chamado pelo Streamlit só no clique: os reruns da página não leem o arquivo
+            with open(caminho, 'rb') as arquivo:
+                return arquivo.read()
+
+        st.download_button(
+            label="⬇️ Baixar Arquivo",
+            data=ler_artefato,
+            file_name=f"{nome_arquivo}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{extensao}",
+            mime=mime,
+            use_container_width=True,
+            icon=icone,
+            key=f"baixar_{formato}"
+        )
+        gerado_em = datetime.fromtimestamp(os.path.getmtime(caminho)).strftime('%d/%m/%Y %H:%M')
+        st.caption(f"✅ Arquivo pronto (gerado em {gerado_em}); será refeito quando seus dados mudarem.")
+        return
+
+    tarefa = obter_tarefa(usuario_id, formato, versao)
+    if tarefa and tarefa['status'] == 'executando':
+        _acompanhar_tarefa(usuario_id, formato, versao)
+        return
+    if tarefa and tarefa['status'] == 'vazia':
+        st.error("❌ Nenhum dado disponível para exportar")
+    elif tarefa and tarefa['status'] == 'erro':
+        st.error(f"❌ Erro ao gerar arquivo: {tarefa['erro']}")
+
+    if st.button(rotulo_botao, use_container_width=True, type="primary", key=f"gerar_{formato}"):
+        iniciar_exportacao(usuario_id, formato, versao)
+        st.rerun()
+
+# Exportar funções
+__all__ = [
+    'FORMATOS',
+    'caminho_artefato',
+    'artefato_disponivel',
+    'iniciar_exportacao',
+    'obter_tarefa',
+    'painel_exportacao'
+]
@@ -0,0 +1,81 @@
+import sys
+import os
+import io
+import zipfile
+import tempfile
+import datetime
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+# Banco temporário: o teste não toca em data/database.db
+_DIRETORIO = tempfile.mkdtemp()
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(_DIRETORIO, 'teste.db')}"
+
+from database import get_session, Transacao
+from export import exportar_para_csv, iterar_csv, exportar_para_parquet, exportar_delta_csv, salvar_marca_exportacao, pq
+
+print("=== TESTE DE EXPORTAÇÃO ===")
+falhas = 0
+
+def verificar(condicao, mensagem):
+    global falhas
+    print(f"{'✅' if condicao else '❌'} {mensagem}")
+    if not condicao:
+        falhas += 1
+
+USUARIO_ID = 2
+session = get_session()
+# Inseridas fora da ordem de data: na ordem de id os meses se intercalam
+for dia in ['2024-01-05', '2024-02-10', '2024-01-20', '2024-03-01', '2024-02-28']:
+    session.add(Transacao(
+        usuario_id=USUARIO_ID, data=datetime.datetime.strptime(dia, '%Y-%m-%d'),
+        descricao=f'COMPRA {dia}', valor=-10.0, tipo='Débito', banco='Teste'
+    ))
+session.commit()
+total = session.query(Transacao).filter_by(usuario_id=USUARIO_ID).count()
+session.close()
+
+# CSV gravado em arquivo temporário (aqui já em disco, com limite de memória mínimo)
+arquivo = exportar_para_csv(USUARIO_ID, tamanho_memoria=64)
+verificar(arquivo is not None and arquivo.read() == b''.join(iterar_csv(USUARIO_ID)), "CSV em arquivo igual ao gerado em blocos")
+arquivo.close()
+verificar(exportar_para_csv(USUARIO_ID + 1) is None, "CSV sem transações retorna None")
+
+# Parquet particionado por mês: um membro por mês, todas as linhas legíveis pelo nome
+# (com nomes repetidos, só o último membro de cada nome é lido)
+if pq is None:
+    print("⚠️ pyarrow não instalado - Parquet particionado não testado")
+else:
+    dados = exportar_para_parquet(USUARIO_ID, particionar_por_mes=True)
+    verificar(dados is not None, "Parquet particionado gerado")
+    with zipfile.ZipFile(io.BytesIO(dados)) as zf:
+        nomes = zf.namelist()
+        verificar(len(nomes) == len(set(nomes)), f"Sem membros duplicados no ZIP ({len(nomes)} meses)")
+        verificar(sorted(nomes) == [f"mes=2024-0{m}/transacoes.parquet" for m in (1, 2, 3)], "Um arquivo por mês")
+        linhas = sum(pq.read_table(io.BytesIO(zf.read(nome))).num_rows for nome in set(nomes))
+    verificar(linhas == total, f"Linhas relidas do ZIP: {linhas} de {total}")
+
+# Delta: a marca só avança quando gravada, e linhas confirmadas depois com
+# updated_at anterior à marca (importação longa) ainda são entregues
+_, novas, marca = exportar_delta_csv(USUARIO_ID, 'teste')
+verificar(novas == total, f"Primeiro delta completo: {novas} de {total}")
+_, novas, _ = exportar_delta_csv(USUARIO_ID, 'teste')
+verificar(novas == total, "Delta não baixado volta inteiro")
+salvar_marca_exportacao('teste', USUARIO_ID, marca)
+_, novas, _ = exportar_delta_csv(USUARIO_ID, 'teste')
+verificar(novas == 0, "Sem alterações depois de gravar a marca")
+
+session = get_session()
+atrasada = Transacao(
+    usuario_id=USUARIO_ID, data=datetime.datetime(2024, 3, 15), descricao='COMPRA ATRASADA', valor=-5.0,
+    updated_at=marca[0] - datetime.timedelta(seconds=30)
+)
+session.add(atrasada)
+session.commit()
+id_atrasada = atrasada.id
+session.close()
+dados, _, _ = exportar_delta_csv(USUARIO_ID, 'teste')
+ids = [linha.split(';')[0] for linha in dados.decode('utf-8').splitlines()[1:]]
+verificar(str(id_atrasada) in ids, "Linha confirmada depois da marca é reenviada")
+
+print("=== FIM DO TESTE ===")
+sys.exit(1 if falhas else 0)